@@ -0,0 +1,34 @@
+"""Throughput on a directory of small scripts: one python -m Cup per script vs. one batch run.
+
+Both are timed as subprocesses from the Cup directory, so the batch run
+pays its own startup and pool start once.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+from Bench.common import WORKLOADS, measure, report
+
+
+SCRIPTS = 60
+
+
+def main():
+	with tempfile.TemporaryDirectory() as directory:
+		paths = []
+		for i in range(SCRIPTS):
+			name, source = WORKLOADS[i % len(WORKLOADS)]
+			paths.append(os.path.join(directory, f'{i}_{name}.cup'))
+			with open(paths[-1], 'w') as f: f.write(source)
+		def sequential():
+			for path in paths: subprocess.run([sys.executable, '-m', 'Cup', '--no-cache', path], check=True, stdout=subprocess.DEVNULL)
+		def batch(jobs):
+			summary = os.path.join(directory, 'summary.json')
+			subprocess.run([sys.executable, '-m', 'Cup', '--no-cache', '--jobs', str(jobs), '--summary', summary, directory], check=True)
+		print(f'{SCRIPTS} scripts, {os.cpu_count()} CPUs')
+		report('sequential', measure(sequential, repeat=1),
+			[(f'--jobs {jobs}', measure(lambda: batch(jobs), repeat=3)) for jobs in (1, 2, 4)])
+
+
+if __name__ == '__main__': main()
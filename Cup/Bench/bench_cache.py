@@ -0,0 +1,37 @@
+"""Cold start (lex, parse and optimize) against warm start (load from the .cupc cache)."""
+import os
+import subprocess
+import sys
+import tempfile
+
+from Cup.Cache import Cache
+from Cup.Interpreter import parse
+
+from Bench.bench_lexer import generate
+from Bench.common import WORKLOADS, measure, report
+
+
+def main():
+	with tempfile.TemporaryDirectory() as directory:
+		cache = Cache(directory)
+		sources = WORKLOADS + [('generated 1 MB', generate(1024 * 1024))]
+		print('parse             cold         warm')
+		for name, source in sources:
+			cold = measure(lambda: parse(source), repeat=3)
+			parse(source, cache=cache)
+			warm = measure(lambda: parse(source, cache=cache), repeat=3)
+			report(name, cold, [('warm', warm)])
+
+		# a whole run of the CLI, interpreter start-up included
+		path = os.path.join(directory, 'script.cup')
+		with open(path, 'w') as f: f.write(dict(WORKLOADS)['binary_search'])
+		env = dict(os.environ, CUP_CACHE_DIR=directory)
+		run = lambda *options: subprocess.run([sys.executable, '-m', 'Cup', *options, path], env=env, stdout=subprocess.DEVNULL, check=True)
+		cold = measure(lambda: run('--no-cache'), repeat=5)
+		run()
+		warm = measure(run, repeat=5)
+		print('process')
+		report('binary_search', cold, [('warm', warm)])
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,41 @@
+"""Builtin-heavy and call-heavy scripts on every backend."""
+from Cup import Compiler, Interpreter, Transpiler, VM
+
+from Bench.common import measure
+
+
+BUILTINS = '''total = 0
+i = 0
+while i < 20000:
+	total = total + abs(i - 100) + size(string(i)) + max([i, 7])
+	i = i + 1
+total
+'''
+
+CALLS = '''let add(a, b):
+	a + b
+let twice(x):
+	add(x, x)
+total = 0
+i = 0
+while i < 20000:
+	total = add(total, twice(i))
+	i = i + 1
+total
+'''
+
+SCRIPTS = [('builtins', BUILTINS), ('calls', CALLS)]
+
+
+def main():
+	backends = [('tree', Interpreter), ('closure', Compiler), ('python', Transpiler), ('vm', VM)]
+	print(f'{"":<10}' + ''.join(f'{name:>12}' for name, _ in backends))
+	for label, source in SCRIPTS:
+		cells = [f'{label:<10}']
+		for _, module in backends:
+			elapsed = measure(lambda: module.evaluate(source), repeat=3)
+			cells.append(f'{elapsed * 1000:9.2f} ms')
+		print(''.join(cells))
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,21 @@
+"""Tree walker vs. closure compiler on the shared workloads.
+
+Both sides get an already parsed program, so only evaluation is timed;
+the closure side is compiled once outside the timed region.
+"""
+from Cup import Compiler, Interpreter
+
+from Bench.common import WORKLOADS, measure, report
+
+
+def main():
+	print('workload          tree walker  closure compiler')
+	for name, source in WORKLOADS:
+		program = Interpreter.parse(source)
+		run = Compiler.compile_program(program)
+		tree = measure(lambda: Interpreter.eval_statements(program.body, Interpreter.create_global_env()))
+		closure = measure(lambda: run(Interpreter.create_global_env()))
+		report(name, tree, [('closure', closure)])
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,47 @@
+"""Loops and calls that stop blocks early: tree walker and closure compiler.
+
+Compare runs of this script across revisions; the second column is the
+closure compiler's time and its speedup over the tree walker.
+"""
+from Cup import Compiler, Interpreter
+
+from Bench.common import WORKLOADS, measure, report
+
+
+# continue and skip on every iteration
+LOOPS = '''total = 0
+i = 0
+while i < 20000:
+	i = i + 1
+	if i % 2 == 0:
+		skip
+	total = total + i
+	continue
+total
+'''
+
+# an explicit return from every call
+CALLS = '''let square(x):
+	return x * x
+total = 0
+i = 0
+while i < 10000:
+	total = total + square(i)
+	i = i + 1
+total
+'''
+
+
+def main():
+	print('workload          tree         closure')
+	for name, source in WORKLOADS + [('loops', LOOPS), ('calls', CALLS)]:
+		program = Interpreter.parse(source)
+		def tree():
+			env = Interpreter.create_global_env()
+			Interpreter.eval_statements(Interpreter.resolve(program, env).body, env)
+		def closure():
+			Compiler.compile_program(program)(Interpreter.create_global_env())
+		report(name, measure(tree), [('closure', measure(closure))])
+
+
+if __name__ == '__main__': main()
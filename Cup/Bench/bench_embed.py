@@ -0,0 +1,36 @@
+"""One Embed.compile followed by N runs, against N calls to evaluate."""
+from Cup import Compiler, Embed, Interpreter, Transpiler, VM
+
+from Bench.common import measure, report
+
+
+# a small rule evaluated against many inputs, as a service would
+RULE = '''let score(amount, days):
+	if days > 30:
+		return amount * 2
+	return amount + days
+result = 0
+i = 0
+while i < 10:
+	result = result + score(amount, i * 5)
+	i = i + 1
+result
+'''
+
+RUNS = 1000
+
+
+def main():
+	evaluators = {'tree': Interpreter, 'closure': Compiler, 'python': Transpiler, 'vm': VM}
+	print(f'{RUNS} runs          evaluate       compile once')
+	for backend, module in evaluators.items():
+		source = f'amount = 7\n{RULE}'
+		def evaluate_each():
+			for _ in range(RUNS): module.evaluate(source)
+		def compile_once():
+			program = Embed.compile(RULE, backend)
+			for amount in range(RUNS): program.run({'amount': amount})
+		report(backend, measure(evaluate_each, repeat=3), [('embed', measure(compile_once, repeat=3))])
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,41 @@
+"""Cost of a fresh global environment: the builtins added to every one, against one shared Builtins frame."""
+import tracemalloc
+
+from Cup import Interpreter
+
+from Bench.common import measure, report
+
+
+ENVS = 10000
+
+
+def copied_env():
+	"""A global environment as built before the shared builtins frame."""
+	env = Interpreter.Environment()
+	Interpreter.add_builtins(env)
+	return env
+
+
+def retained(func):
+	"""Bytes still allocated by ENVS results of `func`."""
+	tracemalloc.start()
+	envs = [func() for _ in range(ENVS)]
+	size = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	del envs
+	return size
+
+
+def main():
+	def create(func):
+		return lambda: [func() for _ in range(ENVS)]
+	print(f'{ENVS} environments')
+	report('create', measure(create(copied_env), repeat=3), [('shared', measure(create(Interpreter.create_global_env), repeat=3))])
+	for label, func in [('copied', copied_env), ('shared', Interpreter.create_global_env)]:
+		print(f'{label:<16}  {retained(func) / ENVS:9.1f} bytes/env')
+	# a tiny script, where setting up the environment used to dominate
+	report('evaluate', measure(create(lambda: Interpreter.evaluate_env('1 + 2', copied_env())), repeat=3),
+		[('shared', measure(create(lambda: Interpreter.evaluate('1 + 2')), repeat=3))])
+
+
+if __name__ == '__main__': main()
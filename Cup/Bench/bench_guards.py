@@ -0,0 +1,49 @@
+"""Guard-heavy loops: a cheap test guarding a costly one, and membership in a set, a map and a list."""
+from Cup import Compiler, Interpreter, Transpiler, VM
+
+from Bench.common import measure
+
+
+GUARDS = '''items = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+found = 0
+i = 0
+while i < 20000:
+	if i % 10 == 0 and sum(items) == 55:
+		found = found + 1
+	if i % 10 != 0 | size(string(i * i)) > 100:
+		found = found + 1
+	i = i + 1
+found
+'''
+
+MEMBERSHIP = '''keys = list(limit(0, 500))
+table = set(keys)
+map = dict(merge(keys, keys))
+found = 0
+i = 0
+while i < 5000:
+	if i in table:
+		found = found + 1
+	if i not in map:
+		found = found + 1
+	if i in keys:
+		found = found + 1
+	i = i + 1
+found
+'''
+
+SCRIPTS = [('guards', GUARDS), ('membership', MEMBERSHIP)]
+
+
+def main():
+	backends = [('tree', Interpreter), ('closure', Compiler), ('python', Transpiler), ('vm', VM)]
+	print(f'{"":<12}' + ''.join(f'{name:>12}' for name, _ in backends))
+	for label, source in SCRIPTS:
+		cells = [f'{label:<12}']
+		for _, module in backends:
+			elapsed = measure(lambda: module.evaluate(source), repeat=3)
+			cells.append(f'{elapsed * 1000:9.2f} ms')
+		print(''.join(cells))
+
+
+if __name__ == '__main__': main()
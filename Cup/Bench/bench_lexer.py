@@ -0,0 +1,52 @@
+"""Lexer throughput in MB/s on a few megabytes of Cup source, from a str and from an mmap'd file,
+and the memory held by a Token list against a TokenBuffer."""
+import os
+import tempfile
+import tracemalloc
+
+from Cup.Lexer import Lexer, open_source
+
+from Bench.common import WORKLOADS, measure
+
+
+def generate(size):
+	"""The workloads repeated until the source is about `size` bytes long."""
+	chunk = '\n'.join(source for _, source in WORKLOADS)
+	return chunk * (size // len(chunk) + 1)
+
+
+def retained(func):
+	"""Bytes still allocated by the result of `func`."""
+	tracemalloc.start()
+	result = func()
+	size = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	del result
+	return size
+
+
+def main():
+	source = generate(4 * 1024 * 1024)
+	megabytes = len(source.encode('utf-8')) / (1024 * 1024)
+	with tempfile.NamedTemporaryFile('w', suffix='.cup', delete=False) as f:
+		f.write(source)
+	try:
+		elapsed = measure(lambda: Lexer().tokenize(source), repeat=3)
+		print(f'str       {megabytes:6.2f} MB  {elapsed * 1000:9.2f} ms  {megabytes / elapsed:6.2f} MB/s')
+		with open_source(f.name) as buffer:
+			elapsed = measure(lambda: Lexer().tokenize(buffer), repeat=3)
+		print(f'mmap      {megabytes:6.2f} MB  {elapsed * 1000:9.2f} ms  {megabytes / elapsed:6.2f} MB/s')
+		elapsed = measure(lambda: sum(1 for _ in Lexer().iter_tokens(source)), repeat=3)
+		print(f'streamed  {megabytes:6.2f} MB  {elapsed * 1000:9.2f} ms  {megabytes / elapsed:6.2f} MB/s')
+		elapsed = measure(lambda: Lexer().tokenize_buffer(source), repeat=3)
+		print(f'buffer    {megabytes:6.2f} MB  {elapsed * 1000:9.2f} ms  {megabytes / elapsed:6.2f} MB/s')
+	finally:
+		os.remove(f.name)
+
+	count = len(Lexer().tokenize_buffer(source))
+	for label, func in [('Token list', lambda: Lexer().tokenize(source)), ('TokenBuffer', lambda: Lexer().tokenize_buffer(source))]:
+		size = retained(func)
+		print(f'{label:<12}  {count} tokens  {size / (1024 * 1024):7.2f} MB  {size / count:6.1f} bytes/token')
+
+
+if __name__ == '__main__': main()
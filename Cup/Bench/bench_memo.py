@@ -0,0 +1,35 @@
+"""Recursive dynamic programming with and without memo()."""
+from Cup import Compiler, Interpreter, Transpiler, VM
+
+from Bench.common import measure, report
+
+
+FIB = '''let fib(n):
+	if n < 2:
+		return n
+	return fib(n - 1) + fib(n - 2)
+MEMO
+fib(20)
+'''
+
+PATHS = '''let paths(x, y):
+	if x * y == 0:
+		return 1
+	return paths(x - 1, y) + paths(x, y - 1)
+MEMO
+paths(8, 8)
+'''
+
+WORKLOADS = [('fib', FIB, 'fib = memo(fib)'), ('paths', PATHS, 'paths = memo(paths)')]
+
+
+def main():
+	backends = [('tree', Interpreter), ('closure', Compiler), ('python', Transpiler), ('vm', VM)]
+	for name, source, wrap in WORKLOADS:
+		plain, memoized = source.replace('MEMO\n', ''), source.replace('MEMO', wrap)
+		for backend, module in backends:
+			report(f'{name} {backend}', measure(lambda: module.evaluate(plain), repeat=3),
+				[('memo', measure(lambda: module.evaluate(memoized), repeat=3))])
+
+
+if __name__ == '__main__': main()
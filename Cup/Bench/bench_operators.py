@@ -0,0 +1,59 @@
+"""Operators in isolation: tree walker vs. closure compiler.
+
+Every binary and unary operator of Cup.Operators is timed on each kind of
+operand it accepts.
+"""
+from Cup import AST, Compiler, Interpreter
+from Cup.Operators import short_circuits, simple_operations, unary_operations
+
+from Bench.common import WORKLOADS, measure, report
+
+
+OPERANDS = [('int', 7, 3), ('float', 7.5, 2.5), ('str', 'ab', 'cd'), ('list', [1, 2], [2, 3])]
+
+
+def _accepts(op, *operands):
+	try: op(*operands)
+	except (TypeError, ValueError): return False
+	return True
+
+
+def _time(name, node, env):
+	compiled = Compiler.compile_node(node)
+	eval_expression = Interpreter.eval_expression
+	def tree():
+		for _ in range(100000): eval_expression(node, env)
+	def closure():
+		for _ in range(100000): compiled(env)
+	report(name, measure(tree), [('closure', measure(closure))])
+
+
+def main():
+	print('workload          tree         closure')
+	for name, source in WORKLOADS:
+		program = Interpreter.parse(source)
+		def tree():
+			env = Interpreter.create_global_env()
+			Interpreter.eval_statements(Interpreter.resolve(program, env).body, env)
+		def closure():
+			Compiler.compile_program(program)(Interpreter.create_global_env())
+		report(name, measure(tree), [('closure', measure(closure))])
+
+	# one operator site evaluated 100k times with identifier operands
+	print()
+	print('operator          tree         closure')
+	for type_name, left, right in OPERANDS:
+		env = Interpreter.create_global_env()
+		env.set('a', left)
+		env.set('b', right)
+		for operator, op in simple_operations.items():
+			if not _accepts(op, left, right): continue
+			_time(f'{type_name} {operator}', AST.BinaryOperator(operator, AST.Identifier('a'), AST.Identifier('b')), env)
+		for operator in short_circuits:
+			_time(f'{type_name} {operator}', AST.BinaryOperator(operator, AST.Identifier('a'), AST.Identifier('b')), env)
+		for operator, op in unary_operations.items():
+			if not _accepts(op, left): continue
+			_time(f'{type_name} unary {operator}', AST.UnaryOperatorPrefix(operator, AST.Identifier('a')), env)
+
+
+if __name__ == '__main__': main()
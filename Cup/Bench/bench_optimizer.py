@@ -0,0 +1,48 @@
+"""Every backend with and without the Optimizer."""
+from Cup import Compiler, Interpreter, VM
+
+from Bench.common import WORKLOADS, measure, report
+
+
+# constant subexpressions and dead branches inside a hot loop
+CONSTANT = '''total = 0
+i = 0
+while i < 20000:
+	if false:
+		total = 0
+	elif 60 * 60 * 24 > 0:
+		total = total + i % (2 ^ 10) * (3 + 4)
+	"unused"
+	i = i + 1
+total
+'''
+
+# a counting loop with an invariant bound and index arithmetic
+COUNTING = '''let smooth(values, width):
+	result = []
+	i = 0
+	n = size(values)
+	while i < n - 2:
+		add((values[i] + values[i + 1] + values[i + 2]) * width \\ (width * 3), result)
+		i = i + 1
+	result
+data = []
+i = 0
+while i < 5000:
+	add(i % 17, data)
+	i = i + 1
+size(smooth(data, 4))
+'''
+
+
+def main():
+	backends = [('tree', Interpreter.evaluate), ('closure', Compiler.evaluate), ('vm', VM.evaluate)]
+	print('workload          unoptimized  optimized')
+	for name, source in WORKLOADS + [('constant', CONSTANT), ('counting', COUNTING)]:
+		for backend, evaluate in backends:
+			report(f'{name} {backend}', measure(lambda: evaluate(source, optimize=False)), [
+				('optimized', measure(lambda: evaluate(source))),
+			])
+
+
+if __name__ == '__main__': main()
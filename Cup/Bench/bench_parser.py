@@ -0,0 +1,35 @@
+"""Parser throughput on a few megabytes of generated Cup source, from an already lexed TokenBuffer,
+and parse time against nesting depth."""
+from Cup.Lexer import Lexer, TokenStream
+from Cup.Parser import Parser
+
+from Bench.bench_lexer import generate
+from Bench.common import measure
+
+
+NESTED = [
+	('terms', lambda n: ' + '.join(['1'] * n)),
+	('lists', lambda n: '[' * n + ']' * n),
+	('groups', lambda n: '(' * n + '1' + ')' * n),
+]
+
+
+def main():
+	for size in (1, 4):
+		source = generate(size * 1024 * 1024)
+		megabytes = len(source.encode('utf-8')) / (1024 * 1024)
+		tokens = Lexer().tokenize_buffer(source)
+		elapsed = measure(lambda: Parser().parse(TokenStream(tokens)), repeat=3)
+		print(f'{megabytes:6.2f} MB  {len(tokens):8} tokens  {elapsed * 1000:9.2f} ms  '
+			f'{megabytes / elapsed:6.2f} MB/s  {len(tokens) / elapsed / 1000:7.1f}k tokens/s')
+
+	for name, generate_nested in NESTED:
+		cells = [f'{name:<8}']
+		for depth in (10 ** 3, 10 ** 4, 10 ** 5):
+			tokens = Lexer().tokenize_buffer(generate_nested(depth))
+			elapsed = measure(lambda: Parser().parse(TokenStream(tokens)), repeat=3)
+			cells.append(f'{depth:>7}: {elapsed * 1000:8.2f} ms')
+		print('  '.join(cells))
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,41 @@
+"""A CPU-bound map over 64 items: map in the main process vs. pmap on 1, 2 and 4 workers.
+
+Each pool is started and warmed up before it is timed. The speedup is
+bounded by the CPUs of the machine (printed first).
+"""
+import os
+
+from Cup import Compiler, Interpreter, Parallel, Transpiler, VM
+
+from Bench.common import measure, report
+
+
+SOURCE = '''let work(n):
+	total = 0
+	i = 0
+	while i < 5000:
+		total = total + i * n % 7
+		i = i + 1
+	total
+sum(list(MAP([0;64), work, 4)))
+'''
+
+WORKERS = (1, 2, 4)
+
+
+def main():
+	backends = [('tree', Interpreter), ('closure', Compiler), ('python', Transpiler), ('vm', VM)]
+	serial = SOURCE.replace(', 4)))', ')))').replace('MAP', 'map')
+	parallel = SOURCE.replace('MAP', 'pmap')
+	print(f'{os.cpu_count()} CPUs')
+	for backend, module in backends:
+		timings = []
+		for workers in WORKERS:
+			Parallel.set_workers(workers)
+			module.evaluate(parallel)
+			timings.append((f'{workers} workers', measure(lambda: module.evaluate(parallel), repeat=3)))
+		report(backend, measure(lambda: module.evaluate(serial), repeat=3), timings)
+	Parallel.set_workers()
+
+
+if __name__ == '__main__': main()
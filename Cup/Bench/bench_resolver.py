@@ -0,0 +1,46 @@
+"""Tree walker with name lookups vs. resolved (depth, slot) addresses."""
+from Cup import AST, Interpreter
+from Cup.Resolver import Layout, resolve
+
+from Bench.common import WORKLOADS, measure, report
+
+
+LOCALS = '''let work(n):
+	a = 1
+	b = 2
+	total = 0
+	i = 0
+	while i < n:
+		total = total + a * b + i
+		i = i + 1
+	total
+work(20000)
+'''
+
+
+def main():
+	print('workload          by name      resolved')
+	for name, source in WORKLOADS + [('locals', LOCALS)]:
+		program = Interpreter.parse(source)
+		def by_name():
+			Interpreter.eval_statements(program.body, Interpreter.create_global_env())
+		def resolved():
+			env = Interpreter.create_global_env()
+			Interpreter.eval_statements(resolve(program, env).body, env)
+		report(name, measure(by_name), [('resolved', measure(resolved))])
+
+	# a single variable read, 100k times, from the innermost of three frames
+	print()
+	print('read              by name      resolved')
+	env = Interpreter.Environment(Interpreter.Environment(Interpreter.create_global_env()), layout=Layout(['i']))
+	env.set('i', 1)
+	env._parent.set('i', 2)
+	by_name = AST.Identifier('i')
+	resolved = AST.Identifier('i', (0, 0))
+	def read(node):
+		eval_identifier = Interpreter.eval_identifier
+		return lambda: [eval_identifier(node, env) for _ in range(100000)]
+	report('local', measure(read(by_name)), [('resolved', measure(read(resolved)))])
+
+
+if __name__ == '__main__': main()
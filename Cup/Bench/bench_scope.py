@@ -0,0 +1,29 @@
+"""Per-call cost of a recursive function that reads a global and a builtin
+at every level. With lexical scoping it should not grow with the depth.
+"""
+import sys
+
+from Cup import Interpreter
+
+from Bench.common import measure
+
+
+RECURSE = '''data = [1, 2, 3]
+let down(n):
+	if n == 0:
+		return 0
+	return down(n - 1) + size(data)
+'''
+
+
+def main():
+	sys.setrecursionlimit(100000)
+	env = Interpreter.create_global_env()
+	Interpreter.evaluate_env(RECURSE, env)
+	print('depth   per call')
+	for depth in (25, 50, 100, 200, 400):
+		elapsed = measure(lambda: Interpreter.evaluate_env(f'down({depth})', env))
+		print(f'{depth:5}   {elapsed / depth * 1e6:8.2f} us')
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,63 @@
+"""A line-processing pipeline over a generated file: lazy streams vs. lists.
+
+Prints the time and the peak memory traced while the script runs, once with
+every stage materialized as a list and once through lines/map/filter/chunk.
+"""
+import os
+import tempfile
+import tracemalloc
+
+from Cup import Compiler, Interpreter, Transpiler, VM
+
+from Bench.common import measure
+
+
+LINES = 200000
+
+EAGER = '''let value(line):
+	int(split(line, ',')[1])
+let large(n):
+	n > 500
+total = 0
+for part in chunk(list(filter(list(map(list(lines(PATH)), value)), large)), 1000):
+	total = total + max(part)
+total
+'''
+
+LAZY = '''let value(line):
+	int(split(line, ',')[1])
+let large(n):
+	n > 500
+total = 0
+for part in chunk(filter(map(lines(PATH), value), large), 1000):
+	total = total + max(part)
+total
+'''
+
+
+def traced_peak(func):
+	tracemalloc.start()
+	try:
+		func()
+		return tracemalloc.get_traced_memory()[1]
+	finally: tracemalloc.stop()
+
+
+def main():
+	backends = [('tree', Interpreter), ('closure', Compiler), ('python', Transpiler), ('vm', VM)]
+	with tempfile.TemporaryDirectory() as directory:
+		path = os.path.join(directory, 'data.csv')
+		with open(path, 'w') as f:
+			for i in range(LINES): f.write(f'row{i},{i * 7919 % 1000}\n')
+		scripts = [(label, source.replace('PATH', repr(path))) for label, source in (('lists', EAGER), ('streams', LAZY))]
+		print(f'{LINES} lines')
+		for backend, module in backends:
+			cells = [f'{backend:<8}']
+			for label, source in scripts:
+				elapsed = measure(lambda: module.evaluate(source), repeat=3)
+				peak = traced_peak(lambda: module.evaluate(source))
+				cells.append(f'{label} {elapsed * 1000:8.2f} ms {peak / 1024:9.0f} KiB')
+			print('  '.join(cells))
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,46 @@
+"""I/O-bound fan-out: subprocesses and file reads waited for one by one vs. gathered."""
+import os
+import tempfile
+
+from Cup import Compiler, Interpreter, Transpiler, VM
+
+from Bench.common import measure, report
+
+
+JOBS = 20
+
+SERIAL = '''sync let main(commands, paths):
+	outputs = []
+	for command in commands:
+		output = wait spawn(command)
+		add(output, outputs)
+	for path in paths:
+		text = wait readfile(path)
+		add(text, outputs)
+	size(outputs)
+runsync(main(COMMANDS, PATHS))
+'''
+
+GATHERED = '''sync let main(commands, paths):
+	outputs = wait gather(list(map(commands, spawn)) + list(map(paths, readfile)))
+	size(outputs)
+runsync(main(COMMANDS, PATHS))
+'''
+
+
+def main():
+	backends = [('tree', Interpreter), ('closure', Compiler), ('python', Transpiler), ('vm', VM)]
+	with tempfile.TemporaryDirectory() as directory:
+		paths = []
+		for i in range(JOBS):
+			paths.append(os.path.join(directory, f'{i}.txt'))
+			with open(paths[-1], 'w') as f: f.write('x' * 100000)
+		commands = [f'sleep 0.05; echo {i}' for i in range(JOBS)]
+		def script(source): return source.replace('COMMANDS', repr(commands)).replace('PATHS', repr(paths))
+		print(f'{JOBS} commands sleeping 50 ms and {JOBS} file reads')
+		for backend, module in backends:
+			report(backend, measure(lambda: module.evaluate(script(SERIAL)), repeat=3),
+				[('gather', measure(lambda: module.evaluate(script(GATHERED)), repeat=3))])
+
+
+if __name__ == '__main__': main()
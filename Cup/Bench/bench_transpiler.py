@@ -0,0 +1,25 @@
+"""Tree walker vs. closure compiler vs. Python transpiler on the shared workloads.
+
+Every backend gets an already parsed program; compilation happens once,
+outside the timed region.
+"""
+from Cup import Compiler, Interpreter, Transpiler
+
+from Bench.common import WORKLOADS, measure, report
+
+
+def main():
+	print('workload          tree walker  alternatives')
+	for name, source in WORKLOADS:
+		program = Interpreter.parse(source)
+		closure = Compiler.compile_program(program)
+		code = Transpiler.compile_program(program)
+		timings = [
+			('closure', measure(lambda: closure(Interpreter.create_global_env()))),
+			('python', measure(lambda: Transpiler.run(code, Interpreter.create_global_env()))),
+		]
+		tree = measure(lambda: Interpreter.eval_statements(program.body, Interpreter.create_global_env()))
+		report(name, tree, timings)
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,27 @@
+"""Tree walker vs. bytecode VM on the shared workloads, plus the cost of
+loading serialized bytecode compared with lexing and parsing the source.
+"""
+from Cup import Bytecode, Interpreter, VM
+
+from Bench.common import WORKLOADS, measure, report
+
+
+def main():
+	print('workload          tree walker  bytecode VM')
+	for name, source in WORKLOADS:
+		program = Interpreter.parse(source)
+		code = Bytecode.compile_program(program)
+		tree = measure(lambda: Interpreter.eval_statements(program.body, Interpreter.create_global_env()))
+		vm = measure(lambda: VM.run(code, Interpreter.create_global_env()))
+		report(name, tree, [('vm', vm)])
+
+	print()
+	print('startup           parse source  load bytecode')
+	for name, source in WORKLOADS:
+		data = Bytecode.dumps(Bytecode.compile_program(Interpreter.parse(source)))
+		parse = measure(lambda: Interpreter.parse(source), repeat=50)
+		load = measure(lambda: Bytecode.loads(data), repeat=50)
+		report(name, parse, [('load', load)])
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,81 @@
+"""Shared workloads and timing helpers for the benchmarks in this directory.
+
+Run a benchmark from the Cup directory, e.g. ``python -m Bench.bench_compiler``.
+"""
+import time
+
+
+BINARY_SEARCH = '''let BinarySearch(array, low, high, key):
+	while low <= high:
+		mid = low + (high - low)\\2
+		if array[mid] == key:
+			return mid
+		elif array[mid] > key:
+			high = mid - 1
+		else:
+			low = mid + 1
+	return -1
+
+array = [1,2,3,4,5,6,7,8,9]
+round = 0
+found = 0
+while round < 300:
+	key = 0
+	while key <= 10:
+		if BinarySearch(array, 0, 8, key) != -1:
+			found = found + 1
+		key = key + 1
+	round = round + 1
+found
+'''
+
+FIB = '''let fib(n):
+	if n < 2:
+		return n
+	return fib(n - 1) + fib(n - 2)
+fib(18)
+'''
+
+SIEVE = '''n = 20000
+sieve = []
+i = 0
+while i <= n:
+	add(1, sieve)
+	i = i + 1
+count = 0
+i = 2
+while i <= n:
+	if sieve[i] == 1:
+		count = count + 1
+		j = i * i
+		while j <= n:
+			sieve[j] = 0
+			j = j + i
+	i = i + 1
+count
+'''
+
+WORKLOADS = [
+	('binary_search', BINARY_SEARCH),
+	('fib', FIB),
+	('sieve', SIEVE),
+]
+
+
+def measure(func, repeat=5):
+	"""Best wall-clock time of ``repeat`` calls to ``func``, in seconds."""
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		func()
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best: best = elapsed
+	return best
+
+
+def report(name, baseline, timings):
+	"""Print one row: the baseline time and each alternative with its speedup."""
+	cells = [f'{name:<16}', f'{baseline * 1000:9.2f} ms']
+	for label, elapsed in timings:
+		cells.append(f'{label} {elapsed * 1000:9.2f} ms ({baseline / elapsed:5.2f}x)')
+	print('  '.join(cells))
@@ -2,17 +2,19 @@
 
 from collections import namedtuple
 
+from Cup.Errors import arity_error
+
 Number = namedtuple('Number', ['value'])
 String = namedtuple('String', ['value'])
-Logic = namedtuple('Logic', ['value']) # not yet
-Identifier = namedtuple('Identifier', ['value'])
+Logic = namedtuple('Logic', ['value']) # True, False or None
+Identifier = namedtuple('Identifier', ['value', 'address'], defaults=[None]) # address: (depth, slot) from Resolver
 Assignment = namedtuple('Assignment', ['left', 'right'])
 BinaryOperator = namedtuple('BinaryOperator', ['operator', 'left', 'right'])
 UnaryOperatorPrefix = namedtuple('UnaryOperatorPrefix', ['operator', 'right'])
 UnaryOperatorPostfix = namedtuple('UnaryOperatorPostfix', ['operator', 'left']) # not yet
 Class = namedtuple('Class', ['name', 'body'])
-Function = namedtuple('Function', ['name', 'params', 'body'])
-CallFunction = namedtuple('CallFunction', ['left', 'arguments'])
+Function = namedtuple('Function', ['name', 'params', 'body', 'layout', 'defaults', 'generator', 'sync'], defaults=[None, (), False, False]) # layout: frame slots from Resolver; defaults: expressions for the last params; generator: the body runs as a generator (it throws, or the function is sync)
+CallFunction = namedtuple('CallFunction', ['left', 'arguments', 'line', 'column'], defaults=[None, None]) # line, column: of its `(`, for errors found before it runs
 CallClass = namedtuple('CallClass', ['left', 'arguments'])
 Condition = namedtuple('Condition', ['test', 'if_body', 'elifs', 'else_body'])
 ConditionElif = namedtuple('ConditionElif', ['test', 'body'])
@@ -23,16 +25,47 @@ When = namedtuple('When', ['test', 'patterns', 'else_body'])
 WhenPattern = namedtuple('WhenPattern', ['pattern', 'body'])
 WhileLoop = namedtuple('WhileLoop', ['test', 'body', 'else_body'])
 ForLoop = namedtuple('ForLoop', ['var_name', 'collection', 'body'])
+# a counting while loop, from the Optimizer: var_name steps by `step` towards `stop`;
+# backends without native support run `loop`, the WhileLoop it replaces
+RangeLoop = namedtuple('RangeLoop', ['var_name', 'stop', 'inclusive', 'step', 'derived', 'body', 'else_body', 'loop'])
+InductionVariable = namedtuple('InductionVariable', ['name', 'scale', 'offset']) # name = var_name * scale + offset
 Quit = namedtuple('Quit', [])
 Continue = namedtuple('Continue', [])
 Skip = namedtuple('Skip', [])
 Return = namedtuple('Return', ['value'])
 Throw = namedtuple('Throw', ['value'])
+Wait = namedtuple('Wait', ['value']) # in a sync function: a statement, the value of an assignment or of a return
 List = namedtuple('List', ['items'])
 Packs = namedtuple('Packs', ['items']) # not yet
 Set = namedtuple('Set', ['items']) # not yet
 Shell = namedtuple('Shell', ['items'])
 Dictionary = namedtuple('Dictionary', ['items'])
+Range = namedtuple('Range', ['start', 'stop', 'step', 'closed_start', 'closed_stop']) # [start;stop;step), step may be None
 SubscriptOperator = namedtuple('SubscriptOperator', ['left', 'key'])
-BuiltinFunction = namedtuple('BuiltinFunction', ['params', 'body'])
+Closure = namedtuple('Closure', ['params', 'function', 'env', 'defaults'], defaults=[()]) # function value: declaration + defining environment + default values
 Program = namedtuple('Program', ['body'])
+
+
+def bind_arguments(function, args):
+	"""`args` (a list) completed with the defaults of `function`, a builtin or a user function.
+
+	Raises TypeError when the number of arguments does not fit the parameters.
+	"""
+	n_params = len(function.params)
+	n_args = len(args)
+	if n_args != n_params:
+		defaults = function.defaults
+		if n_args > n_params or n_args < n_params - len(defaults): raise arity_error(function.params, defaults, n_args)
+		args.extend(defaults[n_args - n_params + len(defaults):])
+	return args
+
+
+class BuiltinFunction(namedtuple('BuiltinFunction', ['params', 'body', 'defaults'], defaults=[()])):
+	"""A function implemented in Python: `body` takes the arguments positionally.
+
+	Python code can call it directly, defaults and arity check included.
+	"""
+
+	__slots__ = ()
+
+	def __call__(self, *args): return self.body(*bind_arguments(self, list(args)))
@@ -0,0 +1,103 @@
+"""Run many Cup scripts in a pool of worker processes: python -m Cup --jobs N dir/ a.cup ...
+
+Each worker imports Cup once and runs script after script, each in its own
+global environment (see Embed), with its output captured and a time limit.
+run_batch returns a summary, one entry per script in the order given:
+
+	{"path": "a.cup", "status": "ok", "result": "42", "stdout": "...", "error": null, "seconds": 0.01}
+
+status is "ok", "error" (a syntax or run-time error), "timeout", or
+"crashed" when the worker process died under the script.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import contextlib
+import io
+import os
+import signal
+import time
+
+from Cup import Embed
+from Cup.Cache import Cache
+from Cup.Errors import CupSyntaxError
+from Cup.Lexer import open_source
+
+
+EXTENSIONS = ('.cup', '.cp', '.u')
+
+
+class Timeout(BaseException):
+	"""Raised in a script that runs past its time limit; a do block cannot catch it."""
+
+
+def _expire(signum, frame): raise Timeout()
+
+
+def find_scripts(paths):
+	"""`paths` with every directory replaced by the Cup scripts under it, sorted."""
+	scripts = []
+	for path in paths:
+		if not os.path.isdir(path):
+			scripts.append(path)
+			continue
+		for directory, _, names in sorted(os.walk(path)):
+			scripts.extend(os.path.join(directory, name) for name in sorted(names) if name.endswith(EXTENSIONS))
+	return scripts
+
+
+def run_script(path, backend='tree', timeout=None, optimize=True, tail_calls=False, cache=True):
+	"""Run the script at `path` in a fresh global environment; its summary entry."""
+	entry = {'path': path, 'status': 'ok', 'result': None, 'stdout': '', 'error': None}
+	output = io.StringIO()
+	# the timer needs SIGALRM, so there is no time limit on Windows
+	timed = timeout is not None and hasattr(signal, 'setitimer')
+	if timed: signal.signal(signal.SIGALRM, _expire)
+	start = time.perf_counter()
+	try:
+		with contextlib.redirect_stdout(output):
+			if timed: signal.setitimer(signal.ITIMER_REAL, timeout)
+			try:
+				with open_source(path) as source:
+					program = Embed.compile(source, backend, optimize, tail_calls, Cache() if cache else None)
+				value = program.run()
+			finally:
+				if timed: signal.setitimer(signal.ITIMER_REAL, 0)
+		if value is not None: entry['result'] = str(value)
+	except Timeout:
+		entry['status'], entry['error'] = 'timeout', f'Ran for more than {timeout} s'
+	except CupSyntaxError as e:
+		entry['status'], entry['error'] = 'error', f'{e.mess} at {e.ln}:{e.col}'
+	except Exception as e:
+		entry['status'], entry['error'] = 'error', f'{type(e).__name__}: {e}'
+	entry['seconds'] = time.perf_counter() - start
+	entry['stdout'] = output.getvalue()
+	return entry
+
+
+def run_batch(paths, jobs=None, timeout=None, backend='tree', optimize=True, tail_calls=False, cache=True):
+	"""Run the scripts in `paths` (files and directories) on `jobs` workers (None: one per CPU).
+
+	A script that kills its worker breaks the pool under the scripts running
+	with it; those are run again one at a time, each in a worker of its own.
+	"""
+	scripts = find_scripts(paths)
+	options = (backend, timeout, optimize, tail_calls, cache)
+	entries = [None] * len(scripts)
+	start = time.perf_counter()
+	broken = []
+	with ProcessPoolExecutor(jobs) as pool:
+		futures = [pool.submit(run_script, script, *options) for script in scripts]
+		for i, future in enumerate(futures):
+			try: entries[i] = future.result()
+			except BrokenProcessPool: broken.append(i)
+	for i in broken:
+		with ProcessPoolExecutor(1) as pool:
+			try: entries[i] = pool.submit(run_script, scripts[i], *options).result()
+			except BrokenProcessPool:
+				entries[i] = {'path': scripts[i], 'status': 'crashed', 'result': None, 'stdout': '', 'error': 'The worker process died', 'seconds': None}
+	counts = {}
+	for entry in entries: counts[entry['status']] = counts.get(entry['status'], 0) + 1
+	return {
+		'jobs': jobs or os.cpu_count(), 'backend': backend, 'seconds': time.perf_counter() - start,
+		'counts': counts, 'scripts': entries,
+	}
@@ -0,0 +1,556 @@
+from __future__ import print_function
+from array import array
+from collections import namedtuple
+import marshal
+
+from Cup import AST
+from Cup.Operators import make_range, simple_operations, lazy_operations, short_circuits, unary_operations
+from Cup.Resolver import function_layout
+
+
+MAGIC = b'CUPB'
+VERSION = 9
+
+OPNAMES = (
+	'LOAD_CONST', 'LOAD_NAME', 'STORE_NAME', 'POP_TOP', 'DUP_TOP',
+	'BINARY', 'UNARY', 'GETITEM', 'SETITEM',
+	'BUILD_LIST', 'BUILD_SHELL', 'BUILD_DICT',
+	'CALL', 'RETURN', 'MAKE_FUNCTION', 'MAKE_GENERATOR',
+	'JUMP', 'JUMP_IF_FALSE', 'GET_ITER', 'FOR_ITER',
+	'SETUP_EXCEPT', 'POP_EXCEPT', 'RAISE_SKIP', 'TAIL_CALL', 'MAKE_FUNCTION_DEFAULTS',
+	'BUILD_RANGE', 'YIELD_VALUE', 'AWAIT',
+	'SETUP_FINALLY', 'END_FINALLY',
+)
+
+(LOAD_CONST, LOAD_NAME, STORE_NAME, POP_TOP, DUP_TOP,
+ BINARY, UNARY, GETITEM, SETITEM,
+ BUILD_LIST, BUILD_SHELL, BUILD_DICT,
+ CALL, RETURN, MAKE_FUNCTION, MAKE_GENERATOR,
+ JUMP, JUMP_IF_FALSE, GET_ITER, FOR_ITER,
+ SETUP_EXCEPT, POP_EXCEPT, RAISE_SKIP, TAIL_CALL, MAKE_FUNCTION_DEFAULTS,
+ BUILD_RANGE, YIELD_VALUE, AWAIT,
+ SETUP_FINALLY, END_FINALLY) = range(len(OPNAMES))
+
+# instructions whose argument is a jump target
+JUMPS = (JUMP, JUMP_IF_FALSE, FOR_ITER, SETUP_EXCEPT, SETUP_FINALLY)
+
+# flags in the argument of BUILD_RANGE
+RANGE_CLOSED_START, RANGE_CLOSED_STOP = 1, 2
+
+# BINARY/UNARY arguments index these tables, so their order is part of the format
+BINARY_OPERATORS = (
+	'+', '-', '*', '/', '\\', '%', '^', '<<', '>>', '&&', '||', '^^',
+	'>', '>=', '<', '<=', '==', '!=', '><', '<=>',
+	'&', 'and', '|', 'or', # only in code before version 4, which compiles them to jumps
+	'match', # pattern match of a when statement, `is` in Cup
+	'in', 'not in', 'is', 'is not',
+)
+
+def _logical(op): return lambda obj1, obj2: op(bool(obj1), bool(obj2))
+
+def _binary_function(op):
+	if op in simple_operations: return simple_operations[op]
+	elif op in lazy_operations: return _logical(lazy_operations[op])
+	return lambda test, pattern: pattern == test
+
+binary_functions = tuple(_binary_function(op) for op in BINARY_OPERATORS)
+
+UNARY_OPERATORS = ('+', '-', '!', 'not', '?', '~')
+
+unary_functions = tuple(unary_operations[op] for op in UNARY_OPERATORS)
+
+
+# A compiled function or program: flat (opcode, argument) pairs plus its tables;
+# varnames lays out a call's frame: the params, then the other names it binds;
+# a call to a generator function returns a generator of the values it throws,
+# a call to a sync function the coroutine that runs it (see Interpreter.drive);
+# skips: (start, end, target, depth) of the blocks a skip leaving a call made
+# in [start, end) stops, innermost first: it jumps to target with `depth`
+# values on the stack, or with target None (a do block) goes to the handler
+Code = namedtuple('Code', ['name', 'params', 'instructions', 'constants', 'names', 'varnames', 'generator', 'sync', 'skips'], defaults=[False, False, ()])
+
+
+class CodeBuilder(object):
+
+	def __init__(self, name, params=(), tail_calls=False, varnames=(), generator=False, sync=False):
+		self.name = name
+		self.params = tuple(params)
+		self.varnames = tuple(varnames)
+		self.generator = generator
+		self.sync = sync
+		self.tail_calls = tail_calls
+		self.instructions = array('i')
+		self.constants = []
+		self.names = []
+		self._constant_index = {}
+		self._name_index = {}
+		# how a skip statement leaves the innermost enclosing statement:
+		# ('jump', patch list) for if/while-else, ('loop', target) for loops, None to raise
+		self.skip_targets = [None]
+		self.skips = []
+		# values a statement starts with on the stack: the iterators of the enclosing for loops
+		self.depth = 0
+		self.loops = []
+		# open do blocks, and unless arms with a last block: a call inside one
+		# must return to its handler
+		self.excepts = 0
+
+	def emit(self, op, arg=0):
+		self.instructions.append(op)
+		self.instructions.append(arg)
+		return len(self.instructions) - 2
+
+	def position(self): return len(self.instructions)
+
+	def patch(self, index, target=None):
+		self.instructions[index + 1] = self.position() if target is None else target
+
+	def constant(self, value):
+		key = (type(value), value) if not isinstance(value, Code) else id(value)
+		if key not in self._constant_index:
+			self._constant_index[key] = len(self.constants)
+			self.constants.append(value)
+		return self._constant_index[key]
+
+	def name_index(self, name):
+		if name not in self._name_index:
+			self._name_index[name] = len(self.names)
+			self.names.append(name)
+		return self._name_index[name]
+
+	def skip_block(self, start, target, depth=None):
+		"""Record that a skip leaving a call made since `start` goes to `target` (None: the do handler)."""
+		self.skips.append((start, self.position(), target, self.depth if depth is None else depth))
+
+	def build(self):
+		return Code(self.name, self.params, self.instructions, tuple(self.constants), tuple(self.names), self.varnames, self.generator, self.sync, tuple(self.skips))
+
+
+def compile_constant(node, builder): builder.emit(LOAD_CONST, builder.constant(node.value))
+def compile_identifier(node, builder): builder.emit(LOAD_NAME, builder.name_index(node.value))
+
+
+def compile_bin_op(node, builder):
+	if node.operator in short_circuits: return compile_logical(node, builder)
+	compile_expression(node.left, builder)
+	compile_expression(node.right, builder)
+	builder.emit(BINARY, BINARY_OPERATORS.index(node.operator))
+
+
+def compile_logical(node, builder):
+	"""Compile and/or to jumps, so the right operand only runs when the left one does not decide."""
+	compile_expression(node.left, builder)
+	left_false = builder.emit(JUMP_IF_FALSE)
+	if short_circuits[node.operator]:
+		# or: a true left operand is the result
+		builder.emit(LOAD_CONST, builder.constant(True))
+		ends, falses = [builder.emit(JUMP)], []
+		builder.patch(left_false)
+	else: ends, falses = [], [left_false]
+	compile_expression(node.right, builder)
+	falses.append(builder.emit(JUMP_IF_FALSE))
+	builder.emit(LOAD_CONST, builder.constant(True))
+	ends.append(builder.emit(JUMP))
+	for jump in falses: builder.patch(jump)
+	builder.emit(LOAD_CONST, builder.constant(False))
+	for end in ends: builder.patch(end)
+
+
+def compile_unary_op(node, builder):
+	compile_expression(node.right, builder)
+	builder.emit(UNARY, UNARY_OPERATORS.index(node.operator))
+
+
+def compile_getitem(node, builder):
+	compile_expression(node.left, builder)
+	compile_expression(node.key, builder)
+	builder.emit(GETITEM)
+
+
+def compile_call_func(node, builder, op=CALL):
+	compile_expression(node.left, builder)
+	for argument in node.arguments: compile_expression(argument, builder)
+	builder.emit(op, len(node.arguments))
+
+
+def compile_returned(node, builder):
+	"""Compile the value of a return, as a tail call when the builder allows it."""
+	if type(node) is AST.CallFunction and builder.tail_calls and not builder.excepts:
+		compile_call_func(node, builder, TAIL_CALL)
+	else: compile_expression(node, builder)
+
+
+def compile_wait(node, builder):
+	compile_expression(node.value, builder)
+	builder.emit(AWAIT)
+
+
+def compile_items(op):
+	def compile_sequence(node, builder):
+		for item in node.items: compile_expression(item, builder)
+		builder.emit(op, len(node.items))
+	return compile_sequence
+
+
+def compile_dict(node, builder):
+	for key, value in node.items:
+		compile_expression(key, builder)
+		compile_expression(value, builder)
+	builder.emit(BUILD_DICT, len(node.items))
+
+
+def compile_range(node, builder):
+	compile_expression(node.start, builder)
+	compile_expression(node.stop, builder)
+	if node.step is not None: compile_expression(node.step, builder)
+	else: builder.emit(LOAD_CONST, builder.constant(None))
+	builder.emit(BUILD_RANGE, RANGE_CLOSED_START * node.closed_start | RANGE_CLOSED_STOP * node.closed_stop)
+
+
+expression_compilers = {
+	AST.Number: compile_constant,
+	AST.String: compile_constant,
+	AST.Logic: compile_constant,
+	AST.Identifier: compile_identifier,
+	AST.BinaryOperator: compile_bin_op,
+	AST.UnaryOperatorPrefix: compile_unary_op,
+	AST.SubscriptOperator: compile_getitem,
+	AST.CallFunction: compile_call_func,
+	AST.List: compile_items(BUILD_LIST),
+	AST.Shell: compile_items(BUILD_SHELL),
+	AST.Dictionary: compile_dict,
+	AST.Range: compile_range,
+	AST.Wait: compile_wait,
+}
+
+
+def compile_expression(node, builder):
+	tp = type(node)
+	if tp in expression_compilers: expression_compilers[tp](node, builder)
+	else: raise Exception(f'Unknown node {tp.__name__} {node}')
+
+
+# Statements get `tail`: when true the statement is the last one of a function
+# or program body and its value is returned instead of dropped.
+
+def compile_assignment(node, builder, tail):
+	if isinstance(node.left, AST.SubscriptOperator):
+		compile_expression(node.left.left, builder)
+		compile_expression(node.left.key, builder)
+		compile_expression(node.right, builder)
+		builder.emit(SETITEM)
+	else:
+		compile_expression(node.right, builder)
+		builder.emit(STORE_NAME, builder.name_index(node.left.value))
+
+
+def compile_func_decla(node, builder, tail):
+	code = compile_function(node.name, node.params, node.body, builder.tail_calls, node.generator, node.sync)
+	if node.defaults:
+		# the default values, evaluated here, go to the function as one shell
+		for default in node.defaults: compile_expression(default, builder)
+		builder.emit(BUILD_SHELL, len(node.defaults))
+		builder.emit(MAKE_FUNCTION_DEFAULTS, builder.constant(code))
+	else: builder.emit(MAKE_FUNCTION, builder.constant(code))
+	builder.emit(STORE_NAME, builder.name_index(node.name))
+
+
+def compile_condition(node, builder, tail):
+	ends = []
+	bodies = []
+	builder.skip_targets.append(('jump', ends))
+	branches = [(node.test, node.if_body)] + [(cond.test, cond.body) for cond in node.elifs]
+	for test, body in branches:
+		compile_expression(test, builder)
+		next_branch = builder.emit(JUMP_IF_FALSE)
+		start = builder.position()
+		compile_statements(body, builder, tail)
+		bodies.append((start, builder.position()))
+		ends.append(builder.emit(JUMP))
+		builder.patch(next_branch)
+	if node.else_body is not None:
+		start = builder.position()
+		compile_statements(node.else_body, builder, tail)
+		bodies.append((start, builder.position()))
+	builder.skip_targets.pop()
+	for end in ends: builder.patch(end)
+	builder.skips.extend((start, stop, builder.position(), builder.depth) for start, stop in bodies)
+
+
+def compile_when(node, builder, tail):
+	ends = []
+	compile_expression(node.test, builder)
+	for pattern in node.patterns:
+		builder.emit(DUP_TOP)
+		compile_expression(pattern.pattern, builder)
+		builder.emit(BINARY, BINARY_OPERATORS.index('match'))
+		next_pattern = builder.emit(JUMP_IF_FALSE)
+		builder.emit(POP_TOP)
+		compile_statements(pattern.body, builder, tail)
+		ends.append(builder.emit(JUMP))
+		builder.patch(next_pattern)
+	builder.emit(POP_TOP)
+	if node.else_body is not None: compile_statements(node.else_body, builder, tail)
+	for end in ends: builder.patch(end)
+
+
+def compile_while_loop(node, builder, tail):
+	start = builder.position()
+	compile_expression(node.test, builder)
+	exit_loop = builder.emit(JUMP_IF_FALSE)
+	breaks = []
+	builder.loops.append((start, breaks))
+	builder.skip_targets.append(('loop', start))
+	body = builder.position()
+	compile_statements(node.body, builder, False)
+	builder.skip_block(body, start)
+	builder.skip_targets.pop()
+	builder.loops.pop()
+	builder.emit(JUMP, start)
+	builder.patch(exit_loop)
+	if node.else_body is not None:
+		ends = []
+		builder.skip_targets.append(('jump', ends))
+		else_body = builder.position()
+		compile_statements(node.else_body, builder, tail)
+		builder.skip_targets.pop()
+		for end in ends: builder.patch(end)
+		builder.skip_block(else_body, builder.position())
+	for index in breaks: builder.patch(index)
+
+
+def compile_range_loop(node, builder, tail): compile_while_loop(node.loop, builder, tail)
+
+
+def compile_for_loop(node, builder, tail):
+	compile_expression(node.collection, builder)
+	builder.emit(GET_ITER)
+	start = builder.position()
+	exit_loop = builder.emit(FOR_ITER)
+	builder.emit(STORE_NAME, builder.name_index(node.var_name))
+	breaks = []
+	builder.loops.append((start, breaks))
+	builder.skip_targets.append(('loop', start))
+	builder.depth += 1
+	body = builder.position()
+	compile_statements(node.body, builder, False)
+	builder.skip_block(body, start)
+	builder.depth -= 1
+	builder.skip_targets.pop()
+	builder.loops.pop()
+	builder.emit(JUMP, start)
+	for index in breaks: builder.patch(index)
+	builder.emit(POP_TOP) # the iterator, when the loop was left by quit
+	builder.patch(exit_loop)
+
+
+def compile_exception(node, builder, tail):
+	"""A do block; with a last block, a return or an error leaving do or unless runs it first.
+
+		SETUP_FINALLY finally        (with a last block)
+		SETUP_EXCEPT unless
+		do body
+		POP_EXCEPT
+		JUMP last
+	unless:
+		unless tests and bodies, each ending with JUMP last
+	last:
+		POP_EXCEPT                   (the finally handler)
+		last body
+		JUMP end
+	finally:                         (a return or an error pending on the stack)
+		last body
+		END_FINALLY                  (raise the error again, or push the return value)
+		RETURN
+	end:
+	"""
+	if node.last_body is not None:
+		setup_finally = builder.emit(SETUP_FINALLY)
+		builder.excepts += 1
+	setup = builder.emit(SETUP_EXCEPT)
+	builder.skip_targets.append(None)
+	builder.excepts += 1
+	do_body = builder.position()
+	compile_statements(node.do_body, builder, False)
+	builder.skip_block(do_body, None)
+	builder.excepts -= 1
+	builder.skip_targets.pop()
+	builder.emit(POP_EXCEPT)
+	to_last = builder.emit(JUMP)
+	builder.patch(setup)
+	ends = []
+	unless_tail = tail and node.last_body is None
+	# a skip leaving an unless arm is raised, to go through the last block
+	if node.last_body is not None: builder.skip_targets.append(None)
+	for unless in node.unlesses:
+		compile_expression(unless.unlesses, builder)
+		next_unless = builder.emit(JUMP_IF_FALSE)
+		compile_statements(unless.body, builder, unless_tail)
+		ends.append(builder.emit(JUMP))
+		builder.patch(next_unless)
+	builder.patch(to_last)
+	for end in ends: builder.patch(end)
+	if node.last_body is None: return
+	builder.skip_targets.pop()
+	builder.excepts -= 1
+	builder.emit(POP_EXCEPT)
+	compile_statements(node.last_body, builder, tail)
+	end = builder.emit(JUMP)
+	builder.patch(setup_finally)
+	# the pending return or error is one more value under the last block's
+	builder.depth += 1
+	compile_statements(node.last_body, builder, False)
+	builder.depth -= 1
+	builder.emit(END_FINALLY)
+	builder.emit(RETURN)
+	builder.patch(end)
+
+
+def compile_use(node, builder, tail): pass
+
+
+def compile_quit(node, builder, tail): builder.loops[-1][1].append(builder.emit(JUMP))
+def compile_continue(node, builder, tail): builder.emit(JUMP, builder.loops[-1][0])
+
+
+def compile_skip(node, builder, tail):
+	target = builder.skip_targets[-1]
+	if target is None: builder.emit(RAISE_SKIP)
+	elif target[0] == 'loop': builder.emit(JUMP, target[1])
+	else: target[1].append(builder.emit(JUMP))
+
+
+def compile_return(node, builder, tail):
+	if node.value is not None: compile_returned(node.value, builder)
+	else: builder.emit(LOAD_CONST, builder.constant(None))
+	builder.emit(RETURN)
+
+
+def compile_throw(node, builder, tail):
+	if node.value is not None: compile_expression(node.value, builder)
+	else: builder.emit(LOAD_CONST, builder.constant(None))
+	builder.emit(YIELD_VALUE)
+
+
+statement_compilers = {
+	AST.Assignment: compile_assignment,
+	AST.Function: compile_func_decla,
+	AST.Condition: compile_condition,
+	AST.When: compile_when,
+	AST.WhileLoop: compile_while_loop,
+	AST.RangeLoop: compile_range_loop,
+	AST.ForLoop: compile_for_loop,
+	AST.Do: compile_exception,
+	AST.Use: compile_use,
+	AST.Quit: compile_quit,
+	AST.Continue: compile_continue,
+	AST.Skip: compile_skip,
+	AST.Return: compile_return,
+	AST.Throw: compile_throw,
+}
+
+
+def compile_statement(node, builder, tail):
+	tp = type(node)
+	if tp in statement_compilers: return statement_compilers[tp](node, builder, tail)
+	if tail:
+		compile_returned(node, builder)
+		builder.emit(RETURN)
+	else:
+		compile_expression(node, builder)
+		builder.emit(POP_TOP)
+
+
+def compile_statements(statements, builder, tail):
+	for i, statement in enumerate(statements):
+		compile_statement(statement, builder, tail and i == len(statements) - 1)
+
+
+def compile_function(name, params, body, tail_calls=False, generator=False, sync=False):
+	builder = CodeBuilder(name, params, tail_calls, function_layout(params, body).names, generator, sync)
+	compile_statements(body, builder, True)
+	builder.emit(LOAD_CONST, builder.constant(None))
+	builder.emit(RETURN)
+	return builder.build()
+
+
+def compile_program(program, tail_calls=False):
+	"""Compile an AST.Program to a Code object.
+
+	With `tail_calls`, a call whose value is returned reuses the caller's
+	frame (TAIL_CALL), so tail-recursive functions run in constant space.
+	"""
+	return compile_function('<program>', (), program.body, tail_calls)
+
+
+# serialization
+
+def _to_tuple(code):
+	constants = tuple(_to_tuple(c) if isinstance(c, Code) else c for c in code.constants)
+	return (code.name, code.params, code.instructions.tobytes(), constants, code.names, code.varnames, code.generator, code.sync, code.skips)
+
+
+def _from_tuple(data):
+	name, params, instructions, constants, names = data[:5]
+	# before version 3, frames were laid out by the params alone
+	varnames = data[5] if len(data) > 5 else params
+	# before version 6, a throw returned a MAKE_GENERATOR generator instead
+	generator = data[6] if len(data) > 6 else False
+	sync = data[7] if len(data) > 7 else False
+	# before version 8, a skip leaving a call left the program
+	skips = data[8] if len(data) > 8 else ()
+	code = array('i')
+	code.frombytes(instructions)
+	constants = tuple(_from_tuple(c) if isinstance(c, tuple) else c for c in constants)
+	return Code(name, params, code, constants, names, varnames, generator, sync, skips)
+
+
+def dumps(code):
+	"""Serialize a Code object; the result can be run without lexing or parsing."""
+	return MAGIC + bytes([VERSION, array('i').itemsize]) + marshal.dumps(_to_tuple(code))
+
+
+def loads(data):
+	if data[:4] != MAGIC: raise ValueError('Not a Cup bytecode file')
+	if not 1 <= data[4] <= VERSION or data[5] != array('i').itemsize:
+		raise ValueError(f'Unsupported Cup bytecode version {data[4]}')
+	return _from_tuple(marshal.loads(data[6:]))
+
+
+def dump(code, path):
+	with open(path, 'wb') as f: f.write(dumps(code))
+
+
+def load(path):
+	with open(path, 'rb') as f: return loads(f.read())
+
+
+# disassembler
+
+def _describe(code, op, arg):
+	if op == LOAD_CONST:
+		const = code.constants[arg]
+		return f'<code {const.name}>' if isinstance(const, Code) else repr(const)
+	elif op in (MAKE_FUNCTION, MAKE_GENERATOR, MAKE_FUNCTION_DEFAULTS): return f'<code {code.constants[arg].name}>'
+	elif op in (LOAD_NAME, STORE_NAME): return code.names[arg]
+	elif op == BINARY: return BINARY_OPERATORS[arg]
+	elif op == UNARY: return UNARY_OPERATORS[arg]
+	elif op in JUMPS: return f'to {arg}'
+	return ''
+
+
+def _disassemble(code):
+	yield f'Disassembly of {code.name}({", ".join(code.params)}):'
+	instructions = code.instructions
+	for pc in range(0, len(instructions), 2):
+		op, arg = instructions[pc], instructions[pc + 1]
+		yield f'{pc:6} {OPNAMES[op]:<16}{arg:<6}{_describe(code, op, arg)}'.rstrip()
+	for const in code.constants:
+		if isinstance(const, Code):
+			yield ''
+			for line in _disassemble(const): yield line
+
+
+def disassemble(code):
+	"""Human-readable listing of a Code object and the functions it contains."""
+	return '\n'.join(_disassemble(code))
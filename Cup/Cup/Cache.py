@@ -0,0 +1,107 @@
+"""On-disk cache of parsed programs, so an unchanged script skips the Lexer and Parser.
+
+Entries are pickled AST.Program objects in `<key>.cupc` files, keyed by a hash
+of the source, the Cup version, the cache format and whether the Optimizer ran.
+An edited script or a new Cup version simply misses; old entries are evicted,
+least recently used first, once the directory grows past `max_size` bytes.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+
+from Cup import __version__
+
+
+MAGIC = b'CUPC'
+VERSION = 5 # bump when the AST changes shape
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+def default_directory():
+	"""$CUP_CACHE_DIR, or ~/.cache/cup."""
+	directory = os.environ.get('CUP_CACHE_DIR')
+	if directory: return directory
+	return os.path.join(os.path.expanduser('~'), '.cache', 'cup')
+
+
+class Cache(object):
+
+	def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE):
+		self.directory = directory or default_directory()
+		self.max_size = max_size
+
+	def key(self, source, optimize=True):
+		"""Hex digest for `source` (a str or a bytes-like buffer such as an mmap)."""
+		digest = hashlib.sha256(f'{__version__}\0{VERSION}\0{bool(optimize)}\0'.encode())
+		digest.update(source.encode('utf-8') if isinstance(source, str) else source)
+		return digest.hexdigest()
+
+	def _path(self, key):
+		return os.path.join(self.directory, key + '.cupc')
+
+	def load(self, key):
+		"""The cached program for `key`, or None on a miss or an unreadable entry."""
+		path = self._path(key)
+		try:
+			with open(path, 'rb') as f: data = f.read()
+		except OSError:
+			return None
+		try:
+			if data[:4] != MAGIC: raise ValueError('Not a Cup cache file')
+			program = pickle.loads(data[4:])
+		except Exception:
+			self._remove(path)
+			return None
+		# the modification time orders entries for eviction
+		try: os.utime(path)
+		except OSError: pass
+		return program
+
+	def store(self, key, program):
+		"""Write `program` under `key`, then evict entries over the size cap.
+
+		Programs too deeply nested to pickle are not cached.
+		"""
+		try: data = MAGIC + pickle.dumps(program, pickle.HIGHEST_PROTOCOL)
+		except RecursionError: return
+		try:
+			os.makedirs(self.directory, exist_ok=True)
+			# write aside and rename, so a concurrent run never reads half an entry
+			fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+			with os.fdopen(fd, 'wb') as f: f.write(data)
+			os.replace(temp_path, self._path(key))
+		except OSError:
+			return
+		self.evict()
+
+	def entries(self):
+		"""(mtime, size, path) of every entry, oldest first."""
+		entries = []
+		try: names = os.listdir(self.directory)
+		except OSError: return entries
+		for name in names:
+			if not name.endswith('.cupc'): continue
+			path = os.path.join(self.directory, name)
+			try: stat = os.stat(path)
+			except OSError: continue
+			entries.append((stat.st_mtime, stat.st_size, path))
+		entries.sort()
+		return entries
+
+	def evict(self):
+		"""Remove the least recently used entries until the cache fits in max_size."""
+		entries = self.entries()
+		total = sum(size for _, size, _ in entries)
+		for _, size, path in entries:
+			if total <= self.max_size: break
+			self._remove(path)
+			total -= size
+
+	def clear(self):
+		for _, _, path in self.entries(): self._remove(path)
+
+	def _remove(self, path):
+		try: os.remove(path)
+		except OSError: pass
@@ -0,0 +1,549 @@
+from __future__ import print_function
+from collections import namedtuple
+
+from Cup import AST
+from Cup.AST import bind_arguments
+from Cup.Interpreter import (
+	Environment, Signal, QUIT, CONTINUE, SKIP, Skip, Return, complete, create_global_env, drive, parse, waited,
+)
+from Cup.Operators import make_range, simple_operations, short_circuits, unary_operations
+from Cup.Resolver import function_layout
+from Cup.Utils import print_env
+
+
+# A user function after compilation: same shape as AST.Function, but body is a closure
+# (for a generator, a closure returning the generator of the body); node: the AST.Function
+CompiledFunction = namedtuple('CompiledFunction', ['name', 'params', 'body', 'layout', 'generator', 'sync', 'node'])
+
+
+class CompiledClosure(AST.Closure):
+	"""A compiled user function value; Python code, such as a builtin, can call it directly."""
+
+	__slots__ = ()
+
+	def __call__(self, *args): return call_closure(self, bind_arguments(self, list(args)))
+
+
+def call_closure(function, args):
+	env = Environment(function.env, args, function.function.layout)
+	if function.function.generator:
+		steps = generate(function.function.body, env)
+		return drive(steps) if function.function.sync else steps
+	ret = function.function.body(env)
+	if type(ret) is Signal:
+		if ret.exception is Return: return ret.value
+		ret.throw()
+	return ret
+
+
+def generate(body, env):
+	ret = yield from body(env)
+	if type(ret) is Signal:
+		if ret.exception is Return: return ret.value
+		ret.throw()
+	return ret
+
+
+# Operators with a Python spelling are compiled into a closure with the operator
+# inlined, and into a cheaper one when the right operand is a literal. A site
+# does not specialize on the operand types it sees: the inlined operator is
+# already specialized by CPython, and a type guard in front of it makes a
+# site slower (an int + site 0.074 s per 200k evaluations, guarded 0.08-0.10 s).
+python_operators = {
+	'+': '+', '-': '-', '*': '*', '/': '/', '\\': '//', '%': '%', '^': '**',
+	'<<': '<<', '>>': '>>', '&&': '&', '||': '|', '^^': '^',
+	'>': '>', '>=': '>=', '<': '<', '<=': '<=', '==': '==', '!=': '!=',
+	'in': 'in', 'not in': 'not in', 'is': 'is', 'is not': 'is not',
+}
+
+inline_operations = {
+	op: eval(f'lambda left, right: lambda env: left(env) {python_op} right(env)')
+	for op, python_op in python_operators.items()
+}
+
+# Python's and/or short-circuit as well; `not not` makes their value a truth value
+inline_operations.update({
+	op: eval(f'lambda left, right: lambda env: not not left(env) {"or" if decides else "and"} not not right(env)')
+	for op, decides in short_circuits.items()
+})
+
+constant_operations = {
+	op: eval(f'lambda left, value: lambda env: left(env) {python_op} value')
+	for op, python_op in python_operators.items()
+}
+
+inline_unary_operations = {
+	'+': lambda right: lambda env: +right(env),
+	'-': lambda right: lambda env: -right(env),
+	'!': lambda right: lambda env: not right(env),
+	'not': lambda right: lambda env: not right(env),
+}
+
+
+def compile_constant(node):
+	value = node.value
+	return lambda env: value
+
+
+def compile_identifier(node):
+	name = node.value
+	return lambda env: env.lookup(name)
+
+
+def compile_bin_op(node):
+	left = compile_node(node.left)
+	if node.operator in inline_operations:
+		if type(node.right) in (AST.Number, AST.String) and node.operator in constant_operations:
+			return constant_operations[node.operator](left, node.right.value)
+		return inline_operations[node.operator](left, compile_node(node.right))
+	right = compile_node(node.right)
+	if node.operator in simple_operations:
+		op = simple_operations[node.operator]
+		return lambda env: op(left(env), right(env))
+	else:
+		def invalid(env): raise Exception(f'Invalid operator {node.operator}')
+		return invalid
+
+
+def compile_unary_op(node):
+	right = compile_node(node.right)
+	if node.operator in inline_unary_operations:
+		return inline_unary_operations[node.operator](right)
+	op = unary_operations[node.operator]
+	return lambda env: op(right(env))
+
+
+def compile_assignment(node):
+	right = compile_node(node.right)
+	if isinstance(node.left, AST.SubscriptOperator):
+		collection = compile_node(node.left.left)
+		key = compile_node(node.left.key)
+		def setitem(env):
+			coll = collection(env)
+			k = key(env)
+			coll[k] = right(env)
+		return setitem
+	name = node.left.value
+	return lambda env: env.set(name, right(env))
+
+
+def compile_condition(node):
+	test = compile_node(node.test)
+	if_body = compile_statements(node.if_body)
+	elifs = tuple((compile_node(cond.test), compile_statements(cond.body)) for cond in node.elifs)
+	else_body = compile_statements(node.else_body) if node.else_body is not None else None
+	def condition(env):
+		if test(env): ret = if_body(env)
+		else:
+			for elif_test, elif_body in elifs:
+				if elif_test(env):
+					ret = elif_body(env)
+					break
+			else:
+				if else_body is None: return
+				ret = else_body(env)
+		return None if ret is SKIP else ret
+	return condition
+
+
+def compile_exception(node):
+	do_body = compile_statements(node.do_body)
+	unlesses = tuple((compile_node(exc.unlesses), compile_statements(exc.body)) for exc in node.unlesses)
+	last_body = compile_statements(node.last_body) if node.last_body is not None else None
+	def unless(env):
+		for unless_test, unless_body in unlesses:
+			if unless_test(env): return unless_body(env)
+	# see Interpreter.eval_exception
+	def exception(env):
+		ret = None
+		try:
+			try:
+				ret = do_body(env)
+				# a return leaves the function; quit, continue or skip is caught like an exception
+				caught = type(ret) is Signal and ret.exception is not Return
+			except Exception:
+				caught = True
+			if caught: ret = unless(env)
+			# the do block's value is not the statement's
+			elif type(ret) is not Signal: ret = None
+		finally:
+			if last_body is not None:
+				last = last_body(env)
+				if type(last) is Signal: return last
+		if last_body is None or type(ret) is Signal: return ret
+		return last
+	return exception
+
+
+def compile_use(node): return lambda env: None
+
+
+def compile_when(node):
+	test = compile_node(node.test)
+	patterns = tuple((compile_node(pattern.pattern), compile_statements(pattern.body)) for pattern in node.patterns)
+	else_body = compile_statements(node.else_body) if node.else_body is not None else None
+	def when(env):
+		value = test(env)
+		for pattern, body in patterns:
+			if pattern(env) == value: return body(env)
+		if else_body is not None: return else_body(env)
+	return when
+
+
+def compile_while_loop(node):
+	test = compile_node(node.test)
+	body = compile_statements(node.body)
+	else_body = compile_statements(node.else_body) if node.else_body is not None else None
+	def while_loop(env):
+		while test(env):
+			ret = body(env)
+			if type(ret) is Signal:
+				if ret is QUIT: break
+				if ret is not CONTINUE and ret is not SKIP: return ret
+		else:
+			if else_body is not None:
+				ret = else_body(env)
+				return None if ret is SKIP else ret
+	return while_loop
+
+
+def compile_range_loop(node):
+	var_name = node.var_name
+	stop = compile_node(node.stop)
+	inclusive = node.inclusive
+	step = node.step
+	derived = tuple(node.derived)
+	names = (var_name,) + tuple(variable.name for variable in derived)
+	body = compile_statements(node.body)
+	else_body = compile_statements(node.else_body) if node.else_body is not None else None
+	loop = compile_while_loop(node.loop)
+	def range_loop(env):
+		start = env.lookup(var_name)
+		end = stop(env)
+		if type(start) is not int or type(end) is not int: return loop(env)
+		if inclusive: end += 1 if step > 0 else -1
+		indices = range(start, end, step)
+		columns = [indices] + [
+			range(start * variable.scale + variable.offset, end * variable.scale + variable.offset, step * variable.scale)
+			for variable in derived
+		]
+		for values in zip(*columns):
+			for name, value in zip(names, values): env.set(name, value)
+			ret = body(env)
+			if type(ret) is Signal:
+				if ret is QUIT: return
+				if ret is CONTINUE or ret is SKIP: return loop(env)
+				return ret
+		if indices: env.set(var_name, indices[-1] + step)
+		if else_body is not None:
+			ret = else_body(env)
+			return None if ret is SKIP else ret
+	return range_loop
+
+
+def compile_for_loop(node):
+	var_name = node.var_name
+	collection = compile_node(node.collection)
+	body = compile_statements(node.body)
+	def for_loop(env):
+		for val in collection(env):
+			env.set(var_name, val)
+			ret = body(env)
+			if type(ret) is Signal:
+				if ret is QUIT: break
+				if ret is not CONTINUE and ret is not SKIP: return ret
+	return for_loop
+
+
+def compile_function(node):
+	"""The CompiledFunction of an AST.Function; its defaults are left to the declaration."""
+	body = compile_gen_statements(node.body) if node.generator else compile_statements(node.body)
+	return CompiledFunction(node.name, node.params, body, function_layout(node.params, node.body), node.generator, node.sync, node)
+
+
+def compile_func_decla(node):
+	function = compile_function(node)
+	if not node.defaults:
+		return lambda env: env.set(function.name, CompiledClosure(function.params, function, env))
+	defaults = tuple(compile_node(default) for default in node.defaults)
+	return lambda env: env.set(function.name, CompiledClosure(function.params, function, env, tuple(default(env) for default in defaults)))
+
+
+def compile_call_func(node):
+	left = compile_node(node.left)
+	arguments = tuple(compile_node(argument) for argument in node.arguments)
+	def call_func(env):
+		function = left(env)
+		args = bind_arguments(function, [argument(env) for argument in arguments])
+		if type(function) is AST.BuiltinFunction:
+			return function.body(*args)
+		return call_closure(function, args)
+	return call_func
+
+
+def compile_getitem(node):
+	collection = compile_node(node.left)
+	key = compile_node(node.key)
+	return lambda env: collection(env)[key(env)]
+
+
+def compile_list(node):
+	items = tuple(compile_node(item) for item in node.items)
+	return lambda env: [item(env) for item in items]
+
+
+def compile_shell(node):
+	items = tuple(compile_node(item) for item in node.items)
+	return lambda env: tuple(item(env) for item in items)
+
+
+def compile_dict(node):
+	items = tuple((compile_node(key), compile_node(value)) for key, value in node.items)
+	return lambda env: {key(env): value(env) for key, value in items}
+
+
+def compile_range(node):
+	start = compile_node(node.start)
+	stop = compile_node(node.stop)
+	step = compile_node(node.step) if node.step is not None else lambda env: None
+	closed_start, closed_stop = node.closed_start, node.closed_stop
+	return lambda env: make_range(start(env), stop(env), step(env), closed_start, closed_stop)
+
+
+compilers = {
+	AST.Number: compile_constant,
+	AST.String: compile_constant,
+	AST.Logic: compile_constant,
+	AST.List: compile_list,
+	AST.Shell: compile_shell,
+	AST.Dictionary: compile_dict,
+	AST.Range: compile_range,
+	AST.Identifier: compile_identifier,
+	AST.BinaryOperator: compile_bin_op,
+	AST.UnaryOperatorPrefix: compile_unary_op,
+	AST.SubscriptOperator: compile_getitem,
+	AST.Assignment: compile_assignment,
+	AST.Condition: compile_condition,
+	AST.Use: compile_use,
+	AST.Do: compile_exception,
+	AST.When: compile_when,
+	AST.WhileLoop: compile_while_loop,
+	AST.RangeLoop: compile_range_loop,
+	AST.ForLoop: compile_for_loop,
+	AST.Function: compile_func_decla,
+	AST.CallFunction: compile_call_func,
+}
+
+
+def compile_node(node):
+	tp = type(node)
+	if tp in compilers:
+		return compilers[tp](node)
+	else:
+		raise Exception(f'Unknown node {tp.__name__} {node}')
+
+
+def compile_statement(node):
+	tp = type(node)
+	if tp is AST.Quit: return lambda env: QUIT
+	elif tp is AST.Continue: return lambda env: CONTINUE
+	elif tp is AST.Skip: return lambda env: SKIP
+	elif tp is AST.Return:
+		if node.value is None: return lambda env: Signal(Return)
+		value = compile_node(node.value)
+		return lambda env: Signal(Return, value(env))
+	return compile_node(node)
+
+
+def compile_statements(statements):
+	"""Compile a block into a closure returning its last value, or the Signal that stopped it."""
+	closures = tuple(compile_statement(statement) for statement in statements)
+	def block(env):
+		ret = None
+		try:
+			for closure in closures:
+				ret = closure(env)
+				if type(ret) is Signal: return ret
+		except Skip:
+			# a skip that left a called function continues from the calling block
+			return SKIP
+		return ret
+	return block
+
+
+# Generator functions: their blocks compile to closures that return a generator.
+# A statement with blocks is compiled by the generator version of its
+# compiler below; a throw yields its value, a wait what it waits for; the
+# rest compile as usual.
+
+PLAIN, NESTED, THROWN = range(3)
+
+
+def compile_gen_statement(node):
+	"""(kind, closure) for a statement of a generator function."""
+	tp = type(node)
+	if tp is AST.Throw: return THROWN, compile_node(node.value) if node.value is not None else (lambda env: None)
+	elif tp in gen_compilers: return NESTED, gen_compilers[tp](node)
+	elif waited(node) is not None: return NESTED, compile_gen_wait(node)
+	return PLAIN, compile_statement(node)
+
+
+def compile_gen_statements(statements):
+	"""compile_statements for a block of a generator function."""
+	closures = tuple(compile_gen_statement(statement) for statement in statements)
+	def block(env):
+		ret = None
+		try:
+			for kind, closure in closures:
+				if kind == THROWN:
+					yield closure(env)
+					ret = None
+					continue
+				ret = (yield from closure(env)) if kind == NESTED else closure(env)
+				if type(ret) is Signal: return ret
+		except Skip:
+			return SKIP
+		return ret
+	return block
+
+
+def compile_gen_wait(node):
+	tp = type(node)
+	value = compile_node(waited(node).value)
+	if tp is AST.Wait:
+		def wait(env): return (yield value(env))
+	elif tp is AST.Return:
+		def wait(env): return Signal(Return, (yield value(env)))
+	elif isinstance(node.left, AST.SubscriptOperator):
+		collection = compile_node(node.left.left)
+		key = compile_node(node.left.key)
+		def wait(env):
+			result = yield value(env)
+			collection(env)[key(env)] = result
+	else:
+		name = node.left.value
+		def wait(env): env.set(name, (yield value(env)))
+	return wait
+
+
+def compile_gen_condition(node):
+	test = compile_node(node.test)
+	if_body = compile_gen_statements(node.if_body)
+	elifs = tuple((compile_node(cond.test), compile_gen_statements(cond.body)) for cond in node.elifs)
+	else_body = compile_gen_statements(node.else_body) if node.else_body is not None else None
+	def condition(env):
+		if test(env): ret = yield from if_body(env)
+		else:
+			for elif_test, elif_body in elifs:
+				if elif_test(env):
+					ret = yield from elif_body(env)
+					break
+			else:
+				if else_body is None: return
+				ret = yield from else_body(env)
+		return None if ret is SKIP else ret
+	return condition
+
+
+def compile_gen_exception(node):
+	do_body = compile_gen_statements(node.do_body)
+	unlesses = tuple((compile_node(exc.unlesses), compile_gen_statements(exc.body)) for exc in node.unlesses)
+	last_body = compile_gen_statements(node.last_body) if node.last_body is not None else None
+	def unless(env):
+		for unless_test, unless_body in unlesses:
+			if unless_test(env): return (yield from unless_body(env))
+	def exception(env):
+		ret = None
+		try:
+			try:
+				ret = yield from do_body(env)
+				caught = type(ret) is Signal and ret.exception is not Return
+			except Exception:
+				caught = True
+			if caught: ret = yield from unless(env)
+			# the do block's value is not the statement's
+			elif type(ret) is not Signal: ret = None
+		finally:
+			if last_body is not None:
+				last = yield from last_body(env)
+				if type(last) is Signal: return last
+		if last_body is None or type(ret) is Signal: return ret
+		return last
+	return exception
+
+
+def compile_gen_when(node):
+	test = compile_node(node.test)
+	patterns = tuple((compile_node(pattern.pattern), compile_gen_statements(pattern.body)) for pattern in node.patterns)
+	else_body = compile_gen_statements(node.else_body) if node.else_body is not None else None
+	def when(env):
+		value = test(env)
+		for pattern, body in patterns:
+			if pattern(env) == value: return (yield from body(env))
+		if else_body is not None: return (yield from else_body(env))
+	return when
+
+
+def compile_gen_while_loop(node):
+	test = compile_node(node.test)
+	body = compile_gen_statements(node.body)
+	else_body = compile_gen_statements(node.else_body) if node.else_body is not None else None
+	def while_loop(env):
+		while test(env):
+			ret = yield from body(env)
+			if type(ret) is Signal:
+				if ret is QUIT: break
+				if ret is not CONTINUE and ret is not SKIP: return ret
+		else:
+			if else_body is not None:
+				ret = yield from else_body(env)
+				return None if ret is SKIP else ret
+	return while_loop
+
+
+def compile_gen_for_loop(node):
+	var_name = node.var_name
+	collection = compile_node(node.collection)
+	body = compile_gen_statements(node.body)
+	def for_loop(env):
+		for val in collection(env):
+			env.set(var_name, val)
+			ret = yield from body(env)
+			if type(ret) is Signal:
+				if ret is QUIT: break
+				if ret is not CONTINUE and ret is not SKIP: return ret
+	return for_loop
+
+
+gen_compilers = {
+	AST.Condition: compile_gen_condition,
+	AST.Do: compile_gen_exception,
+	AST.When: compile_gen_when,
+	AST.WhileLoop: compile_gen_while_loop,
+	# the counting loop runs as the while loop it replaces
+	AST.RangeLoop: lambda node: compile_gen_while_loop(node.loop),
+	AST.ForLoop: compile_gen_for_loop,
+}
+
+
+def compile_program(program):
+	"""Walk the program once and return a closure that runs it against an environment."""
+	return compile_statements(program.body)
+
+
+def evaluate_env(s, env, verbose=False, optimize=True, cache=None):
+	program = parse(s, verbose, optimize, cache)
+	if program is None: return
+
+	ret = complete(compile_program(program)(env))
+
+	if verbose:
+		print('Environment')
+		print_env(env)
+		print()
+
+	return ret
+
+
+def evaluate(s, verbose=False, optimize=True, cache=None):
+	return evaluate_env(s, create_global_env(), verbose, optimize, cache)
@@ -0,0 +1,94 @@
+"""Compile a Cup program once and run it many times from Python.
+
+	program = Embed.compile('total = x * 2\ntotal')
+	program.run({'x': 21})    # 42
+	program.run({'x': 1})     # 2
+
+compile() lexes, parses, optimizes and compiles for the chosen backend up
+front and raises a CupSyntaxError (message, line, column and source_line)
+instead of printing it. A Program holds no per-run state: every run gets
+its own global environment, so one Program can be run from many threads.
+"""
+import builtins
+
+from Cup import Bytecode, Compiler, Transpiler, VM
+from Cup.Interpreter import Environment, complete, create_global_env, eval_statements, parse_program
+from Cup.Resolver import declared_names, resolve
+
+
+def _prepare_tree(program, tail_calls):
+	names = declared_names(program.body, [])
+	# resolved once against a fresh environment; Program.new_env lays out
+	# its globals in the same slots
+	resolved = resolve(program, create_global_env()).body
+	def run(env, fresh):
+		body = resolved if fresh else resolve(program, env).body
+		return complete(eval_statements(body, env))
+	return names, run
+
+
+def _prepare_closure(program, tail_calls):
+	body = Compiler.compile_program(program)
+	return [], lambda env, fresh: complete(body(env))
+
+
+def _prepare_python(program, tail_calls):
+	code = builtins.compile(Transpiler.transpile(program), '<cup>', 'exec')
+	return [], lambda env, fresh: Transpiler.run(code, env)
+
+
+def _prepare_vm(program, tail_calls):
+	code = Bytecode.compile_program(program, tail_calls)
+	return [], lambda env, fresh: VM.run(code, env)
+
+
+backends = {
+	'tree': _prepare_tree,
+	'closure': _prepare_closure,
+	'python': _prepare_python,
+	'vm': _prepare_vm,
+}
+
+
+class Program(object):
+	"""A compiled Cup program; see compile()."""
+
+	def __init__(self, program, backend='closure', tail_calls=False):
+		if backend not in backends: raise ValueError(f'Unknown backend {backend}')
+		self.program = program
+		self.backend = backend
+		self._globals, self._run = backends[backend](program, tail_calls)
+
+	def new_env(self, bindings=None):
+		"""A global environment with the builtins, the program's globals and `bindings` (a dict)."""
+		env = create_global_env()
+		for name in self._globals: env.declare(name)
+		if bindings:
+			for name, value in bindings.items(): env.set(name, value)
+		return env
+
+	def run(self, bindings=None):
+		"""Run the program and return its value.
+
+		`bindings` is a dict of globals for a fresh environment, or an
+		Environment to run in, which keeps what the program assigns.
+		"""
+		if isinstance(bindings, Environment): return self._run(bindings, False)
+		return self._run(self.new_env(bindings), True)
+
+
+def compile(source, backend='closure', optimize=True, tail_calls=False, cache=None):
+	"""Compile `source` (a str or bytes-like buffer) into a Program for `backend`.
+
+	Raises CupSyntaxError on invalid source. With a Cache.Cache, a source seen
+	before skips the Lexer and Parser.
+	"""
+	if cache is not None:
+		key = cache.key(source, optimize)
+		program = cache.load(key)
+		if program is None:
+			program = parse_program(source, optimize)
+			cache.store(key, program)
+	else:
+		program = parse_program(source, optimize)
+	return Program(program, backend, tail_calls)
@@ -7,10 +7,20 @@ class CupSyntaxError(Exception):
 		self.mess = mess
 		self.ln = ln
 		self.col = col
+		self.source_line = None # the offending line, once the source is known
+
+class ArityError(CupSyntaxError, TypeError):
+	"""A call whose argument count cannot fit the function it is known to call, found before the program runs."""
+
+def arity_error(params, defaults, n_args):
+	"""The TypeError for a call with `n_args` arguments to a function taking `params`."""
+	n_params = len(params)
+	expected = f'{n_params - len(defaults)} to {n_params}' if defaults else n_params
+	return TypeError(f'Expected {expected} arguments, got {n_args}')
 
 def report_error(lexer, error):
 	ln = error.ln
 	col = error.col
-	src_ln = lexer.source_lines[ln - 1]
+	src_ln = error.source_line if error.source_line is not None else lexer.source_lines[ln - 1]
 	print(f'Syntax error: {error.mess} at line {ln}, column {col}')
 	print(f'{src_ln}\n{" " * (col - 1)}^')
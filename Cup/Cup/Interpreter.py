@@ -2,11 +2,17 @@
 
 from __future__ import print_function
 from collections import namedtuple
-import operator, math
+import asyncio
+import functools
+import itertools
+import math
 
-from Cup import AST
+from Cup import AST, Optimizer
 from Cup.Lexer import Lexer, TokenStream
 from Cup.Parser import Parser, ListOfExpressions
+from Cup.Operators import make_range, simple_operations, short_circuits, unary_operations
+from Cup.Resolver import check_arity, function_layout, resolve
+from Cup.AST import bind_arguments
 from Cup.Errors import CupSyntaxError, report_error
 from Cup.Utils import print_ast, print_tokens, print_env
 
@@ -20,15 +26,51 @@ class Return(Exception):
 	def __init__(self, value):
 		self.value = value
 
-class Throw(Exception):
-	def __init__(self, value):
+
+class Signal(object):
+	"""A block that stopped early on quit, continue, skip or return.
+
+	eval_statements returns it in place of the block's value, and it is passed
+	back up until the loop, condition or call that handles it. It is only
+	raised (as its exception) where it leaves a function or the program.
+	"""
+	__slots__ = ('exception', 'value')
+
+	def __init__(self, exception, value=None):
+		self.exception = exception
 		self.value = value
 
+	def throw(self): raise self.exception(self.value)
+
+QUIT = Signal(Quit)
+CONTINUE = Signal(Continue)
+SKIP = Signal(Skip)
+
+# marks a frame slot whose variable has not been assigned yet
+UNSET = type('Unset', (object,), {'__repr__': lambda self: 'UNSET'})()
+
+
 class Environment(object):
+	"""A frame of variables: values live in a list of slots, `_names` maps names to slots.
 
-	def __init__(self, parent=None, args=None):
+	Frames of resolved functions share their Layout's name index until a
+	name outside the layout is assigned. `args` is a dict of names to values,
+	or with a layout, the list of values for its first (parameter) slots.
+	"""
+
+	def __init__(self, parent=None, args=None, layout=None):
 		self._parent = parent
-		self._values = {}
+		if layout is None:
+			self._names = {}
+			self._slots = []
+			self._shared = False
+		else:
+			self._names = layout.index
+			self._shared = True
+			if type(args) is list:
+				self._slots = args + [UNSET] * (layout.size - len(args))
+				return
+			self._slots = [UNSET] * layout.size
 		if args is not None:
 			self._from_dict(args)
 
@@ -36,96 +78,107 @@ class Environment(object):
 		for key, value in args.items():
 			self.set(key, value)
 
+	def slot(self, key): return self._names.get(key)
+
+	def declare(self, key):
+		slot = self._names.get(key)
+		if slot is None:
+			if self._shared:
+				self._names = dict(self._names)
+				self._shared = False
+			slot = self._names[key] = len(self._slots)
+			self._slots.append(UNSET)
+		return slot
+
 	def set(self, key, val):
-		self._values[key] = val
+		slot = self._names.get(key)
+		if slot is None: slot = self.declare(key)
+		self._slots[slot] = val
+
+	def lookup(self, key):
+		env = self
+		while env is not None:
+			slot = env._names.get(key)
+			if slot is not None:
+				val = env._slots[slot]
+				if val is not UNSET: return val
+			env = env._parent
+		raise NameError(f'Name "{key}" is not defined')
 
 	def get(self, key):
-		val = self._values.get(key, None)
-		if val is None and self._parent is not None:
-			return self._parent.get(key)
-		else:
-			return val
+		try: return self.lookup(key)
+		except NameError: return None
 
 	def asdict(self):
-		return self._values
+		# __cup_ names are the optimizer's temporaries, not the program's
+		return {key: self._slots[slot] for key, slot in self._names.items() if self._slots[slot] is not UNSET and not key.startswith('__cup_')}
 
 	def __repr__(self):
-		return f'Environment({str(self._values)})'
+		return f'Environment({str(self.asdict())})'
 
 
 def eval_bin_op(node, env):
-	simple_operations = {
-		'+': operator.add,
-		'-': operator.sub,
-		'*': operator.mul,
-		'/': operator.truediv,
-		'\\': operator.floordiv,
-		'%': operator.mod,
-		'^': operator.pow,
-		'<<': operator.lshift,
-		'>>': operator.rshift,
-		'&&': operator.and_,
-		'||':operator.or_,
-		'^^': operator.xor,
-		'>': operator.gt,
-		'>=': operator.ge,
-		'<': operator.lt,
-		'<=': operator.le,
-		'==': operator.eq,
-		'!=': operator.ne,
-		'><': lambda obj1, obj2: False if set(obj1) & set(obj2) else True,
-		'<=>': lambda obj1, obj2: float(obj1) == float(obj2), 
-
-	}
-	lazy_operations = {
-		'&': lambda obj1, obj2: obj1 and obj2,
-		'and': lambda obj1, obj2: obj1 and obj2,
-		'|': lambda obj1, obj2: obj1 or obj2,
-		'or': lambda obj1, obj2: obj1 or obj2,
-	}
-	if node.operator in simple_operations: return simple_operations[node.operator](eval_expression(node.left, env), eval_expression(node.right, env))
-	elif node.operator in lazy_operations: return lazy_operations[node.operator](bool(eval_expression(node.left, env)), bool(eval_expression(node.right, env)))
-	else: raise Exception(f'Invalid operator {node.operator}')
+	op = simple_operations.get(node.operator)
+	if op is not None: return op(eval_expression(node.left, env), eval_expression(node.right, env))
+	decides = short_circuits.get(node.operator)
+	if decides is not None:
+		if bool(eval_expression(node.left, env)) is decides: return decides
+		return bool(eval_expression(node.right, env))
+	raise Exception(f'Invalid operator {node.operator}')
 
 
 def eval_unary_op(node, env):
-	operations = {
-		'+': operator.pos,
-		'-': operator.neg,
-		'!': operator.not_,
-		'not': operator.not_,
-		'?': lambda obj: type(obj),
-		'~': lambda obj: round(obj),
-	}
-	return operations[node.operator](eval_expression(node.right, env))
+	return unary_operations[node.operator](eval_expression(node.right, env))
 
 
 def eval_assignment(node, env):
 
 	if isinstance(node.left, AST.SubscriptOperator): return eval_setitem(node, env)
+	elif node.left.address is not None: env._slots[node.left.address[1]] = eval_expression(node.right, env)
 	else: return env.set(node.left.value, eval_expression(node.right, env))
 
 
 def eval_condition(node, env):
-	try:
-		if eval_expression(node.test, env): return eval_statements(node.if_body, env)
-
+	if eval_expression(node.test, env): ret = eval_statements(node.if_body, env)
+	else:
 		for cond in node.elifs:
 			if eval_expression(cond.test, env):
-				return eval_statements(cond.body, env)
+				ret = eval_statements(cond.body, env)
+				break
+		else:
+			if node.else_body is None: return
+			ret = eval_statements(node.else_body, env)
+	return None if ret is SKIP else ret
 
-		if node.else_body is not None: return eval_statements(node.else_body, env)
-	except Skip: pass
+def eval_unless(node, env):
+	for exc in node.unlesses:
+		if eval_expression(exc.unlesses, env): return eval_statements(exc.body, env)
 
 def eval_exception(node, env):
+	"""Run do, then unless on an error; last runs whatever happened, like a Python finally.
+
+	A signal from the last block wins; otherwise a signal (a return) or an
+	error from do or unless goes on after it, and the last block's value is
+	the statement's.
+	"""
 	if node.do_body is not None:
+		ret = None
 		try:
-			eval_statements(node.do_body, env)
-		except Exception as e:
-			for exc in node.errors:
-				if eval_expression(exc.errors, env): return eval_statements(exc.body, env)
+			try:
+				ret = eval_statements(node.do_body, env)
+				# a return leaves the function; quit, continue or skip is caught like an exception
+				caught = type(ret) is Signal and ret.exception is not Return
+			except Exception:
+				caught = True
+			if caught: ret = eval_unless(node, env)
+			# the do block's value is not the statement's
+			elif type(ret) is not Signal: ret = None
 		finally:
-			if node.last_body is not None: return eval_statements(node.last_body, env)
+			if node.last_body is not None:
+				last = eval_statements(node.last_body, env)
+				if type(last) is Signal: return last
+		if node.last_body is None or type(ret) is Signal: return ret
+		return last
 
 def eval_use(node, env):
 	obj = node.obj
@@ -144,14 +197,40 @@ def eval_when(node, env):
 
 def eval_while_loop(node, env):
 	while eval_expression(node.test, env):
-		try: eval_statements(node.body, env)
-		except Quit: break
-		except Continue: pass
-		except Skip: pass 
+		ret = eval_statements(node.body, env)
+		if type(ret) is Signal:
+			if ret is QUIT: break
+			if ret is not CONTINUE and ret is not SKIP: return ret
 	else:
-		try:
-			if node.else_body is not None: return eval_statements(node.else_body, env)
-		except Skip: pass
+		if node.else_body is not None:
+			ret = eval_statements(node.else_body, env)
+			return None if ret is SKIP else ret
+
+
+def eval_range_loop(node, env):
+	start = env.lookup(node.var_name)
+	stop = eval_expression(node.stop, env)
+	if type(start) is not int or type(stop) is not int: return eval_while_loop(node.loop, env)
+	step = node.step
+	if node.inclusive: stop += 1 if step > 0 else -1
+	indices = range(start, stop, step)
+	names = [node.var_name] + [variable.name for variable in node.derived]
+	columns = [indices] + [
+		range(start * variable.scale + variable.offset, stop * variable.scale + variable.offset, step * variable.scale)
+		for variable in node.derived
+	]
+	for values in zip(*columns):
+		for name, value in zip(names, values): env.set(name, value)
+		ret = eval_statements(node.body, env)
+		if type(ret) is Signal:
+			if ret is QUIT: return
+			# the loop as written goes back to its test without stepping
+			if ret is CONTINUE or ret is SKIP: return eval_while_loop(node.loop, env)
+			return ret
+	if indices: env.set(node.var_name, indices[-1] + step)
+	if node.else_body is not None:
+		ret = eval_statements(node.else_body, env)
+		return None if ret is SKIP else ret
 
 
 def eval_for_loop(node, env):
@@ -159,49 +238,66 @@ def eval_for_loop(node, env):
 	collection = eval_expression(node.collection, env)
 	for val in collection:
 		env.set(var_name, val)
-		try: eval_statements(node.body, env)
-		except Quit: break
-		except Continue: pass
-		except Skip: pass 
+		ret = eval_statements(node.body, env)
+		if type(ret) is Signal:
+			if ret is QUIT: break
+			if ret is not CONTINUE and ret is not SKIP: return ret
 
 
-def eval_func_decla(node, env): return env.set(node.name, node)
+class Closure(AST.Closure):
+	"""A user function value; Python code, such as a builtin, can call it directly."""
+
+	__slots__ = ()
+
+	def __call__(self, *args): return call_closure(self, bind_arguments(self, list(args)))
+
+
+def call_closure(function, args):
+	env = Environment(function.env, args, function.function.layout)
+	if function.function.generator:
+		steps = generate(function.function.body, env)
+		return drive(steps) if function.function.sync else steps
+	ret = eval_statements(function.function.body, env)
+	if type(ret) is Signal:
+		if ret.exception is Return: return ret.value
+		ret.throw()
+	return ret
+
+def eval_func_decla(node, env):
+	# a program run without the Resolver lays out the frame here
+	if node.layout is None: node = node._replace(layout=function_layout(node.params, node.body))
+	defaults = tuple(eval_expression(default, env) for default in node.defaults)
+	return env.set(node.name, Closure(node.params, node, env, defaults))
 
 def eval_call_func(node, env):
 	function = eval_expression(node.left, env)
-	n_expected_args = len(function.params)
-	n_actual_args = len(node.arguments)
-	if n_expected_args != n_actual_args:
-		raise TypeError(f'Expected {n_expected_args} arguments, got {n_actual_args}')
-	args = dict(zip(function.params, [eval_expression(node, env) for node in node.arguments]))
-	if isinstance(function, AST.BuiltinFunction):
-		return function.body(args, env)
-	else:
-		call_env = Environment(env, args)
-		try: return eval_statements(function.body, call_env)
-		except Return as ret: return ret.value
-		except Throw as thw: return thw.value
+	args = bind_arguments(function, [eval_expression(node, env) for node in node.arguments])
+	if type(function) is AST.BuiltinFunction:
+		return function.body(*args)
+	return call_closure(function, args)
 
 def eval_class_decla(node, env): return env.set(node.name, node)
 
 def eval_call_class(node, env):
 	function = eval_expression(node.left, env)
-	n_expected_args = len(function.params)
-	n_actual_args = len(node.arguments)
-	if n_expected_args != n_actual_args:
-		raise TypeError(f'Expected {n_expected_args} arguments, got {n_actual_args}')
-	args = dict(zip(function.params, [eval_expression(node, env) for node in node.arguments]))
-	if isinstance(function, AST.BuiltinFunction):
-		return function.body(args, env)
+	args = bind_arguments(function, [eval_expression(node, env) for node in node.arguments])
+	if type(function) is AST.BuiltinFunction:
+		return function.body(*args)
 	else:
-		call_env = Environment(env, args)
-		return eval_statements(function.body, call_env)
+		call_env = Environment(env, dict(zip(function.params, args)))
+		return complete(eval_statements(function.body, call_env))
  
 def eval_identifier(node, env):
-	name = node.value
-	val = env.get(name)
-	if val is None: raise NameError(f'Name "{name}" is not defined')
-	return val
+	address = node.address
+	if address is not None:
+		depth, slot = address
+		frame = env
+		while depth:
+			frame = frame._parent
+			depth -= 1
+		val = frame._slots[slot]
+		if val is not UNSET: return val
+	return env.lookup(node.value)
 
 
 def eval_getitem(node, env):
@@ -222,12 +318,11 @@ def eval_set(node, env): return set({eval_expression(item, env) for item in node
 def eval_shell(node, env): return tuple((eval_expression(item, env) for item in node.items))
 def eval_dict(node, env): return {eval_expression(key, env): eval_expression(value, env) for key, value in node.items}
 
+def eval_range(node, env):
+	step = eval_expression(node.step, env) if node.step is not None else None
+	return make_range(eval_expression(node.start, env), eval_expression(node.stop, env), step, node.closed_start, node.closed_stop)
+
 def eval_return(node, env): return eval_expression(node.value, env) if node.value is not None else None
-def eval_throw(node, env):
-	if node.value is not None:
-		for val in eval_expression(node.value, env):
-			yield val 
-	else: return None
 
 
 evaluators = {
@@ -239,6 +334,7 @@ evaluators = {
 	# AST.Packs: eval_packs,
 	AST.Shell: eval_shell,
 	AST.Dictionary: eval_dict,
+	AST.Range: eval_range,
 	AST.Identifier: eval_identifier,
 	AST.BinaryOperator: eval_bin_op,
 	AST.UnaryOperatorPrefix: eval_unary_op,
@@ -249,13 +345,13 @@ evaluators = {
 	AST.Do: eval_exception,
 	AST.When: eval_when,
 	AST.WhileLoop: eval_while_loop,
+	AST.RangeLoop: eval_range_loop,
 	AST.ForLoop: eval_for_loop,
 	AST.Function: eval_func_decla,
 	AST.Class: eval_class_decla,
 	AST.CallFunction: eval_call_func,
 	AST.CallClass: eval_call_class,
 	AST.Return: eval_return,
-	AST.Throw: eval_throw,
 }
 
 
@@ -273,149 +369,482 @@ def eval_expression(node, env): return eval_node(node, env)
 def eval_statement(node, env): return eval_node(node, env)
 
 
+signals = {AST.Quit: QUIT, AST.Continue: CONTINUE, AST.Skip: SKIP}
+completions = {AST.Return: Return}
+
+
 def eval_statements(statements, env):
+	"""Run a block and return the value of its last statement, or the Signal that stopped it."""
+	ret = None
+	try:
+		for statement in statements:
+			tp = type(statement)
+			if tp in signals: return signals[tp]
+			ret = eval_statement(statement, env)
+			if tp in completions: return Signal(completions[tp], ret)
+			if type(ret) is Signal: return ret
+	except Skip:
+		# a skip that left a called function continues from the calling block
+		return SKIP
+	return ret
+
+
+def complete(ret):
+	"""Raise a Signal that reached the top of a program as its exception."""
+	if type(ret) is Signal: ret.throw()
+	return ret
+
+
+# Generator functions: a call to a function whose body throws returns a
+# Python generator that yields each thrown value. Statements with blocks
+# run through the generator versions of their evaluators below, so a throw
+# in a loop or a condition suspends the whole call until the next value is
+# asked for.
+#
+# A sync function runs the same way, but yields what it waits for: a call
+# returns the coroutine drive() makes of its generator.
+
+def generate(body, env):
+	"""The generator run by a call to a generator function; it returns the function's value."""
+	ret = yield from gen_statements(body, env)
+	if type(ret) is Signal:
+		if ret.exception is Return: return ret.value
+		ret.throw()
+	return ret
+
+
+async def drive(steps):
+	"""Run the generator of a sync function call on the running asyncio event loop.
+
+	Each value it yields is awaited, and the result, or the exception, is
+	sent back in, so a do block around a wait catches what the wait raises.
+	"""
+	value, error = None, None
+	while True:
+		try: awaitable = steps.send(value) if error is None else steps.throw(error)
+		except StopIteration as stop: return stop.value
+		try: value, error = await awaitable, None
+		except Exception as e: value, error = None, e
+
+
+def waited(statement):
+	"""The AST.Wait a statement of a sync function suspends on, or None."""
+	tp = type(statement)
+	if tp is AST.Wait: return statement
+	elif tp is AST.Assignment: value = statement.right
+	elif tp is AST.Return: value = statement.value
+	else: return None
+	return value if type(value) is AST.Wait else None
+
+
+def gen_statements(statements, env):
+	"""eval_statements for a block of a generator function."""
 	ret = None
-	for statement in statements:
-		if isinstance(statement, AST.Quit): raise Quit(ret)
-		elif isinstance(statement, AST.Continue): raise Continue(ret)
-		elif isinstance(statement, AST.Skip): raise Skip(ret)
-		ret = eval_statement(statement, env)
-		if isinstance(statement, AST.Return): raise Return(ret)
-		elif isinstance(statement, AST.Throw): raise Throw(ret)
+	try:
+		for statement in statements:
+			tp = type(statement)
+			if tp in signals: return signals[tp]
+			if tp is AST.Throw:
+				yield eval_expression(statement.value, env) if statement.value is not None else None
+				ret = None
+				continue
+			generator = generators.get(tp)
+			if generator is not None: ret = yield from generator(statement, env)
+			elif waited(statement) is not None: ret = yield from gen_wait(statement, env)
+			else: ret = eval_statement(statement, env)
+			if tp in completions: return Signal(completions[tp], ret)
+			if type(ret) is Signal: return ret
+	except Skip:
+		return SKIP
 	return ret
 
+
+def gen_wait(node, env):
+	"""Suspend on the value a statement waits for, then finish the statement with the result."""
+	value = yield eval_expression(waited(node).value, env)
+	if type(node) is not AST.Assignment: return value
+	if isinstance(node.left, AST.SubscriptOperator): eval_expression(node.left.left, env)[eval_expression(node.left.key, env)] = value
+	else: env.set(node.left.value, value)
+
+
+def gen_condition(node, env):
+	if eval_expression(node.test, env): ret = yield from gen_statements(node.if_body, env)
+	else:
+		for cond in node.elifs:
+			if eval_expression(cond.test, env):
+				ret = yield from gen_statements(cond.body, env)
+				break
+		else:
+			if node.else_body is None: return
+			ret = yield from gen_statements(node.else_body, env)
+	return None if ret is SKIP else ret
+
+def gen_unless(node, env):
+	for exc in node.unlesses:
+		if eval_expression(exc.unlesses, env): return (yield from gen_statements(exc.body, env))
+
+def gen_exception(node, env):
+	if node.do_body is not None:
+		ret = None
+		try:
+			try:
+				ret = yield from gen_statements(node.do_body, env)
+				caught = type(ret) is Signal and ret.exception is not Return
+			except Exception:
+				caught = True
+			if caught: ret = yield from gen_unless(node, env)
+			# the do block's value is not the statement's
+			elif type(ret) is not Signal: ret = None
+		finally:
+			if node.last_body is not None:
+				last = yield from gen_statements(node.last_body, env)
+				if type(last) is Signal: return last
+		if node.last_body is None or type(ret) is Signal: return ret
+		return last
+
+def gen_when(node, env):
+	test = eval_expression(node.test, env)
+	for pattern in node.patterns:
+		if eval_expression(pattern.pattern, env) == test:
+			return (yield from gen_statements(pattern.body, env))
+	if node.else_body is not None:
+		return (yield from gen_statements(node.else_body, env))
+
+
+def gen_while_loop(node, env):
+	while eval_expression(node.test, env):
+		ret = yield from gen_statements(node.body, env)
+		if type(ret) is Signal:
+			if ret is QUIT: break
+			if ret is not CONTINUE and ret is not SKIP: return ret
+	else:
+		if node.else_body is not None:
+			ret = yield from gen_statements(node.else_body, env)
+			return None if ret is SKIP else ret
+
+
+def gen_for_loop(node, env):
+	var_name = node.var_name
+	for val in eval_expression(node.collection, env):
+		env.set(var_name, val)
+		ret = yield from gen_statements(node.body, env)
+		if type(ret) is Signal:
+			if ret is QUIT: break
+			if ret is not CONTINUE and ret is not SKIP: return ret
+
+
+generators = {
+	AST.Condition: gen_condition,
+	AST.Do: gen_exception,
+	AST.When: gen_when,
+	AST.WhileLoop: gen_while_loop,
+	# the counting loop runs as the while loop it replaces
+	AST.RangeLoop: lambda node, env: gen_while_loop(node.loop, env),
+	AST.ForLoop: gen_for_loop,
+}
+
+class Memo(object):
+	"""Body of a memo() function: calls `function` through an LRU cache keyed by the arguments.
+
+	Calls with an unhashable argument, such as a list, skip the cache.
+	"""
+
+	__slots__ = ('function', 'cached', 'uncached')
+
+	def __init__(self, function, size):
+		self.function = function
+		self.cached = functools.lru_cache(size)(function)
+		self.uncached = 0
+
+	def __call__(self, *args):
+		try: hash(args)
+		except TypeError:
+			self.uncached += 1
+			return self.function(*args)
+		return self.cached(*args)
+
+	def stats(self):
+		info = self.cached.cache_info()
+		return {'hits': info.hits, 'misses': info.misses, 'uncached': self.uncached, 'size': info.currsize, 'max_size': info.maxsize}
+
+	def clear(self):
+		self.cached.cache_clear()
+		self.uncached = 0
+
+
+def _signature(function):
+	"""(params, defaults) of a Cup function, or of a plain Python function (the python backend's)."""
+	if hasattr(function, 'params'): return function.params, function.defaults
+	code = function.__code__
+	return code.co_varnames[:code.co_argcount], function.__defaults__ or ()
+
+
+def memo(function, size):
+	"""`function` with its results cached; `size` caps the entries (null: unbounded)."""
+	params, defaults = _signature(function)
+	return AST.BuiltinFunction(params, Memo(function, size), defaults)
+
+
+def _memo_body(function):
+	if type(function) is not AST.BuiltinFunction or type(function.body) is not Memo:
+		raise TypeError('Expected a function made by memo')
+	return function.body
+
+
+def cut(obj, start, stop, step):
+	"""obj[start:stop:step] as a list; a range stays a lazy range."""
+	part = obj[start:stop:step]
+	return part if type(part) is range else list(part)
+
+
+def chunk(obj, size):
+	"""Lists of `size` consecutive items of `obj`, read as they are asked for; the last may be shorter."""
+	if size < 1: raise ValueError(f'Chunk size must be positive, not {size}')
+	items = iter(obj)
+	while True:
+		part = list(itertools.islice(items, size))
+		if not part: return
+		yield part
+
+
+def lines(path):
+	"""The lines of the text file at `path` without their line ends, read one at a time."""
+	with open(path) as f:
+		for line in f: yield line.rstrip('\n')
+
+
+def _read_text(path):
+	with open(path) as f: return f.read()
+
+
+async def spawn(command):
+	"""The output of the shell `command`; a command that fails raises RuntimeError."""
+	process = await asyncio.create_subprocess_shell(command, stdout=asyncio.subprocess.PIPE)
+	output, _ = await process.communicate()
+	if process.returncode: raise RuntimeError(f'Command failed with status {process.returncode}: {command}')
+	return output.decode()
+
+
+async def gather(awaitables):
+	"""The results of `awaitables`, waited for concurrently, in order."""
+	return list(await asyncio.gather(*awaitables))
+
+
+def pmap(obj, function, size):
+	# Parallel builds functions for every backend, so it is imported on first use
+	from Cup import Parallel
+	return Parallel.pmap(obj, function, size)
+
 # for the future
 def add_builtins(env):
+	# name: (params, function called with the arguments in order[, defaults of the last params])
 	builtins = {
 
 		# input/output system
-		'read': (['inp'], lambda args, e: input(args['inp'])),
-		'say': (['out'], lambda args, e: print(args['out'])),	
+		'read': (['inp'], input),
+		'say': (['out'], print),	
 
 		# string, list, ... function
-		'size': (['obj'], lambda args, e: len(args['obj'])),
-		'cut': (['obj', 'start', 'stop', 'step'], lambda args, e: list(args['obj'][args['start']:args['stop']])),
-		'swap': (['obj', 'obj1', 'obj2'], lambda args, e: args['obj'].replace([args['obj1'], args['obj2']])),
-		'invert': (['obj'], lambda args, e: args['obj'][::-1]),
-		'sort': (['obj'], lambda args, e: sorted(args['obj'])),
-		'add':(['obj1', 'obj'], lambda args, e: args['obj'].append(args['obj1'])),
-		'find': (['obj1', 'obj'], lambda args, e: args['obj'].find(args['obj1'])),
-		'count': (['obj1', 'obj'], lambda args, e: args['obj'].count(args['obj1'])),
-		'erase': (['obj1', 'obj'], lambda args, e: args['obj'].remove(args['obj1'])),			
-		'clear': (['obj'], lambda args, e: args['obj'].clear()),			
-		'upcase': (['str'], lambda args, e: args['str'].upper()),
-		'lowcase': (['str'], lambda args, e: args['str'].lower()),
-		'isupcase': (['str'], lambda args, e: args['str'].isupper()),
-		'islowcase': (['str'], lambda args, e: args['str'].islower()),
-		'title': (['str'], lambda args, e: args['str'].title()),
-		'istitle': (['str'], lambda args, e: args['str'].istitle()),
-		'isalpha': (['str'], lambda args, e: args['str'].isalpha()),
-		'isdigit': (['str'], lambda args, e: args['str'].isdigit()),
-		'isascii': (['str'], lambda args, e: args['str'].isascii()),
-		'translate': (['str', 'lang'], lambda args, e: args['str'].translate(args['lang'])),
-		'keys': (['obj'], lambda args, e: args['obj'].keys()),
-		'values': (['obj'], lambda args, e: args['obj'].values()),
-		'items': (['obj'], lambda args, e: args['obj'].items()),		
-		'copy': (['obj'], lambda args, e: args['obj'].copy()),
-		'join': (['txt', 'obj'], lambda args, e: args['obj'].join(args['txt'])),
-		'split': (['txt', 'obj'], lambda args, e: args['txt'].split(args['obj'] if args['obj'] else " ")),
+		'size': (['obj'], len),
+		'cut': (['obj', 'start', 'stop', 'step'], cut, (None, None, None)),
+		'swap': (['obj', 'obj1', 'obj2'], lambda obj, obj1, obj2: obj.replace([obj1, obj2])),
+		'invert': (['obj'], lambda obj: obj[::-1]),
+		'sort': (['obj'], sorted),
+		'add':(['obj1', 'obj'], lambda obj1, obj: obj.append(obj1)),
+		'find': (['obj1', 'obj'], lambda obj1, obj: obj.find(obj1)),
+		'count': (['obj1', 'obj'], lambda obj1, obj: obj.count(obj1)),
+		'erase': (['obj1', 'obj'], lambda obj1, obj: obj.remove(obj1)),			
+		'clear': (['obj'], lambda obj: obj.clear()),			
+		'upcase': (['str'], lambda str: str.upper()),
+		'lowcase': (['str'], lambda str: str.lower()),
+		'isupcase': (['str'], lambda str: str.isupper()),
+		'islowcase': (['str'], lambda str: str.islower()),
+		'title': (['str'], lambda str: str.title()),
+		'istitle': (['str'], lambda str: str.istitle()),
+		'isalpha': (['str'], lambda str: str.isalpha()),
+		'isdigit': (['str'], lambda str: str.isdigit()),
+		'isascii': (['str'], lambda str: str.isascii()),
+		'translate': (['str', 'lang'], lambda str, lang: str.translate(lang)),
+		'keys': (['obj'], lambda obj: obj.keys()),
+		'values': (['obj'], lambda obj: obj.values()),
+		'items': (['obj'], lambda obj: obj.items()),		
+		'copy': (['obj'], lambda obj: obj.copy()),
+		'join': (['txt', 'obj'], lambda txt, obj: obj.join(txt)),
+		'split': (['txt', 'obj'], lambda txt, obj: txt.split(obj if obj else " "), (None,)),
 
 		# converter
-		'ordinal': (['obj'], lambda args, e: ord(args['obj'])),'ord': (['obj'], lambda args, e: ord(args['obj'])),
-		'string': (['obj'], lambda args, e: str(args['obj'])),'str': (['obj'], lambda args, e: str(args['obj'])),
-		'char': (['obj'], lambda args, e: chr(args['obj'])),'chr': (['obj'], lambda args, e: chr(args['obj'])),
-		'integer': (['obj'], lambda args, e: int(args['obj'])),'int': (['obj'], lambda args, e: int(args['obj'])),
-		'decimal': (['obj'], lambda args, e: float(args['obj'])),'dec': (['obj'], lambda args, e: float(args['obj'])),
-		'complex': (['obj'], lambda args, e: complex(args['obj'])),'cmplx': (['obj'], lambda args, e: complex(args['obj'])),
-		'logic': (['obj'], lambda args, e: bool(args['obj'])),'bool': (['iter'], lambda args, e: list(args['iter'])),
-		'list': (['iter'], lambda args, e: list(args['iter'])),
-		'set': (['iter'], lambda args, e: set(args['iter'])),
-		'shell': (['iter'], lambda args, e: tuple(args['iter'])),
-		'dict': (['iter'], lambda args, e: dict(args['iter'])),
-		'bin': (['obj'], lambda args, e: bin(args['obj'])),
-		'hex': (['obj'], lambda args, e: hex(args['obj'])),
-		'oct': (['obj'], lambda args, e: oct(args['obj'])),
+		'ordinal': (['obj'], ord),'ord': (['obj'], ord),
+		'string': (['obj'], str),'str': (['obj'], str),
+		'char': (['obj'], chr),'chr': (['obj'], chr),
+		'integer': (['obj'], int),'int': (['obj'], int),
+		'decimal': (['obj'], float),'dec': (['obj'], float),
+		'complex': (['obj'], complex),'cmplx': (['obj'], complex),
+		'logic': (['obj'], bool),'bool': (['iter'], list),
+		'list': (['iter'], list),
+		'set': (['iter'], set),
+		'shell': (['iter'], tuple),
+		'dict': (['iter'], dict),
+		'bin': (['obj'], bin),
+		'hex': (['obj'], hex),
+		'oct': (['obj'], oct),
 		# math function
-		'round': (['obj'], lambda args, e: round(args['obj'])),
-		'abs': (['obj'],  lambda args, e: abs(args['obj'])),
-		'sqrt': (['obj'], lambda args, e: math.sqrt(args['obj'])),
-		'cbrt': (['obj'], lambda args, e: args['obj']**(1/3)),
-		'pow': (['obj', 'obj1'], lambda args, e: pow(args['obj'], args['obj1'])),
-		'max': (['obj'], lambda args, e: max(args['obj'])),
-		'min': (['obj'], lambda args, e: min(args['obj'])),
-		'solve': (['obj'], lambda args, e: eval(args['obj'])),
-		'lcm': (['obj'], lambda args, e: math.lcm(args['obj'])),
-		'gcd': (['obj'], lambda args, e: math.gcd(args['obj'])),
-		'sum': (['obj'], lambda args, e: sum(args['obj'])),		
-		'prod': (['obj'], lambda args, e: math.prod(args['obj'])),	
-		'ceil': (['obj'], lambda args, e: math.ceil(args['obj'])),	
-		'floor': (['obj'], lambda args, e: math.floor(args['obj'])),	
-		'factorial': (['obj'], lambda args, e: math.factorial(args['obj'])),	
-		'log': (['base', 'obj'], lambda args, e: math.log(args['obj'], args['base'])),	
-		'sin': (['obj'], lambda args, e: math.sin(args['obj'])),	
-		'cos': (['obj'], lambda args, e: math.cos(args['obj'])),	
-		'tan': (['obj'], lambda args, e: math.tan(args['obj'])),
-		'sinh': (['obj'], lambda args, e: math.sinh(args['obj'])),	
-		'cosh': (['obj'], lambda args, e: math.cosh(args['obj'])),	
-		'tanh': (['obj'], lambda args, e: math.tanh(args['obj'])),
-		'asin': (['obj'], lambda args, e: math.asin(args['obj'])),	
-		'acos': (['obj'], lambda args, e: math.acos(args['obj'])),	
-		'atan': (['obj'], lambda args, e: math.atan(args['obj'])),
-		'asinh': (['obj'], lambda args, e: math.asinh(args['obj'])),	
-		'acosh': (['obj'], lambda args, e: math.acosh(args['obj'])),	
-		'atanh': (['obj'], lambda args, e: math.atanh(args['obj'])),	
-		'deg': (['obj'], lambda args, e: math.degrees(args['obj'])),	
-		'rad': (['obj'], lambda args, e: math.radians(args['obj'])),		
+		'round': (['obj'], round),
+		'abs': (['obj'], abs),
+		'sqrt': (['obj'], math.sqrt),
+		'cbrt': (['obj'], lambda obj: obj**(1/3)),
+		'pow': (['obj', 'obj1'], lambda obj, obj1: pow(obj, obj1)),
+		'max': (['obj'], max),
+		'min': (['obj'], min),
+		'solve': (['obj'], lambda obj: eval(obj)),
+		'lcm': (['obj'], math.lcm),
+		'gcd': (['obj'], math.gcd),
+		'sum': (['obj'], sum),		
+		'prod': (['obj'], math.prod),	
+		'ceil': (['obj'], math.ceil),	
+		'floor': (['obj'], math.floor),	
+		'factorial': (['obj'], math.factorial),	
+		'log': (['base', 'obj'], lambda base, obj: math.log(obj, base)),	
+		'sin': (['obj'], math.sin),	
+		'cos': (['obj'], math.cos),	
+		'tan': (['obj'], math.tan),
+		'sinh': (['obj'], math.sinh),	
+		'cosh': (['obj'], math.cosh),	
+		'tanh': (['obj'], math.tanh),
+		'asin': (['obj'], math.asin),	
+		'acos': (['obj'], math.acos),	
+		'atan': (['obj'], math.atan),
+		'asinh': (['obj'], math.asinh),	
+		'acosh': (['obj'], math.acosh),	
+		'atanh': (['obj'], math.atanh),	
+		'deg': (['obj'], math.degrees),	
+		'rad': (['obj'], math.radians),		
 		# other function
-		'limit': (['start', 'stop', 'step'], lambda args, e: range(args['start'], args['stop'], args['step'])),
-		'about': (['obj'], lambda args, e: dir(args['obj'])),		
-		'typeof': (['obj'], lambda args, e: type(args['obj'])),
-		'enum': (['obj'], lambda args, e: enumerate(args['obj'])),
-		'all': (['obj'], lambda args, e: all(args['obj'])),
-		'any': (['obj'], lambda args, e: any(args['obj'])),
-		'merge': (['obj1', 'obj2'], lambda args, e: zip(args['obj1'], args['obj2'])),
-		'run': (['code'], lambda args, e: exec(args['code'])),
-		'filter': (['obj', 'cond'], lambda args, e: filter(args['cond'], args['obj'])),
-		'id': (['obj'], lambda args, e: id(args['obj'])),
+		'limit': (['start', 'stop', 'step'], range, (1,)),
+		'about': (['obj'], dir),		
+		'typeof': (['obj'], type),
+		'enum': (['obj'], enumerate),
+		'all': (['obj'], all),
+		'any': (['obj'], any),
+		'merge': (['obj1', 'obj2'], lambda obj1, obj2: zip(obj1, obj2)),
+		'run': (['code'], lambda code: exec(code)),
+		'filter': (['obj', 'cond'], lambda obj, cond: filter(cond, obj)),
+		'id': (['obj'], id),
+		'memo': (['function', 'size'], memo, (128,)),
+		'memostats': (['function'], lambda function: _memo_body(function).stats()),
+		'memoclear': (['function'], lambda function: _memo_body(function).clear()),
+		# streams: lazy, they read their input one item at a time
+		'map': (['obj', 'function'], lambda obj, function: map(function, obj)),
+		'take': (['obj', 'n'], itertools.islice),
+		'chunk': (['obj', 'size'], chunk),
+		'lines': (['path'], lines),
+		'pmap': (['obj', 'function', 'size'], pmap, (64,)),
+		# sync: each returns something to wait for, in a sync function
+		'sleep': (['seconds', 'value'], asyncio.sleep, (None,)),
+		'readfile': (['path'], lambda path: asyncio.to_thread(_read_text, path)),
+		'spawn': (['command'], spawn),
+		'gather': (['awaitables'], gather),
+		'runsync': (['coroutine'], asyncio.run),
 
 	}
-	for key, (params, func) in builtins.items():
-		env.set(key, AST.BuiltinFunction(params, func))
+	for key, builtin in builtins.items():
+		env.set(key, AST.BuiltinFunction(*builtin))
+
+
+class Builtins(Environment):
+	"""The builtin functions, as a read-only frame.
+
+	One instance is built at import time and is the parent of every global
+	environment, so assigning a builtin's name in a program shadows it in
+	that environment only.
+	"""
+
+	def __init__(self):
+		super().__init__()
+		env = Environment()
+		add_builtins(env)
+		self._names, self._slots = env._names, env._slots
+
+	def declare(self, key): raise TypeError('The builtins are read-only')
+
+	def set(self, key, val): raise TypeError('The builtins are read-only')
+
+BUILTINS = Builtins()
 
 
 def create_global_env():
-	env = Environment()
-	add_builtins(env)
-	return env
+	"""An empty global frame on top of the shared BUILTINS."""
+	return Environment(BUILTINS)
 
 
-def evaluate_env(s, env, verbose=False):
+def parse_program(s, optimize=True):
+	"""Lex, parse and optimize `s` without printing anything.
+
+	A CupSyntaxError is raised with its source_line filled in.
+	"""
 	lexer = Lexer()
-	try: tokens = lexer.tokenize(s)
+	try:
+		program = Parser().parse(TokenStream(lexer.tokenize_buffer(s)))
+		check_arity(program)
 	except CupSyntaxError as err:
-		report_error(lexer, err)
-		if verbose: raise
-		else: return
-
-	if verbose:
+		err.source_line = lexer.source_lines[err.ln - 1]
+		raise
+	return Optimizer.optimize(program) if optimize else program
+
+
+def parse(s, verbose=False, optimize=True, cache=None):
+	"""Lex and parse `s` (a str or a buffer from Lexer.open_source), then run the Optimizer unless `optimize` is false.
+
+	Given a Cache.Cache, a source seen before is loaded from it instead; verbose
+	runs bypass it so that every stage is printed.
+	"""
+	if cache is not None and not verbose:
+		key = cache.key(s, optimize)
+		program = cache.load(key)
+		if program is None:
+			program = parse(s, verbose, optimize)
+			if program is not None: cache.store(key, program)
+		return program
+
+	if not verbose:
+		try: return parse_program(s, optimize)
+		except CupSyntaxError as err:
+			report_error(None, err)
+			return
+
+	# verbose: the same stages, printing each one
+	lexer = Lexer()
+	try:
+		tokens = lexer.tokenize_buffer(s)
 		print('Tokens')
-		print_tokens(tokens)
+		print_tokens(list(tokens))
 		print()
+		program = Parser().parse(TokenStream(tokens))
+	except CupSyntaxError as err:
+		report_error(lexer, err)
+		raise
 
-	token_stream = TokenStream(tokens)
-
-	try: program = Parser().parse(token_stream)
+	print('AST')
+	print_ast(program.body)
+	print()
+	try: check_arity(program)
 	except CupSyntaxError as err:
 		report_error(lexer, err)
-		if verbose: raise
-		else: return
+		raise
 
-	if verbose:
-		print('AST')
-		print_AST(program.body)
+	if optimize:
+		program = Optimizer.optimize(program, print)
+		print('Optimized AST')
+		print_ast(program.body)
 		print()
 
-	ret = eval_statements(program.body, env)
+	return program
+
+
+def evaluate_env(s, env, verbose=False, optimize=True, cache=None):
+	program = parse(s, verbose, optimize, cache)
+	if program is None: return
+
+	ret = complete(eval_statements(resolve(program, env).body, env))
 
 	if verbose:
 		print('Environment')
@@ -425,5 +854,5 @@ def evaluate_env(s, env, verbose=False):
 	return ret
 
 
-def evaluate(s, verbose=False):
-	return evaluate_env(s, create_global_env(), verbose)
+def evaluate(s, verbose=False, optimize=True, cache=None):
+	return evaluate_env(s, create_global_env(), verbose, optimize, cache)
@@ -1,8 +1,12 @@
 
 
 
-import re
+from array import array
 from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+import mmap
+import os
+import re
 
 from Cup.Errors import CupSyntaxError as LexerError
 from Cup.Setup import iteritems
@@ -39,25 +43,22 @@ def decode_num(s):
 	try: return int(s)
 	except ValueError: return float(s)
 
-# def decode_logic(s):
-# 	try: return True
-# 	except ValueError: False
+def decode_logic(s): return {'true': True, 'false': False, 'null': None}[s]
 
 class Lexer(object):
 
 	rules = [
 		('COMMENT', r'//.*'), # comment line
-		('STRING', r'"(\\"|[^"])*"'),
-		('STRING', r"'(\\'|[^'])*'"),
+		('STRING', r'"(\\"|[^"\r\n])*"'),
+		('STRING', r"'(\\'|[^'\r\n])*'"),
 		('NUMBER', r'\d*\.\d+|\d+\.\d*|\d+'), # float + integer
-		('LOGIC', r'true|false|null'),		
+		('LOGIC', r'(?:true|false|null)\b'),		
 		('NAME', r'[a-zA-Z_]\w*'), # indentifier
 		('WHITESPACE', r'[ \t]+'),
-		('NEWLINE', r'\n+'),
 		('OPERATOR', r'&&|\|\||\^\^|<<|>>'), # bitwises operators 
 		('OPERATOR', r'\+|\-|\*|/|\\|%|\^'), # arithmetic operators
 		('OPERATOR', r'<=>|><|<=|>=|==|!=|<|>'), # comparison operators
-		('OPERATOR', r'&|\||!|and|or|not'), # boolean operators		
+		('OPERATOR', r'&|\||!'), # boolean operators, and the word_operators		
 		('OPERATOR', r'\?|~|\+|\-'), # unary operator
 		('ASSIGN', '='),
 		('COLON', ':'),
@@ -82,6 +83,9 @@ class Lexer(object):
 		'sync':'SYNC',      'elif':'ELIF',      'if':'IF',			'in': 'IN',  'last': 'LAST', 'unless': 'UNLESS',
 	}
 
+	# names that are operators rather than identifiers
+	word_operators = frozenset(['and', 'or', 'not'])
+
 	ignore_tokens = [
 		'WHITESPACE',
 		'COMMENT',
@@ -90,13 +94,33 @@ class Lexer(object):
 	decoders = {
 		'STRING': decode_str,
 		'NUMBER': decode_num,
-		# 'LOGIC': decode_logic,
+		'LOGIC': decode_logic,
+	}
+
+	# scanner-only rules around the token rules: line breaks are counted
+	# rather than returned, and a character no rule accepts is reported
+	line_rule = ('EOL', r'\r\n?|\n')
+	error_rule = ('ERROR', r'.')
+
+	# in a bytes buffer (an mmap'd file) a name may also contain UTF-8 sequences
+	bytes_rules = {
+		'NAME': r'[a-zA-Z_\x80-\xff][\w\x80-\xff]*',
 	}
 
 	def __init__(self):
-		self.source_lines = []
+		self._source = ''
+		self._source_lines = None
 		self._regex = self._compile_rules(self.rules)
 
+	@property
+	def source_lines(self):
+		"""Lines of the last scanned source, only split when an error is reported."""
+		if self._source_lines is None:
+			source = self._source
+			if not isinstance(source, str): source = bytes(source).decode('utf-8', 'replace')
+			self._source_lines = [line.rstrip() for line in re.split(r'\r\n?|\n', source)]
+		return self._source_lines
+
 	def _convert_rules(self, rules):
 		grouped_rules = OrderedDict()
 		for name, pattern in rules:
@@ -104,95 +128,212 @@ class Lexer(object):
 			grouped_rules[name].append(pattern)
 
 		for name, patterns in iteritems(grouped_rules):
-			joined_patterns = '|'.join(['({})'.format(p) for p in patterns])
+			joined_patterns = '|'.join(['(?:{})'.format(p) for p in patterns])
 			yield f'(?P<{name}>{joined_patterns})'
 
-	def _compile_rules(self, rules):
-		return re.compile('|'.join(self._convert_rules(rules)))
-
-	def _tokenize_line(self, line, line_num):
-		pos = 0
-		while pos < len(line):
-			matches = self._regex.match(line, pos)
-			if matches is not None:
-				name = matches.lastgroup
-				pos = matches.end(name)
-				if name not in self.ignore_tokens:
-					value = matches.group(name)
-					if name in self.decoders:
-						value = self.decoders[name](value)
-					elif name == 'NAME' and value in self.keywords:
-						name = self.keywords[value]
-						value = None
-					yield Token(name, value, line_num, matches.start() + 1)
-			else:
-				raise LexerError(f'Unexpected character {line[pos]}', line_num, pos + 1)
-
-	def _count_leading_characters(self, line, char):
-		count = 0
-		for c in line:
-			if c != char: break
-			count += 1
-		return count
-
-	def _detect_indent(self, line):
-		if line[0] in (' ', '\t'):
-			return line[0] * self._count_leading_characters(line, line[0])
+	def _scanner_pattern(self, rules):
+		# whitespace is skipped as the prefix of the next match rather than
+		# being a match of its own, which halves the matches to go through
+		whitespace = [pattern for name, pattern in rules if name == 'WHITESPACE']
+		rules = [self.line_rule] + [rule for rule in rules if rule[0] != 'WHITESPACE'] + [self.error_rule]
+		return '(?:{})?(?:{})'.format('|'.join(whitespace), '|'.join(self._convert_rules(rules)))
 
-	def tokenize(self, s):
+	def _compile_rules(self, rules):
+		return re.compile(self._scanner_pattern(rules))
+
+	def _compile_bytes_rules(self):
+		rules = [(name, self.bytes_rules.get(name, pattern)) for name, pattern in self.rules]
+		return re.compile(self._scanner_pattern(rules).encode())
+
+	def iter_tokens(self, source):
+		"""Scan `source` in a single pass, yielding tokens as they are found.
+
+		`source` is a str, or a bytes-like buffer such as an mmap'd file (see
+		open_source) whose values are decoded as UTF-8; columns then count bytes.
+		Indentation is measured from each line's leading whitespace with the
+		unit of the first indented line, and only lines holding a token emit
+		INDENT/DEDENT and NEWLINE.
+		"""
+		return map(Token._make, self._scan(source))
+
+	def _scan(self, source):
+		# the single pass behind iter_tokens and tokenize_buffer, yielding plain tuples
+		self._source = source
+		self._source_lines = None
+		text = isinstance(source, str)
+		regex = self._regex if text else self._compile_bytes_rules()
+		keywords = self.keywords
+		word_operators = self.word_operators
+		decoders = self.decoders
+		ignore_tokens = self.ignore_tokens
 		indent_symbol = None
-		tokens = []
 		last_indent_level = 0
-		line_num = 0
-		for line_num, line in enumerate(s.splitlines(), 1):
-			line = line.rstrip()
-
-			if not line:
-				self.source_lines.append('')
+		line_num = 1
+		line_start = 0
+		line_end = 0
+		has_tokens = False
+		for matches in regex.finditer(source):
+			name = matches.lastgroup
+			if name == 'EOL':
+				if has_tokens: yield ('NEWLINE', None, line_num, line_end - line_start + 1)
+				line_num += 1
+				line_start = matches.end()
+				has_tokens = False
 				continue
-
-			if indent_symbol is None:
-				indent_symbol = self._detect_indent(line)
-
-			if indent_symbol is not None:
-				indent_level = line.count(indent_symbol)
-				line = line[indent_level*len(indent_symbol):]
-			else:
+			start = matches.start(name)
+			value = matches.group(name)
+			if not text: value = value.decode('utf-8')
+			if name == 'ERROR':
+				raise LexerError(f'Unexpected character {value}', line_num, start - line_start + 1)
+			line_end = matches.end()
+			if name in ignore_tokens: continue
+			if name in decoders:
+				value = decoders[name](value)
+			elif name == 'NAME':
+				if value in keywords:
+					name = keywords[value]
+					value = None
+				elif value in word_operators: name = 'OPERATOR'
+			if not has_tokens:
+				has_tokens = True
 				indent_level = 0
+				if start != line_start:
+					leading = source[line_start:start]
+					# the indent unit is a run of one character, so the level is how
+					# many units fit in the run of that character the line starts with
+					if indent_symbol is None:
+						indent_symbol = leading[:len(leading) - len(leading.lstrip(leading[:1]))]
+					indent_level = (len(leading) - len(leading.lstrip(indent_symbol[:1]))) // len(indent_symbol)
+				if indent_level > last_indent_level:
+					for _ in range(indent_level - last_indent_level): yield ('INDENT', None, line_num, 0)
+				elif indent_level < last_indent_level:
+					for _ in range(last_indent_level - indent_level): yield ('DEDENT', None, line_num, 0)
+				last_indent_level = indent_level
+			yield (name, value, line_num, start - line_start + 1)
+
+		if has_tokens: yield ('NEWLINE', None, line_num, line_end - line_start + 1)
+		if last_indent_level > 0:
+			# the last line is the one before a trailing line break
+			if line_start == len(source): line_num -= 1
+			for _ in range(last_indent_level): yield ('DEDENT', None, line_num, 0)
 
-			self.source_lines.append(line)
+	def tokenize_buffer(self, s):
+		"""Scan `s` like iter_tokens into a TokenBuffer, without building a Token per token."""
+		return TokenBuffer(self._scan(s))
 
-			line_tokens = list(self._tokenize_line(line, line_num))
-			if line_tokens:
-				if indent_level != last_indent_level:
-					if indent_level > last_indent_level:
-						tokens.extend([Token('INDENT', None, line_num, 0)] * (indent_level - last_indent_level))
-					elif indent_level < last_indent_level:
-						tokens.extend([Token('DEDENT', None, line_num, 0)] * (last_indent_level - indent_level))
-					last_indent_level = indent_level
+	def tokenize(self, s):
+		return list(self.iter_tokens(s))
+
+
+@contextmanager
+def open_source(path):
+	"""Map a Cup file read-only for the Lexer, without reading it into memory."""
+	with open(path, 'rb') as f:
+		if os.fstat(f.fileno()).st_size == 0:
+			yield b''
+			return
+		with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as source:
+			yield source
+
+
+# Every token kind, numbered for the kind codes of a TokenBuffer
+kinds = tuple(OrderedDict.fromkeys(
+	['NEWLINE', 'INDENT', 'DEDENT'] + [name for name, _ in Lexer.rules] + list(Lexer.keywords.values())
+))
+kind_codes = {kind: code for code, kind in enumerate(kinds)}
+END = len(kinds)
+
+
+class TokenBuffer(object):
+	"""Tokens stored column by column instead of one Token object each.
+
+	Kind codes (indexes into `kinds`) are kept in an array('B'), lines and
+	columns in array('I'), and values as ids into `constants`, a side table
+	that holds each distinct value once, with id 0 for no value. A Token is
+	only built when one is read.
+	"""
+
+	def __init__(self, tokens=()):
+		self.kinds = array('B')
+		self.lines = array('I')
+		self.columns = array('I')
+		self.values = array('I')
+		self.constants = [None]
+		self._constant_ids = {}
+		self.extend(tokens)
+
+	def extend(self, tokens):
+		"""Append (name, value, line, column) tuples or Tokens."""
+		add_kind = self.kinds.append
+		add_line = self.lines.append
+		add_column = self.columns.append
+		add_value = self.values.append
+		constants = self.constants
+		constant_ids = self._constant_ids
+		for name, value, line, column in tokens:
+			add_kind(kind_codes[name])
+			add_line(line)
+			add_column(column)
+			if value is None:
+				add_value(0)
+				continue
+			# True, 1 and 1.0 are equal keys, so only strings are their own key
+			key = value if type(value) is str else (type(value), value)
+			value_id = constant_ids.get(key)
+			if value_id is None:
+				value_id = constant_ids[key] = len(constants)
+				constants.append(value)
+			add_value(value_id)
 
-				tokens.extend(line_tokens)
-				tokens.append(Token('NEWLINE', None, line_num, len(line) + 1))
+	def __len__(self):
+		return len(self.kinds)
 
-		if last_indent_level > 0:
-			tokens.extend([Token('DEDENT', None, line_num, 0)] * last_indent_level)
+	def __getitem__(self, i):
+		return Token(kinds[self.kinds[i]], self.constants[self.values[i]], self.lines[i], self.columns[i])
 
-		return tokens
+	def __iter__(self):
+		return map(self.__getitem__, range(len(self)))
 
 
 class TokenStream(object):
+	"""Reads a TokenBuffer for the Parser.
+
+	Tokens are matched by kind code (see `kinds`), and kind() and value()
+	look at the current token without building a Token for it.
+	"""
 
 	def __init__(self, tokens):
-		self._tokens = tokens
+		self._tokens = tokens if isinstance(tokens, TokenBuffer) else TokenBuffer(tokens)
+		self._kinds = self._tokens.kinds
 		self._pos = 0
 
-	def consume_expected(self, *args):
-		token = None
-		for expected_name in args:
-			token = self.consume()
-			if token.name != expected_name:
-				raise LexerError(f'Expected {expected_name}, got {token.name}', token.line, token.column)
-		return token
+	def kind(self):
+		"""Kind code of the current token, END past the last one."""
+		pos = self._pos
+		return self._kinds[pos] if pos < len(self._kinds) else END
+
+	def value(self):
+		tokens = self._tokens
+		return tokens.constants[tokens.values[self._pos]]
+
+	def consume_value(self):
+		"""Skip the current token and return its value."""
+		value = self.value()
+		self._pos += 1
+		return value
+
+	def expect(self, *expected_kinds):
+		"""Skip tokens of the given kinds, in order."""
+		for expected in expected_kinds:
+			if self.kind() != expected:
+				token = self.current()
+				raise LexerError(f'Expected {kinds[expected]}, got {token.name}', token.line, token.column)
+			self._pos += 1
+
+	def consume_expected(self, *expected_kinds):
+		"""Skip tokens of the given kinds and return the last one."""
+		self.expect(*expected_kinds)
+		return self._tokens[self._pos - 1]
 
 	def consume(self):
 		token = self.current()
@@ -212,4 +353,4 @@ class TokenStream(object):
 			raise LexerError('End expected', token.line, token.column)
 
 	def is_end(self):
-		return self._pos == len(self._tokens)
+		return self._pos == len(self._kinds)
@@ -0,0 +1,71 @@
+import operator
+
+
+# Cup operators and the Python functions that implement them, shared by every backend
+
+simple_operations = {
+	'+': operator.add,
+	'-': operator.sub,
+	'*': operator.mul,
+	'/': operator.truediv,
+	'\\': operator.floordiv,
+	'%': operator.mod,
+	'^': operator.pow,
+	'<<': operator.lshift,
+	'>>': operator.rshift,
+	'&&': operator.and_,
+	'||':operator.or_,
+	'^^': operator.xor,
+	'>': operator.gt,
+	'>=': operator.ge,
+	'<': operator.lt,
+	'<=': operator.le,
+	'==': operator.eq,
+	'!=': operator.ne,
+	'><': lambda obj1, obj2: False if set(obj1) & set(obj2) else True,
+	'<=>': lambda obj1, obj2: float(obj1) == float(obj2),
+	'in': lambda obj1, obj2: obj1 in obj2,
+	'not in': lambda obj1, obj2: obj1 not in obj2,
+	'is': operator.is_,
+	'is not': operator.is_not,
+}
+
+# logical operators as functions of both truth values, for folding constants
+lazy_operations = {
+	'&': lambda obj1, obj2: obj1 and obj2,
+	'and': lambda obj1, obj2: obj1 and obj2,
+	'|': lambda obj1, obj2: obj1 or obj2,
+	'or': lambda obj1, obj2: obj1 or obj2,
+}
+
+# the backends evaluate the right operand of a logical operator only when
+# the left one's truth value is not the one that decides the result
+short_circuits = {
+	'&': False,
+	'and': False,
+	'|': True,
+	'or': True,
+}
+
+unary_operations = {
+	'+': operator.pos,
+	'-': operator.neg,
+	'!': operator.not_,
+	'not': operator.not_,
+	'?': lambda obj: type(obj),
+	'~': lambda obj: round(obj),
+}
+
+
+def make_range(start, stop, step, closed_start, closed_stop):
+	"""The lazy Python range for the Cup range literal from `start` to `stop`.
+
+	It counts down when `stop` is below `start`: the step is always given as
+	a positive size. An open bound is left out, so `(0;10;2]` is 2, 4, .. 10.
+	"""
+	if step is None: step = 1
+	elif step <= 0: raise ValueError(f'Range step must be positive, not {step}')
+	if stop < start: step = -step
+	if not closed_start: start += step
+	if closed_stop: stop += 1 if step > 0 else -1
+	return range(start, stop, step)
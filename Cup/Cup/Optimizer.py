@@ -0,0 +1,464 @@
+"""Constant folding, dead-branch elimination and loop optimization over the AST.
+
+Runs between the parser and the backends. Every rewrite keeps what a program
+does: an operation that would raise is left to raise at run time, and a block
+keeps the value of its last statement.
+"""
+from Cup import AST
+from Cup.Operators import simple_operations, lazy_operations, unary_operations
+from Cup.Resolver import declared_names
+
+
+CONSTANTS = (AST.Number, AST.String, AST.Logic)
+
+
+def constant(value):
+	"""The literal node for a folded value, or None when it has no literal form."""
+	if value is None or isinstance(value, bool): return AST.Logic(value)
+	elif isinstance(value, (int, float)): return AST.Number(value)
+	elif isinstance(value, str): return AST.String(value)
+
+
+def _worth_folding(operator, left, right):
+	# huge powers, shifts and string repetitions are cheaper to leave to run time
+	if operator in ('^', '<<') and isinstance(right, (int, float)) and abs(right) > 64: return False
+	if operator == '*' and (isinstance(left, str) or isinstance(right, str)): return False
+	return True
+
+
+def _fold(operation, *args):
+	try: return constant(operation(*args))
+	except Exception: return None
+
+
+def optimize_bin_op(node):
+	left = optimize_node(node.left)
+	right = optimize_node(node.right)
+	if type(left) in CONSTANTS and type(right) in CONSTANTS and _worth_folding(node.operator, left.value, right.value):
+		if node.operator in simple_operations: folded = _fold(simple_operations[node.operator], left.value, right.value)
+		elif node.operator in lazy_operations: folded = _fold(lazy_operations[node.operator], bool(left.value), bool(right.value))
+		else: folded = None
+		if folded is not None: return folded
+	return node._replace(left=left, right=right)
+
+
+def optimize_unary_op(node):
+	right = optimize_node(node.right)
+	if type(right) in CONSTANTS and node.operator in unary_operations:
+		folded = _fold(unary_operations[node.operator], right.value)
+		if folded is not None: return folded
+	return node._replace(right=right)
+
+
+optimizers = {
+	AST.BinaryOperator: optimize_bin_op,
+	AST.UnaryOperatorPrefix: optimize_unary_op,
+}
+
+
+def optimize_node(node):
+	if isinstance(node, list): return [optimize_node(item) for item in node]
+	elif isinstance(node, tuple) and not hasattr(node, '_fields'): return tuple(optimize_node(item) for item in node)
+	elif not hasattr(node, '_fields'): return node
+	tp = type(node)
+	if tp in optimizers: return optimizers[tp](node)
+	return tp(*[
+		optimize_statements(value) if field.endswith('body') and value is not None else optimize_node(value)
+		for field, value in zip(node._fields, node)
+	])
+
+
+def _contains(node, types):
+	"""Whether `node` has a node of one of `types` outside nested function declarations."""
+	if isinstance(node, (list, tuple)) and not hasattr(node, '_fields'): return any(_contains(item, types) for item in node)
+	elif not hasattr(node, '_fields') or type(node) is AST.Function: return False
+	return type(node) in types or any(_contains(value, types) for value in node)
+
+
+def _unconditional(body):
+	"""Statements for a branch that always runs.
+
+	A condition catches a skip from its body, or from a function its body
+	calls, so only a body that can do neither is spliced into the block.
+	"""
+	if _contains(body, (AST.Skip, AST.CallFunction, AST.CallClass)):
+		return [AST.Condition(AST.Logic(True), body, [], None)]
+	return body
+
+
+def optimize_condition(node):
+	branches = [(node.test, node.if_body)] + [(cond.test, cond.body) for cond in node.elifs]
+	kept = []
+	else_body = node.else_body
+	for test, body in branches:
+		test = optimize_node(test)
+		if type(test) in CONSTANTS:
+			if not test.value: continue
+			else_body = body # every later arm is unreachable
+			break
+		kept.append((test, optimize_statements(body)))
+	else_body = optimize_statements(else_body) if else_body is not None else None
+	if not kept: return _unconditional(else_body) if else_body is not None else []
+	elifs = [AST.ConditionElif(test, body) for test, body in kept[1:]]
+	return [AST.Condition(kept[0][0], kept[0][1], elifs, else_body)]
+
+
+def optimize_while_loop(node):
+	test = optimize_node(node.test)
+	if type(test) in CONSTANTS and not test.value:
+		# the else block of a loop that never runs: it still catches skip
+		return _unconditional(optimize_statements(node.else_body)) if node.else_body is not None else []
+	else_body = optimize_statements(node.else_body) if node.else_body is not None else None
+	return [AST.WhileLoop(test, optimize_statements(node.body), else_body)]
+
+
+def optimize_when(node):
+	test = optimize_node(node.test)
+	patterns = []
+	else_body = node.else_body
+	for pattern in node.patterns:
+		value = optimize_node(pattern.pattern)
+		if type(test) in CONSTANTS and type(value) in CONSTANTS:
+			if value.value != test.value: continue
+			else_body = pattern.body # every later arm is unreachable
+			break
+		patterns.append(AST.WhenPattern(value, optimize_statements(pattern.body)))
+	else_body = optimize_statements(else_body) if else_body is not None else None
+	# unlike a condition, when lets a skip through, so an arm that always runs is spliced as is
+	if not patterns: return else_body if else_body is not None else []
+	return [AST.When(test, patterns, else_body)]
+
+
+statement_optimizers = {
+	AST.Condition: optimize_condition,
+	AST.WhileLoop: optimize_while_loop,
+	AST.When: optimize_when,
+}
+
+
+def optimize_statement(node):
+	"""Optimize one statement into the statements that replace it, possibly none."""
+	tp = type(node)
+	if tp in statement_optimizers: return statement_optimizers[tp](node)
+	return [optimize_node(node)]
+
+
+def _is_pure(node):
+	tp = type(node)
+	if tp in CONSTANTS: return True
+	elif tp is AST.List or tp is AST.Shell: return all(_is_pure(item) for item in node.items)
+	elif tp is AST.Dictionary: return all(type(key) in CONSTANTS and _is_pure(value) for key, value in node.items)
+	return False
+
+
+def optimize_statements(statements):
+	"""Optimize a block, dropping statements without effect but keeping the block's value."""
+	body = []
+	replacement = []
+	for statement in statements:
+		replacement = optimize_statement(statement)
+		body.extend(replacement)
+	if statements and not replacement: body.append(AST.Logic(None))
+	return [statement for statement in body[:-1] if not _is_pure(statement)] + body[-1:]
+
+
+# Loop pass
+
+EXPRESSIONS = CONSTANTS + (
+	AST.Identifier, AST.BinaryOperator, AST.UnaryOperatorPrefix, AST.SubscriptOperator,
+	AST.CallFunction, AST.CallClass, AST.List, AST.Shell, AST.Dictionary, AST.Range,
+)
+# a wait suspends the function: like a call, what follows may see other effects
+CALLS = (AST.CallFunction, AST.CallClass, AST.Wait)
+OPERATIONS = (AST.BinaryOperator, AST.UnaryOperatorPrefix)
+
+# comparison seen from the other side, for `stop > i` and the like
+MIRRORED = {'<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+# operators that look into a container or at its identity: never hoisted
+MEMBERSHIP = ('in', 'not in', 'is', 'is not')
+
+
+def _source(node):
+	"""Short Cup text of an expression, for reports."""
+	tp = type(node)
+	if tp is AST.Identifier: return node.value
+	elif tp is AST.Logic: return {True: 'true', False: 'false', None: 'null'}[node.value]
+	elif tp in CONSTANTS: return repr(node.value)
+	elif tp is AST.UnaryOperatorPrefix: return f'{node.operator}{_operand(node.right)}'
+	elif tp is AST.BinaryOperator: return f'{_operand(node.left)} {node.operator} {_operand(node.right)}'
+	return '...'
+
+def _operand(node): return f'({_source(node)})' if type(node) is AST.BinaryOperator else _source(node)
+
+
+def _same(node1, node2):
+	"""Structural equality that, unlike tuple equality, tells Number(1) from Logic(True)."""
+	if type(node1) is not type(node2): return False
+	elif not hasattr(node1, '_fields'): return node1 == node2
+	return all(_same(value1, value2) for value1, value2 in zip(node1, node2))
+
+
+def _find(node, found):
+	for index, other in enumerate(found):
+		if _same(node, other): return index
+
+
+def _collect(node, match, found):
+	"""Append the largest subexpressions for which `match` holds, outside nested function declarations."""
+	if isinstance(node, (list, tuple)) and not hasattr(node, '_fields'):
+		for item in node: _collect(item, match, found)
+	elif not hasattr(node, '_fields') or type(node) is AST.Function: return
+	elif match(node):
+		if _find(node, found) is None: found.append(node)
+	else:
+		for value in node: _collect(value, match, found)
+
+
+def _substitute(node, old, new):
+	"""Replace every expression of `old` by the matching one of `new`, outside nested function declarations."""
+	if isinstance(node, list): return [_substitute(item, old, new) for item in node]
+	elif isinstance(node, tuple) and not hasattr(node, '_fields'): return tuple(_substitute(item, old, new) for item in node)
+	elif not hasattr(node, '_fields') or type(node) is AST.Function: return node
+	if type(node) in OPERATIONS:
+		index = _find(node, old)
+		if index is not None: return new[index]
+	return type(node)(*[_substitute(value, old, new) for value in node])
+
+
+def _base(node):
+	"""The name under a chain of subscripts, as `a` of `a[i][j]`, or None."""
+	while type(node) is AST.SubscriptOperator: node = node.left
+	if type(node) is AST.Identifier: return node.value
+
+
+def _mutated(node, names):
+	"""Add the names whose value `node` may change in place: bases of subscript stores and call arguments."""
+	if isinstance(node, (list, tuple)) and not hasattr(node, '_fields'):
+		for item in node: _mutated(item, names)
+		return names
+	elif not hasattr(node, '_fields'): return names
+	tp = type(node)
+	if tp is AST.Assignment and type(node.left) is AST.SubscriptOperator: names.add(_base(node.left))
+	elif tp is AST.CallFunction or tp is AST.CallClass: names.update(_base(argument) for argument in node.arguments)
+	for value in node: _mutated(value, names)
+	return names
+
+
+def _is_alias(node):
+	return type(node) is AST.Assignment and type(node.left) is AST.Identifier and type(node.right) is AST.Identifier
+
+
+def _aliases(statements):
+	"""The `x = y` assignments of a scope, outside nested function declarations."""
+	aliases = []
+	_collect(statements, _is_alias, aliases)
+	return [(alias.left.value, alias.right.value) for alias in aliases]
+
+
+def _assigned(loop, aliases, local):
+	"""Names a loop may rebind or change in place, with the names `aliases` (see _aliases) ties to them.
+
+	A call can change any container it reaches, so in a loop that calls or
+	waits every name it reads outside `local` (the function's own names, or
+	None at the top level) may change. An alias made any other way, such as
+	through a list or a parameter, is not seen.
+	"""
+	mutated = _mutated([loop.test, loop.body], set())
+	if _contains([loop.test, loop.body], CALLS):
+		identifiers = []
+		_collect([loop.test, loop.body], lambda node: type(node) is AST.Identifier, identifiers)
+		mutated.update(node.value for node in identifiers if local is None or node.value not in local)
+	while True:
+		more = {name for alias in aliases for name in alias if alias[0] in mutated or alias[1] in mutated} - mutated
+		if not more: break
+		mutated |= more
+	mutated.discard(None)
+	return set(declared_names(loop.body, [])) | mutated
+
+
+def _invariant(node, assigned):
+	"""Whether an expression is the same on every iteration of a loop that assigns `assigned` (see _assigned)."""
+	tp = type(node)
+	if tp in CONSTANTS: return True
+	elif tp is AST.Identifier: return node.value not in assigned
+	elif tp is AST.BinaryOperator:
+		if node.operator in MEMBERSHIP: return False
+		return _invariant(node.left, assigned) and _invariant(node.right, assigned)
+	elif tp is AST.UnaryOperatorPrefix: return _invariant(node.right, assigned)
+	return False
+
+
+def _every_iteration(loop):
+	"""Expressions that each iteration evaluates, in order, until it can branch or stop."""
+	yield loop.test
+	for statement in loop.body:
+		tp = type(statement)
+		if tp is AST.Assignment:
+			if type(statement.left) is AST.SubscriptOperator:
+				yield statement.left.left
+				yield statement.left.key
+			yield statement.right
+		elif tp in EXPRESSIONS: yield statement
+		else: return
+
+
+def _hoistable(node, assigned, found):
+	"""Collect the largest invariant operations `node` evaluates before its first call.
+
+	Returns False once a call is reached: what follows may see its effects.
+	"""
+	tp = type(node)
+	if tp in OPERATIONS and _invariant(node, assigned):
+		if _find(node, found) is None: found.append(node)
+		return True
+	elif tp is AST.BinaryOperator:
+		if not _hoistable(node.left, assigned, found): return False
+		# the right operand of a logical operator may not be evaluated
+		if node.operator in lazy_operations: return not _contains(node.right, CALLS)
+		return _hoistable(node.right, assigned, found)
+	elif tp is AST.UnaryOperatorPrefix: return _hoistable(node.right, assigned, found)
+	elif tp is AST.SubscriptOperator: return _hoistable(node.left, assigned, found) and _hoistable(node.key, assigned, found)
+	elif tp is AST.List or tp is AST.Shell: return all(_hoistable(item, assigned, found) for item in node.items)
+	elif tp is AST.Range:
+		return all(_hoistable(bound, assigned, found) for bound in (node.start, node.stop, node.step) if bound is not None)
+	elif tp is AST.Wait:
+		_hoistable(node.value, assigned, found)
+		return False
+	elif tp in CALLS:
+		if _hoistable(node.left, assigned, found): all(_hoistable(argument, assigned, found) for argument in node.arguments)
+		return False
+	return not _contains(node, CALLS)
+
+
+def _step(node, var_name):
+	"""The constant step of `var_name = node`, for `var_name + c`, `c + var_name` or `var_name - c`."""
+	if type(node) is not AST.BinaryOperator: return
+	left, right = node.left, node.right
+	if node.operator == '+' and type(left) is AST.Number: left, right = right, left
+	if type(left) is not AST.Identifier or left.value != var_name: return
+	if type(right) is not AST.Number or type(right.value) is not int or not right.value: return
+	if node.operator == '+': return right.value
+	elif node.operator == '-': return -right.value
+
+
+def _affine(node, var_name):
+	"""(scale, offset) when `node` is var_name * scale + offset in integer literals."""
+	tp = type(node)
+	if tp is AST.Identifier and node.value == var_name: return (1, 0)
+	elif tp is AST.Number and type(node.value) is int: return (0, node.value)
+	elif tp is not AST.BinaryOperator or node.operator not in ('+', '-', '*'): return
+	left, right = _affine(node.left, var_name), _affine(node.right, var_name)
+	if left is None or right is None: return
+	if node.operator == '+': return (left[0] + right[0], left[1] + right[1])
+	elif node.operator == '-': return (left[0] - right[0], left[1] - right[1])
+	elif left[0] == 0: return (left[1] * right[0], left[1] * right[1])
+	elif right[0] == 0: return (left[0] * right[1], left[1] * right[1])
+
+
+class LoopOptimizer(object):
+	"""Rewrites while loops: hoists invariant expressions and turns counting loops into RangeLoops.
+
+	An invariant expression is one built from literals and names the loop
+	never assigns, stores into or passes to a call (without `in` or `is`,
+	which look into a container). In a loop that calls anything, only the
+	function's own names can be invariant. It is hoisted only from code every
+	iteration runs before it can branch or call (the test and the leading
+	simple statements), into a temporary assigned once under `if <test>:`. So
+	a loop that never runs evaluates nothing more. The one difference is when
+	the hoisted expression raises: earlier assignments of the first iteration
+	no longer happen first. The temporaries are named __cup_hoisted<n>, which
+	Environment.asdict leaves out.
+
+	`while i < n:` ... `i = i + c` becomes a RangeLoop when the body assigns
+	i only in that last statement and n is invariant. Integer expressions
+	i * a + b in its body become induction variables stepped alongside i.
+	"""
+
+	def __init__(self, report=None):
+		self.report = report
+		self._temps = 0
+		self._aliases = []
+		self._locals = None
+
+	def _temp(self, prefix):
+		self._temps += 1
+		return f'__cup_{prefix}{self._temps}'
+
+	def _walk(self, node):
+		if isinstance(node, list): return [self._walk(item) for item in node]
+		elif isinstance(node, tuple) and not hasattr(node, '_fields'): return tuple(self._walk(item) for item in node)
+		elif not hasattr(node, '_fields'): return node
+		elif type(node) is AST.Function: return self._function(node)
+		node = type(node)(*[self._walk(value) for value in node])
+		return self._while_loop(node) if type(node) is AST.WhileLoop else node
+
+	def _function(self, node):
+		outer = self._aliases, self._locals
+		self._aliases = _aliases(node.body)
+		self._locals = set(node.params) | set(declared_names(node.body, []))
+		try: return AST.Function(*[self._walk(value) for value in node])
+		finally: self._aliases, self._locals = outer
+
+	def _while_loop(self, loop):
+		changes = []
+		hoisted = []
+		if not _contains(loop.test, CALLS):
+			assigned = _assigned(loop, self._aliases, self._locals)
+			for expression in _every_iteration(loop):
+				if not _hoistable(expression, assigned, hoisted): break
+		temps = [AST.Identifier(self._temp('hoisted')) for _ in hoisted]
+		new_loop = _substitute(loop._replace(else_body=None), hoisted, temps)._replace(else_body=loop.else_body)
+		changes.extend(f'hoisted {_source(expression)}' for expression in hoisted)
+
+		range_loop = self._range_loop(new_loop, changes)
+		if range_loop is not None: new_loop = range_loop
+
+		if self.report is not None and changes:
+			self.report(f'Loop optimizer: while {_source(loop.test)}: {", ".join(changes)}')
+		if not hoisted: return new_loop
+		assignments = [AST.Assignment(temp, expression) for temp, expression in zip(temps, hoisted)]
+		return AST.Condition(loop.test, assignments + [new_loop], [], loop.else_body)
+
+	def _range_loop(self, loop, changes):
+		test = loop.test
+		if type(test) is not AST.BinaryOperator or test.operator not in MIRRORED: return
+		last = loop.body[-1]
+		if type(last) is not AST.Assignment or type(last.left) is not AST.Identifier: return
+		var_name = last.left.value
+		step = _step(last.right, var_name)
+		if step is None: return
+		if type(test.left) is AST.Identifier and test.left.value == var_name: operator, stop = test.operator, test.right
+		elif type(test.right) is AST.Identifier and test.right.value == var_name: operator, stop = MIRRORED[test.operator], test.left
+		else: return
+		if (step > 0) != (operator in ('<', '<=')): return
+		body = loop.body[:-1]
+		if var_name in declared_names(body, []) or not _invariant(stop, _assigned(loop, self._aliases, self._locals)): return
+		changes.append(f'range loop over {var_name}')
+
+		reduced = []
+		def reducible(node):
+			if type(node) is not AST.BinaryOperator: return False
+			affine = _affine(node, var_name)
+			return affine is not None and affine[0] != 0
+		_collect(body, reducible, reduced)
+		derived = []
+		for expression in reduced:
+			scale, offset = _affine(expression, var_name)
+			derived.append(AST.InductionVariable(self._temp('index'), scale, offset))
+			changes.append(f'reduced {_source(expression)}')
+		body = _substitute(body, reduced, [AST.Identifier(variable.name) for variable in derived])
+		return AST.RangeLoop(var_name, stop, operator in ('<=', '>='), step, derived, body, loop.else_body, loop)
+
+	def optimize(self, program):
+		self._aliases = _aliases(program.body)
+		return AST.Program(self._walk(program.body))
+
+
+def optimize(program, report=None):
+	"""Return `program` with constants folded, unreachable code removed and loops optimized.
+
+	`report`, when given, is called with a line describing each transformed loop.
+	"""
+	program = AST.Program(optimize_statements(program.body))
+	return LoopOptimizer(report).optimize(program)
@@ -0,0 +1,198 @@
+"""pmap: a Cup function mapped over a stream of items in worker processes.
+
+	for square in pmap(limit(1000000), slow_square, 256):
+		say(square)
+
+A function value cannot be pickled as it is: its environment ends in the
+BUILTINS frame, whose bodies are Python lambdas, and the closure and python
+backends hold compiled Python objects. `ship` takes it apart into a Shipped
+declaration (an AST.Function, a Bytecode.Code or a marshalled Python code
+object) with its default values, plus the globals it reads, user functions
+among them shipped in turn. Builtins stay behind, every worker has its own.
+A worker builds the function again once per payload, in a fresh global
+environment, for the backend it came from.
+
+Items go out in chunks of `size`; a few chunks per worker are in flight at a
+time and the results come back in order, as the stream is read.
+"""
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import marshal
+import os
+import pickle
+import types
+
+from Cup import AST, Compiler, Transpiler, VM
+from Cup.Bytecode import Code
+from Cup.Interpreter import BUILTINS, Closure, chunk, create_global_env
+from Cup.Resolver import resolve
+
+
+# backend: the function value's kind; declaration: what the worker rebuilds it from
+Shipped = namedtuple('Shipped', ['backend', 'name', 'declaration', 'defaults'])
+
+# chunks in flight for each worker
+WINDOW = 2
+
+
+def _identifiers(node, names):
+	"""Every name an AST reads or binds, nested functions included."""
+	if type(node) is AST.Identifier: names.add(node.value)
+	elif isinstance(node, (list, tuple)):
+		for item in node: _identifiers(item, names)
+	return names
+
+
+def _code_names(code, names):
+	"""The names a Bytecode.Code and the functions declared in it look up outside their frames."""
+	names.update(name for name in code.names if name not in code.varnames)
+	for constant in code.constants:
+		if type(constant) is Code: _code_names(constant, names)
+	return names
+
+
+def _python_names(code, names):
+	# leaving out the helpers the Transpiler adds to every namespace
+	names.update(Transpiler.unmangle(name) for name in code.co_names if name not in Transpiler.helpers and name != 'Exception')
+	for constant in code.co_consts:
+		if type(constant) is types.CodeType: _python_names(constant, names)
+	return names
+
+
+def _is_builtin(name, value):
+	builtin = BUILTINS.get(name)
+	if builtin is None: return False
+	# the python backend sees the builtins through Transpiler.Builtin wrappers
+	return value is builtin or type(value) is Transpiler.Builtin and value.body is builtin.body
+
+
+def _take_apart(function):
+	"""(Shipped, free names, environment to look them up in) of a user function."""
+	tp = type(function)
+	if tp is Closure:
+		node = function.function
+		names = _identifiers(node.body, set()) - set(node.layout.names)
+		return Shipped('tree', node.name, node, function.defaults), names, function.env.lookup
+	if tp is Compiler.CompiledClosure:
+		node = function.function.node
+		names = _identifiers(node.body, set()) - set(function.function.layout.names)
+		return Shipped('closure', node.name, node, function.defaults), names, function.env.lookup
+	if tp is VM.Function:
+		return Shipped('vm', function.name, function.code, function.defaults), _code_names(function.code, set()), function.env.lookup
+	if tp is types.FunctionType:
+		if function.__closure__: raise TypeError(f'{function.__name__} is declared in another function, it cannot be sent to a worker process')
+		namespace = function.__globals__
+		def lookup(name):
+			try: return namespace[Transpiler.mangle(name)]
+			except KeyError: raise NameError(name)
+		declaration = marshal.dumps(function.__code__)
+		return Shipped('python', Transpiler.unmangle(function.__name__), declaration, function.__defaults__ or ()), _python_names(function.__code__, set()), lookup
+	raise TypeError('Only user functions can be sent to a worker process')
+
+
+def ship(function):
+	"""(Shipped function, globals by name) for `function`: picklable, as long as the values it reads are.
+
+	Raises TypeError for a builtin or a memo() function, and for a function
+	the python backend declared in another function.
+	"""
+	shipped = {}
+	def visit(function):
+		declaration, names, lookup = _take_apart(function)
+		for name in sorted(names):
+			if name in shipped: continue
+			try: value = lookup(name)
+			except NameError: continue
+			if _is_builtin(name, value): continue
+			shipped[name] = None # a recursive function reads itself
+			shipped[name] = visit(value) if _is_function(value) else value
+		return declaration
+	root = visit(function)
+	return root, shipped
+
+
+def _is_function(value):
+	return type(value) in (Closure, Compiler.CompiledClosure, VM.Function, types.FunctionType, AST.BuiltinFunction, Transpiler.Builtin)
+
+
+def rebuild(root, shipped):
+	"""The function `ship` took apart, in a fresh global environment."""
+	env = create_global_env()
+	for name in shipped: env.declare(name)
+	functions = []
+	for name, value in shipped.items():
+		if type(value) is Shipped: functions.append((name, value))
+		else: env.set(name, value)
+	# the python backend's globals are read from the environment once: declare the others first
+	functions.sort(key=lambda item: item[1].backend == 'python')
+	for name, declaration in functions:
+		function = _build(declaration, env)
+		env.set(name, function)
+		if declaration.backend == 'python': Transpiler.namespace_for(env)[Transpiler.mangle(name)] = function
+	return _build(root, env)
+
+
+def _build(shipped, env):
+	backend, name, declaration, defaults = shipped
+	if backend == 'tree':
+		node = resolve(AST.Program([declaration]), env).body[0]
+		return Closure(node.params, node, env, defaults)
+	if backend == 'closure':
+		return Compiler.CompiledClosure(declaration.params, Compiler.compile_function(declaration), env, defaults)
+	if backend == 'vm': return VM.make_function(declaration, env, defaults)
+	return types.FunctionType(marshal.loads(declaration), Transpiler.namespace_for(env), Transpiler.mangle(name), defaults or None)
+
+
+# the last functions a worker rebuilt, by payload digest
+_rebuilt = {}
+
+
+def _map_chunk(key, payload, items):
+	function = _rebuilt.get(key)
+	if function is None:
+		if len(_rebuilt) >= 16: _rebuilt.clear()
+		function = _rebuilt[key] = rebuild(*pickle.loads(payload))
+	return [function(item) for item in items]
+
+
+_pool = None
+_workers = None
+
+
+def set_workers(workers=None):
+	"""Use `workers` processes from now on (None: one per CPU); shuts the current pool down."""
+	global _pool, _workers
+	if _pool is not None: _pool.shutdown()
+	_pool = None
+	_workers = workers
+
+
+def pool():
+	"""The shared ProcessPoolExecutor, started on first use and kept warm between maps."""
+	global _pool
+	if _pool is None: _pool = ProcessPoolExecutor(_workers)
+	return _pool
+
+
+def pmap(obj, function, size=64):
+	"""`function` applied to each item of `obj` in worker processes: a stream of the results, in order."""
+	if size < 1: raise ValueError(f'Chunk size must be positive, not {size}')
+	shipped = ship(function)
+	try: payload = pickle.dumps(shipped, pickle.HIGHEST_PROTOCOL)
+	except (pickle.PicklingError, TypeError, AttributeError) as e:
+		raise TypeError(f'{shipped[0].name} reads a value that cannot be sent to a worker process: {e}') from None
+	return _stream(hashlib.sha256(payload).hexdigest(), payload, obj, size)
+
+
+def _stream(key, payload, obj, size):
+	executor = pool()
+	window = WINDOW * (_workers or os.cpu_count() or 1)
+	pending = deque()
+	try:
+		for part in chunk(obj, size):
+			pending.append(executor.submit(_map_chunk, key, payload, part))
+			if len(pending) >= window: yield from pending.popleft().result()
+		while pending: yield from pending.popleft().result()
+	finally:
+		for future in pending: future.cancel()
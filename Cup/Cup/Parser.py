@@ -1,7 +1,18 @@
-
-
 from Cup import AST
 from Cup.Errors import CupSyntaxError
+from Cup.Lexer import END, kind_codes
+
+
+# token kind codes, see Cup.Lexer.kinds
+(
+	NUMBER, STRING, LOGIC, NAME, OPERATOR, ASSIGN, COLON, LPAREN, RPAREN, LBRACK, RBRACK, LCBRACK, RCBRACK, COMMA, SEMICOLON,
+	NEWLINE, INDENT, DEDENT, FUNCTION, CLASS, IF, ELIF, ELSE, USE, OF, DO, UNLESS, LAST, WHEN, IS, WHILE, FOR, IN,
+	RETURN, THROW, QUIT, CONTINUE, SKIP, SYNC, WAIT,
+) = (kind_codes[name] for name in (
+	'NUMBER', 'STRING', 'LOGIC', 'NAME', 'OPERATOR', 'ASSIGN', 'COLON', 'LPAREN', 'RPAREN', 'LBRACK', 'RBRACK', 'LCBRACK', 'RCBRACK', 'COMMA', 'SEMICOLON',
+	'NEWLINE', 'INDENT', 'DEDENT', 'FUNCTION', 'CLASS', 'IF', 'ELIF', 'ELSE', 'USE', 'OF', 'DO', 'UNLESS', 'LAST', 'WHEN', 'IS', 'WHILE', 'FOR', 'IN',
+	'RETURN', 'THROW', 'QUIT', 'CONTINUE', 'SKIP', 'SYNC', 'WAIT',
+))
 
 
 class ParserError(CupSyntaxError):
@@ -10,450 +21,513 @@ class ParserError(CupSyntaxError):
 		super(ParserError, self).__init__(message, token.line, token.column)
 
 
-def enter_scope(parser, name):
-	class State(object):
-		def __enter__(self): parser.scope.append(name)
-		def __exit__(self, exc_type, exc_val, exc_tb): parser.scope.pop()
-	return State()
+def dispatch_table(subparsers, default=None):
+	"""A tuple indexed by token kind code (END included) from a {kind: subparser} dict."""
+	return tuple(subparsers.get(kind, default) for kind in range(END + 1))
 
 
+# Subparsers hold no state: each is created once, below its class, and
+# shared through the dispatch tables. Per-parse state lives on the Parser.
 class Subparser(object):
 
 	PRECEDENCE = {
 		'call': 14, 'subscript': 14,
-		'^': 13, 
+		'^': 13,
 		'unary': 12,
-		'*': 11, '/': 11, '\\': 11, '%': 11, 
-		'+': 10, '-': 10, 
-		'<<': 9, '>>': 9, 
+		'*': 11, '/': 11, '\\': 11, '%': 11,
+		'+': 10, '-': 10,
+		'<<': 9, '>>': 9,
 		'&&': 8,
 		'^^': 7,
 		'||': 6,
-		'==': 5, '!=': 5, '><': 5, '<=>': 5,
-		'>': 4, '>=': 4, '<': 4, '<=': 4, 
+		'==': 5, '!=': 5, '><': 5, '<=>': 5, 'in': 5, 'not in': 5, 'is': 5, 'is not': 5,
+		'>': 4, '>=': 4, '<': 4, '<=': 4,
 		'&': 3, 'and':3,
-		'|': 2, 'or': 3,
+		'|': 2, 'or': 2,
 
 	}
 
-	def get_subparser(self, token, subparsers, default=None):
-		cls = subparsers.get(token.name, default)
-		if cls is not None: return cls()
-
-
-class PrefixSubparser(Subparser):
-	def parse(self, parser, tokens): raise NotImplementedError()
-
-
-class InfixSubparser(Subparser):
-	def parse(self, parser, tokens, left): raise NotImplementedError()
-	def get_precedence(self, token): raise NotImplementedError()
-
-
-# number expression: NUMBER
-class NumberExpression(PrefixSubparser):
-	
-	def parse(self, parser, tokens):
-		token = tokens.consume_expected('NUMBER')
-		return AST.Number(token.value)
-
-
-# string expression: STRING
-class StringExpression(PrefixSubparser):
-
-	def parse(self, parser, tokens):
-		token = tokens.consume_expected('STRING')
-		return AST.String(token.value)
-
-
-# name expression: NAME
-class NameExpression(PrefixSubparser):
-
-	def parse(self, parser, tokens):
-		token = tokens.consume_expected('NAME')
-		return AST.Identifier(token.value)
-
-# logic expression: LOGIC
-class LogicExpression(PrefixSubparser):
-
-	def parse(self, parser, tokens):
-		token = tokens.consume_expected('LOGIC')
-		return AST.Logic(token.value)
-
-# prefix expression: OPERATOR expr
-
-class UnaryOperatorExpression(PrefixSubparser):
-
-	SUPPORTED_OPERATORS = ['!', 'not', '+', '-', '?', '~']
-	def parse(self, parser, tokens):
-		token = tokens.consume_expected('OPERATOR')
-		if token.value not in self.SUPPORTED_OPERATORS:
-			raise ParserError(f'Unary operator {token.value} is not supported', token)
-		right = Expression().parse(parser, tokens, self.get_precedence(token))
-		# left = Expression().parse(parser, tokens, self.get_precedence(token))
-		if right is None: raise ParserError(f'Expected expression {token.value}', tokens.consume())
-		# elif left: return AST.UnaryOperatorPostfix(token.value, left) 
-		return AST.UnaryOperatorPrefix(token.value, right)
-		
-
-	def get_precedence(self, token): return self.PRECEDENCE['unary']
+	# whether parse() is a generator that yields the generators of nested blocks (see run)
+	nested = False
+
+
+def run(generator):
+	"""Drive a nested subparser generator and return its value.
+
+	Where a subparser would call the parser of a nested block, it yields that
+	parser's generator instead and is sent back its value, so the nesting
+	depth of blocks is bounded by memory rather than by the recursion limit.
+	"""
+	stack = []
+	value = None
+	while True:
+		try: request = generator.send(value)
+		except StopIteration as stop:
+			if not stack: return stop.value
+			generator = stack.pop()
+			value = stop.value
+			continue
+		stack.append(generator)
+		generator = request
+		value = None
+
+
+# what the expression being parsed belongs to
+TOP, GROUP, LIST, DICT_KEY, DICT_VALUE, CALL, SUBSCRIPT, RANGE = range(8)
+
+# states of the expression parser
+OPERAND, INFIX, MISSING = range(3)
+
+# literals and names: the node built from the token's value
+atom_nodes = dispatch_table({
+	NUMBER: AST.Number,
+	STRING: AST.String,
+	LOGIC: AST.Logic,
+	NAME: AST.Identifier,
+})
+
+
+def _reduce(operands, operators):
+	precedence, operator, unary = operators.pop()
+	right = operands.pop()
+	if unary: operands.append(AST.UnaryOperatorPrefix(operator, right))
+	else: operands[-1] = AST.BinaryOperator(operator, operands[-1], right)
+
+
+# expr: atom | OPERATOR expr | expr OPERATOR expr
+#     | LPAREN expr RPAREN | LBRACK list_of expression? RBRACK | LCBRACK (expr COLON expr COMMA)* RCBRACK
+#     | (LBRACK | LPAREN) expr SEMICOLON expr (SEMICOLON expr)? (RBRACK | RPAREN)
+#     | expr LPAREN list_of expression? RPAREN | expr LBRACK expr RBRACK
+class Expression(Subparser):
+	"""Operator precedence parsing on explicit stacks.
 
+	Operands and pending operators are kept on two lists, and a bracketed
+	expression (group, list, dictionary, call arguments or subscript key)
+	pushes a context rather than recursing, so neither long operator chains
+	nor deep nesting use the Python stack. A group or list whose first
+	expression is followed by ';' turns into a range. Binary operators are left
+	associative, a prefix operator binds tighter than every binary operator
+	but '^', and calls and subscripts bind tightest.
+	"""
 
-# group expression: LPAREN expr RPAREN
-class GroupExpression(PrefixSubparser):
+	UNARY_OPERATORS = frozenset(['!', 'not', '+', '-', '?', '~'])
 
 	def parse(self, parser, tokens):
-		tokens.consume_expected('LPAREN')
-		right = Expression().parse(parser, tokens)
-		tokens.consume_expected('RPAREN')
-		return right
-
-
-# list expression: LBRACK list_of expression? RBRACK
-class ListExpression(PrefixSubparser):
+		PRECEDENCE = self.PRECEDENCE
+		unary_precedence = PRECEDENCE['unary']
+		operands = []
+		operators = [] # (precedence, operator, unary)
+		contexts = []
+		calls = [] # the `(` tokens of the open calls
+		context, base, items, left = TOP, 0, None, None
+		state = OPERAND
+		while True:
+			if state == OPERAND:
+				kind = tokens.kind()
+				node = atom_nodes[kind]
+				if node is not None:
+					operands.append(node(tokens.consume_value()))
+					state = INFIX
+					continue
+				if kind == OPERATOR:
+					token = tokens.consume()
+					if token.value not in self.UNARY_OPERATORS:
+						raise ParserError(f'Unary operator {token.value} is not supported', token)
+					operators.append((unary_precedence, token.value, True))
+					continue
+				if kind == LPAREN or kind == LBRACK or kind == LCBRACK:
+					tokens.consume_value()
+					contexts.append((context, base, items, left))
+					context = GROUP if kind == LPAREN else LIST if kind == LBRACK else DICT_KEY
+					base, items, left = len(operators), [], None
+					continue
+				if kind == END: tokens.current() # Unexpected end of input
+				state = MISSING
+
+			if state == MISSING:
+				if len(operators) > base:
+					_, operator, unary = operators[-1]
+					raise ParserError(f'Expected expression {operator}' if unary else 'Expected expression', tokens.consume())
+				value = None
+			else:
+				kind = tokens.kind()
+				if kind == OPERATOR or kind == IN or kind == IS:
+					operator = tokens.consume_value()
+					if kind == IN: operator = 'in'
+					elif kind == IS:
+						operator = 'is'
+						if tokens.kind() == OPERATOR and tokens.value() == 'not':
+							tokens.consume_value()
+							operator = 'is not'
+					elif operator == 'not':
+						tokens.expect(IN)
+						operator = 'not in'
+					precedence = PRECEDENCE[operator]
+					while len(operators) > base and operators[-1][0] >= precedence: _reduce(operands, operators)
+					operators.append((precedence, operator, False))
+					state = OPERAND
+					continue
+				if kind == LPAREN or kind == LBRACK:
+					if kind == LPAREN: calls.append(tokens.current())
+					tokens.consume_value()
+					contexts.append((context, base, items, left))
+					context = CALL if kind == LPAREN else SUBSCRIPT
+					base, items, left = len(operators), [], operands.pop()
+					state = OPERAND
+					continue
+				while len(operators) > base: _reduce(operands, operators)
+				value = operands.pop()
+
+			# the expression of the current context ends here with `value`
+			state = OPERAND
+			if context == TOP: return value
+			elif context == GROUP:
+				if value is not None and tokens.kind() == SEMICOLON:
+					tokens.expect(SEMICOLON)
+					context, items, left = RANGE, [value], False
+					continue
+				tokens.expect(RPAREN)
+				node = value
+			elif context == LIST or context == CALL:
+				if value is not None:
+					if context == LIST and not items and tokens.kind() == SEMICOLON:
+						tokens.expect(SEMICOLON)
+						context, items, left = RANGE, [value], True
+						continue
+					items.append(value)
+					if tokens.kind() == COMMA:
+						tokens.expect(COMMA)
+						continue
+				if context == LIST:
+					tokens.expect(RBRACK)
+					node = AST.List(items)
+				else:
+					tokens.expect(RPAREN)
+					paren = calls.pop()
+					node = AST.CallFunction(left, items, paren.line, paren.column)
+			elif context == DICT_KEY:
+				if value is not None:
+					tokens.expect(COLON)
+					context, left = DICT_VALUE, value
+					continue
+				tokens.expect(RCBRACK)
+				node = AST.Dictionary(items)
+			elif context == DICT_VALUE:
+				if value is None: raise ParserError('Dictionary value expected', tokens.consume())
+				items.append((left, value))
+				if tokens.kind() == COMMA:
+					tokens.expect(COMMA)
+					context, left = DICT_KEY, None
+					continue
+				tokens.expect(RCBRACK)
+				node = AST.Dictionary(items)
+			elif context == RANGE:
+				# `left` holds whether the range opened with '['
+				if value is None: raise ParserError('Range bound expected', tokens.current())
+				items.append(value)
+				if len(items) < 3 and tokens.kind() == SEMICOLON:
+					tokens.expect(SEMICOLON)
+					continue
+				closed_stop = tokens.kind() == RBRACK
+				if not closed_stop and tokens.kind() != RPAREN:
+					raise ParserError('Expected "]" or ")" to close the range', tokens.current())
+				tokens.consume_value()
+				step = items[2] if len(items) == 3 else None
+				node = AST.Range(items[0], items[1], step, left, closed_stop)
+			else:
+				if value is None: raise ParserError('Subscript operator key is required', tokens.current())
+				tokens.expect(RBRACK)
+				node = AST.SubscriptOperator(left, value)
 
-	def parse(self, parser, tokens):
-		tokens.consume_expected('LBRACK')
-		items = ListOfExpressions().parse(parser, tokens)
-		tokens.consume_expected('RBRACK')
-		return AST.List(items)
+			context, base, items, left = contexts.pop()
+			# an empty group leaves its expression without an operand
+			if node is None: state = MISSING
+			else:
+				operands.append(node)
+				state = INFIX
 
 
-# list expression: LBRACK list_of expression? RBRACK
-class SetExpression(PrefixSubparser):
+# list_of expression: (expr COLON)*
+class ListOfExpressions(Subparser):
 
 	def parse(self, parser, tokens):
-		tokens.consume_expected('LCBRACK')
-		items = ListOfExpressions().parse(parser, tokens)
-		tokens.consume_expected('RCBRACK')
-		return AST.Set(items)
-
-
-# dict expression: LCBRACK (expr COLON expr COLON)* RCBRACK
-class DictionaryExpression(PrefixSubparser):
-
-	def _parse_keyvals(self, parser, tokens):
 		items = []
 		while not tokens.is_end():
-			key = Expression().parse(parser, tokens)
-			if key is not None:
-				tokens.consume_expected('COLON')
-				value = Expression().parse(parser, tokens)
-				if value is None: raise ParserError('Dictionary value expected', tokens.consume())
-				items.append((key, value))
+			exp = expression.parse(parser, tokens)
+			if exp is not None: items.append(exp)
 			else: break
-			if tokens.current().name == 'COMMA': tokens.consume_expected('COMMA	')
+			if tokens.kind() == COMMA: tokens.expect(COMMA)
 			else: break
 		return items
 
-	def parse(self, parser, tokens):
-		tokens.consume_expected('LCBRACK')
-		items = self._parse_keyvals(parser, tokens)
-		tokens.consume_expected('RCBRACK')
-		return AST.Dictionary(items)
-
-
-# infix expression: expr OPERATOR expr
-class BinaryOperatorExpression(InfixSubparser):
 
-	def parse(self, parser, tokens, left):
-		token = tokens.consume_expected('OPERATOR')
-		right = Expression().parse(parser, tokens, self.get_precedence(token))
-		if right is None: raise ParserError('Expected expression'.format(token.value), tokens.consume())
-		return AST.BinaryOperator(token.value, left, right)
-
-	def get_precedence(self, token): return self.PRECEDENCE[token.value]
-
-
-# call expression: NAME LPAREN list_of expression? RPAREN
-class CallFunctionExpression(InfixSubparser):
-
-	def parse(self, parser, tokens, left):
-		tokens.consume_expected('LPAREN')
-		arguments = ListOfExpressions().parse(parser, tokens)
-		tokens.consume_expected('RPAREN')
-		return AST.CallFunction(left, arguments)
+expression = Expression()
+list_of_expressions = ListOfExpressions()
 
-	def get_precedence(self, token): return self.PRECEDENCE['call']
 
+# value: expr | WAIT expr
+def parse_value(parser, tokens):
+	"""An expression, or inside a sync function, the wait for one.
 
-# subscript expression: NAME LBRACK expr RBRACK
-class SubscriptOperatorExpression(InfixSubparser):
-
-	def parse(self, parser, tokens, left):
-		tokens.consume_expected('LBRACK')
-		key = Expression().parse(parser, tokens)
-		if key is None: raise ParserError('Subscript operator key is required', tokens.current())
-		tokens.consume_expected('RBRACK')
-		return AST.SubscriptOperator(left, key)
-
-	def get_precedence(self, token): return self.PRECEDENCE['subscript']
-
-
-class Expression(Subparser):
-
-	def get_prefix_subparser(self, token):
-		return self.get_subparser(token, {
-			'NUMBER': NumberExpression,
-			'STRING': StringExpression,
-			'LOGIC': LogicExpression,
-			'NAME': NameExpression,
-			'LPAREN': GroupExpression,
- 			'LBRACK': ListExpression,
- 			'LCBRACK': SetExpression,
-			'LCBRACK': DictionaryExpression,
-			'OPERATOR': UnaryOperatorExpression,
-		})
-
-	def get_infix_subparser(self, token):
-		return self.get_subparser(token, {
-			'OPERATOR': BinaryOperatorExpression,
-			'LPAREN': CallFunctionExpression,
-			'LBRACK': SubscriptOperatorExpression,
-		})
-
-	def get_next_precedence(self, tokens):
-		if not tokens.is_end():
-			token = tokens.current()
-			parser = self.get_infix_subparser(token)
-			if parser is not None: return parser.get_precedence(token)
-		return 0
-
-	def parse(self, parser, tokens, precedence=0):
-		subparser = self.get_prefix_subparser(tokens.current())
-		if subparser is not None:
-			left = subparser.parse(parser, tokens)
-			if left is not None:
-				while precedence < self.get_next_precedence(tokens):
-					op = self.get_infix_subparser(tokens.current()).parse(parser, tokens, left)
-					if op is not None: left = op
-				return left
-
-
-# list_of expression: (expr COLON)*
-class ListOfExpressions(Subparser):
-
-	def parse(self, parser, tokens):
-		items = []
-		while not tokens.is_end():
-			exp = Expression().parse(parser, tokens)
-			if exp is not None: items.append(exp)
-			else: break
-			if tokens.current().name == 'COMMA': tokens.consume_expected('COMMA')
-			else: break
-		return items
+	A wait is only parsed where a statement starts, and as the value of an
+	assignment or of a return: where a function can be suspended.
+	"""
+	if tokens.kind() != WAIT: return expression.parse(parser, tokens)
+	if not parser.syncs or not parser.syncs[-1]: raise ParserError('Wait outside of sync function', tokens.current())
+	tokens.expect(WAIT)
+	value = expression.parse(parser, tokens)
+	if value is None: raise ParserError('Expected expression to wait for', tokens.current())
+	return AST.Wait(value)
 
 
 
 # block: NEWLINE INDENT stmnts DEDENT
 class Block(Subparser):
 
-	def parse(self, parser, tokens):
-		tokens.consume_expected('NEWLINE', 'INDENT')
-		statements = Statements().parse(parser, tokens)
-		tokens.consume_expected('DEDENT')
+	def parse(self, parser, tokens, scope=None):
+		"""Parse the block, inside `scope` ('function', 'loop', ...) when one is given."""
+		tokens.expect(NEWLINE, INDENT)
+		if scope is None: statements = yield statements_parser.parse(parser, tokens)
+		else:
+			parser.scope.append(scope)
+			try: statements = yield statements_parser.parse(parser, tokens)
+			finally: parser.scope.pop()
+		tokens.expect(DEDENT)
 		return statements
 
 
-# func_stmnt: FUNCTION NAME LPAREN func_params? RPAREN COLON block
+block = Block()
+
+
+# func_stmnt: SYNC? FUNCTION NAME LPAREN func_params? RPAREN COLON block
 class FunctionStatement(Subparser):
 
-	# func_params: (NAME COLON)*
-	def _parse_params(self, tokens):
+	nested = True
+
+	# func_params: (NAME (ASSIGN exp)? COMMA)*
+	def _parse_params(self, parser, tokens):
 		params = []
-		if tokens.current().name == 'NAME':
+		defaults = []
+		if tokens.kind() == NAME:
 			while not tokens.is_end():
-				id_token = tokens.consume_expected('NAME')
+				id_token = tokens.consume_expected(NAME)
 				params.append(id_token.value)
-				if tokens.current().name == 'COMMA': tokens.consume_expected('COMMA')
+				if tokens.kind() == ASSIGN:
+					tokens.expect(ASSIGN)
+					default = expression.parse(parser, tokens)
+					if default is None: raise ParserError('Expected default value', tokens.current())
+					defaults.append(default)
+				elif defaults: raise ParserError('Parameter without default after a default', id_token)
+				if tokens.kind() == COMMA: tokens.expect(COMMA)
 				else:break
-		return params
+		return params, tuple(defaults)
 
 	def parse(self, parser, tokens):
-		tokens.consume_expected('FUNCTION')
-		id_token = tokens.consume_expected('NAME')
-		tokens.consume_expected('LPAREN')
-		arguments = self._parse_params(tokens)
-		tokens.consume_expected('RPAREN')
-		tokens.consume_expected('COLON')
-		with enter_scope(parser, 'function'): block = Block().parse(parser, tokens)
-		if block is None: raise ParserError('Expected function body', tokens.current())
-		return AST.Function(id_token.value, arguments, block)
+		sync = tokens.kind() == SYNC
+		if sync: tokens.expect(SYNC)
+		tokens.expect(FUNCTION)
+		id_token = tokens.consume_expected(NAME)
+		tokens.expect(LPAREN)
+		arguments, defaults = self._parse_params(parser, tokens)
+		tokens.expect(RPAREN)
+		tokens.expect(COLON)
+		parser.throws.append(False)
+		parser.syncs.append(sync)
+		try: body = yield block.parse(parser, tokens, 'function')
+		finally:
+			generator = parser.throws.pop()
+			parser.syncs.pop()
+		if body is None: raise ParserError('Expected function body', tokens.current())
+		return AST.Function(id_token.value, arguments, body, defaults=defaults, generator=generator or sync, sync=sync)
+
+function_statement = FunctionStatement()
+
 
 class ClassStatement(Subparser):
 
+	nested = True
+
 	# class_params: (NAME COLON)*
 	# def _parse_params(self, tokens):
 	# 	params = []
-	# 	if tokens.current().name == 'NAME':
+	# 	if tokens.kind() == NAME:
 	# 		while not tokens.is_end():
-	# 			id_token = tokens.consume_expected('NAME')
+	# 			id_token = tokens.consume_expected(NAME)
 	# 			params.append(id_token.value)
-	# 			if tokens.current().name == 'COMMA': tokens.consume_expected('COMMA')
+	# 			if tokens.kind() == COMMA: tokens.expect(COMMA)
 	# 			else:break
 	# 	return params
 
 	def parse(self, parser, tokens):
-		tokens.consume_expected('CLASS')
-		id_token = tokens.consume_expected('NAME')
+		tokens.expect(CLASS)
+		id_token = tokens.consume_expected(NAME)
 		# arguments = self._parse_params(tokens)
-		tokens.consume_expected('COLON')
-		with enter_scope(parser, 'class'): block = Block().parse(parser, tokens)
-		if block is None: raise ParserError('Expected class body', tokens.current())
-		return AST.Class(id_token.value, arguments, block)
+		tokens.expect(COLON)
+		body = yield block.parse(parser, tokens, 'class')
+		if body is None: raise ParserError('Expected class body', tokens.current())
+		return AST.Class(id_token.value, arguments, body)
 
 
 # cond_stmnt: IF expr COLON block (ELIF COLON block)* (ELSE COLON block)?
 class ConditionalStatement(Subparser):
 
+	nested = True
+
 	def _parse_elif_conditions(self, parser, tokens):
 		conditions = []
-		while not tokens.is_end() and tokens.current().name == 'ELIF':
-			tokens.consume_expected('ELIF')
-			test = Expression().parse(parser, tokens)
+		while tokens.kind() == ELIF:
+			tokens.expect(ELIF)
+			test = expression.parse(parser, tokens)
 			if test is None: raise ParserError('Expected "elif" condition', tokens.current())
-			tokens.consume_expected('COLON')
-			with enter_scope(parser, 'condition'): block = Block().parse(parser, tokens)
-			if block is None: raise ParserError('Expected "elif" body', tokens.current())
-			conditions.append(AST.ConditionElif(test, block))
+			tokens.expect(COLON)
+			body = yield block.parse(parser, tokens, 'condition')
+			if body is None: raise ParserError('Expected "elif" body', tokens.current())
+			conditions.append(AST.ConditionElif(test, body))
 		return conditions
 
 	def _parse_else(self, parser, tokens):
 		else_block = None
-		if not tokens.is_end() and tokens.current().name == 'ELSE':
-			tokens.consume_expected('ELSE', 'COLON')
-			with enter_scope(parser, 'condition'): else_block = Block().parse(parser, tokens)
+		if tokens.kind() == ELSE:
+			tokens.expect(ELSE, COLON)
+			else_block = yield block.parse(parser, tokens, 'condition')
 			if else_block is None: raise ParserError('Expected "else" body', tokens.current())
 		return else_block
 
 	def parse(self, parser, tokens):
-		tokens.consume_expected('IF')
-		test = Expression().parse(parser, tokens)
+		tokens.expect(IF)
+		test = expression.parse(parser, tokens)
 		if test is None: raise ParserError('Expected "if" condition', tokens.current())
-		tokens.consume_expected('COLON')
-		with enter_scope(parser, 'condition'): if_block = Block().parse(parser, tokens)
+		tokens.expect(COLON)
+		if_block = yield block.parse(parser, tokens, 'condition')
 		if if_block is None: raise ParserError('Expected if body', tokens.current())
-		elif_conditions = self._parse_elif_conditions(parser, tokens)
-		else_block = self._parse_else(parser, tokens)
+		elif_conditions = yield from self._parse_elif_conditions(parser, tokens)
+		else_block = yield from self._parse_else(parser, tokens)
 		return AST.Condition(test, if_block, elif_conditions, else_block)
 
 # exception_stmnt: DO COLON block (ELIF COLON block)* (LAST COLON block)?
 class ExceptionStatement(Subparser):
 
+	nested = True
+
 	def _parse_error_exceptions(self, parser, tokens):
 		exceptions = []
-		while not tokens.is_end() and tokens.current().name == 'UNLESS':
-			tokens.consume_expected('UNLESS')
-			error = Expression().parse(parser, tokens)
+		while tokens.kind() == UNLESS:
+			tokens.expect(UNLESS)
+			error = expression.parse(parser, tokens)
 			if error is None: raise ParserError('Expected "unless" exception', tokens.current())
-			tokens.consume_expected('COLON')
-			with enter_scope(parser, 'exception'): block = Block().parse(parser, tokens)
-			if block is None: raise ParserError('Expected "unless" body', tokens.current())
-			exceptions.append(AST.Unless(error, block))
+			tokens.expect(COLON)
+			body = yield block.parse(parser, tokens, 'exception')
+			if body is None: raise ParserError('Expected "unless" body', tokens.current())
+			exceptions.append(AST.Unless(error, body))
 		return exceptions
 
 	def _parse_last(self, parser, tokens):
 		last_block = None
-		if not tokens.is_end() and tokens.current().name == 'LAST':
-			tokens.consume_expected('LAST', 'COLON')
-			with enter_scope(parser, 'exception'): last_block = Block().parse(parser, tokens)
+		if tokens.kind() == LAST:
+			tokens.expect(LAST, COLON)
+			last_block = yield block.parse(parser, tokens, 'exception')
 			if last_block is None: raise ParserError('Expected "last" body', tokens.current())
 		return last_block
 
 	def parse(self, parser, tokens):
-		tokens.consume_expected('DO', 'COLON')
-		with enter_scope(parser, 'exception'): do_block = Block().parse(parser, tokens)
+		tokens.expect(DO, COLON)
+		do_block = yield block.parse(parser, tokens, 'exception')
 		if do_block is None: raise ParserError('Expected "do" body', tokens.current())
-		unlesses = self._parse_error_exceptions(parser, tokens)
-		last_block = self._parse_last(parser, tokens)
+		unlesses = yield from self._parse_error_exceptions(parser, tokens)
+		last_block = yield from self._parse_last(parser, tokens)
 		return AST.Do(do_block, unlesses, last_block)
 
 # when_stmnt: WHEN expr COLON NEWLINE INDENT when_is+ (ELSE COLON block)? DEDENT
 class WhenStatement(Subparser):
 
+	nested = True
+
 	# match_when: IS expr COLON block
 	def _parse_when(self, parser, tokens):
-		tokens.consume_expected('IS')
-		pattern = Expression().parse(parser, tokens)
+		tokens.expect(IS)
+		pattern = expression.parse(parser, tokens)
 		if pattern is None: raise ParserError('Pattern expression expected', tokens.current())
-		tokens.consume_expected('COLON')
-		with enter_scope(parser, 'cond'): block = Block().parse(parser, tokens)
-		return AST.WhenPattern(pattern, block)
+		tokens.expect(COLON)
+		body = yield block.parse(parser, tokens, 'cond')
+		return AST.WhenPattern(pattern, body)
 
 	def parse(self, parser, tokens):
-		tokens.consume_expected('WHEN')
-		test = Expression().parse(parser, tokens)
-		tokens.consume_expected('COLON', 'NEWLINE', 'INDENT')
+		tokens.expect(WHEN)
+		test = expression.parse(parser, tokens)
+		tokens.expect(COLON, NEWLINE, INDENT)
 		patterns = []
-		while not tokens.is_end() and tokens.current().name == 'IS':
-			patterns.append(self._parse_when(parser, tokens))
+		while tokens.kind() == IS:
+			patterns.append((yield from self._parse_when(parser, tokens)))
 		if not patterns:
 			raise ParserError('One or more "when" pattern excepted', tokens.current())
 		else_block = None
-		if not tokens.is_end() and tokens.current().name == 'ELSE':
-			tokens.consume_expected('ELSE', 'COLON')
-			with enter_scope(parser, 'cond'): else_block = Block().parse(parser, tokens)
+		if tokens.kind() == ELSE:
+			tokens.expect(ELSE, COLON)
+			else_block = yield block.parse(parser, tokens, 'cond')
 			if else_block is None:
 				raise ParserError('Expected "else" body', tokens.current())
-		tokens.consume_expected('DEDENT')
+		tokens.expect(DEDENT)
 		return AST.When(test, patterns, else_block)
 
 
 # loop_while_stmnt: WHILE expr COLON block
 class WhileLoopStatement(Subparser):
 
+	nested = True
+
 	def parse(self, parser, tokens):
-		tokens.consume_expected('WHILE')
-		test = Expression().parse(parser, tokens)
+		tokens.expect(WHILE)
+		test = expression.parse(parser, tokens)
 		if test is None: raise ParserError('While condition expected', tokens.current())
-		tokens.consume_expected('COLON')
-		with enter_scope(parser, 'loop'): block = Block().parse(parser, tokens)
-		if block is None: raise ParserError('Expected loop body', tokens.current())
-		else_block = self._parse_else(parser, tokens)
-		return AST.WhileLoop(test, block, else_block)
+		tokens.expect(COLON)
+		body = yield block.parse(parser, tokens, 'loop')
+		if body is None: raise ParserError('Expected loop body', tokens.current())
+		else_block = yield from self._parse_else(parser, tokens)
+		return AST.WhileLoop(test, body, else_block)
 
 	def _parse_else(self, parser, tokens):
 		else_block = None
-		if not tokens.is_end() and tokens.current().name == 'ELSE':
-			tokens.consume_expected('ELSE', 'COLON')
-			else_block = Block().parse(parser, tokens)
+		if tokens.kind() == ELSE:
+			tokens.expect(ELSE, COLON)
+			else_block = yield block.parse(parser, tokens)
 			if else_block is None: raise ParserError('Expected "else" body', tokens.current())
 		return else_block
 
 # loop_for_stmnt: FOR NAME expr COLON block
 class ForLoopStatement(Subparser):
 
+	nested = True
+
 	def parse(self, parser, tokens):
-		tokens.consume_expected('FOR')
-		id_token = tokens.consume_expected('NAME')
-		tokens.consume_expected('IN')
-		collection = Expression().parse(parser, tokens)
-		tokens.consume_expected('COLON')
-		with enter_scope(parser, 'loop'):
-			block = Block().parse(parser, tokens)
-		if block is None:
+		tokens.expect(FOR)
+		id_token = tokens.consume_expected(NAME)
+		tokens.expect(IN)
+		collection = expression.parse(parser, tokens)
+		tokens.expect(COLON)
+		body = yield block.parse(parser, tokens, 'loop')
+		if body is None:
 			raise ParserError('Expected loop body', tokens.current())
-		return AST.ForLoop(id_token.value, collection, block)
+		return AST.ForLoop(id_token.value, collection, body)
 
 # use_stmnt: USE NAME OF lib
 class UseStatement(Subparser):
 
 	def parse(self, parser, tokens):
-		tokens.consume_expected('USE')
-		obj = tokens.consume_expected('NAME')
-		tokens.consume_expected('OF')
-		library = tokens.consume_expected('NAME', 'NEWLINE')
+		tokens.expect(USE)
+		obj = tokens.consume_expected(NAME)
+		tokens.expect(OF)
+		library = tokens.consume_expected(NAME, NEWLINE)
 		return AST.Use(obj.value, library)
 
-# return_stmnt: RETURN expr?
+# return_stmnt: RETURN value?
 class ReturnStatement(Subparser):
 
 	def parse(self, parser, tokens):
 		if not parser.scope or 'function' not in parser.scope:
 			raise ParserError('Return outside of function', tokens.current())
-		tokens.consume_expected('RETURN')
-		value = Expression().parse(parser, tokens)
-		tokens.consume_expected('NEWLINE')
+		tokens.expect(RETURN)
+		value = parse_value(parser, tokens)
+		tokens.expect(NEWLINE)
 		return AST.Return(value)
 
 # throw_stmnt: THROW expr?
@@ -462,9 +536,12 @@ class ThrowStatement(Subparser):
 	def parse(self, parser, tokens):
 		if not parser.scope or 'function' not in parser.scope:
 			raise ParserError('Throw outside of function', tokens.current())
-		tokens.consume_expected('THROW')
-		value = Expression().parse(parser, tokens)
-		tokens.consume_expected('NEWLINE')
+		if parser.syncs[-1]: raise ParserError('Throw inside sync function', tokens.current())
+		# a function whose body throws is a generator
+		parser.throws[-1] = True
+		tokens.expect(THROW)
+		value = expression.parse(parser, tokens)
+		tokens.expect(NEWLINE)
 		return AST.Throw(value)
 
 
@@ -474,7 +551,7 @@ class QuitStatement(Subparser):
 	def parse(self, parser, tokens):
 		if not parser.scope or parser.scope[-1] != 'loop':
 			raise ParserError('Quit outside of loop', tokens.current())
-		tokens.consume_expected('QUIT', 'NEWLINE')
+		tokens.expect(QUIT, NEWLINE)
 		return AST.Quit()
 
 
@@ -484,7 +561,7 @@ class ContinueStatement(Subparser):
 	def parse(self, parser, tokens):
 		if not parser.scope or parser.scope[-1] != 'loop':
 			raise ParserError('Continue outside of loop', tokens.current())
-		tokens.consume_expected('CONTINUE', 'NEWLINE')
+		tokens.expect(CONTINUE, NEWLINE)
 		return AST.Continue()
 
 # cont_stmnt: SKIP
@@ -493,57 +570,45 @@ class SkipStatement(Subparser):
 	def parse(self, parser, tokens):
 		if not parser.scope or parser.scope[-1] not in ['loop', 'condition', 'cond', 'exception'] and 'function' not in parser.scope:
 			raise ParserError('Skip outside of loop or function', tokens.current())
-		tokens.consume_expected('SKIP', 'NEWLINE')
+		tokens.expect(SKIP, NEWLINE)
 		return AST.Skip()
 
-# assing_stmnt: expr ASSIGN expr NEWLINE
+# assing_stmnt: expr ASSIGN value NEWLINE
 class AssignmentStatement(Subparser):
 
 	def parse(self, parser, tokens, left):
-		tokens.consume_expected('ASSIGN')
-		right = Expression().parse(parser, tokens)
-		tokens.consume_expected('NEWLINE')
+		tokens.expect(ASSIGN)
+		right = parse_value(parser, tokens)
+		tokens.expect(NEWLINE)
 		return AST.Assignment(left, right)
 
 
+assignment_statement = AssignmentStatement()
+
+
 # expr_stmnt: assing_stmnt
-#           | expr NEWLINE
+#           | value NEWLINE
 class ExpressionStatement(Subparser):
 
 	def parse(self, parser, tokens):
-		exp = Expression().parse(parser, tokens)
+		exp = parse_value(parser, tokens)
 		if exp is not None:
-			if tokens.current().name == 'ASSIGN':
-				return AssignmentStatement().parse(parser, tokens, exp)
+			if tokens.kind() == ASSIGN and type(exp) is not AST.Wait:
+				return assignment_statement.parse(parser, tokens, exp)
 			else:
-				tokens.consume_expected('NEWLINE')
+				tokens.expect(NEWLINE)
 				return exp
 
 
 # stmnts: stmnt*
 class Statements(Subparser):
 
-	def get_statement_subparser(self, token):
-		return self.get_subparser(token, {
-			'FUNCTION': FunctionStatement,
-			'CLASS': ClassStatement,
-			'IF': ConditionalStatement,
-			'USE': UseStatement,
-			'DO': ExceptionStatement,
-			'WHEN': WhenStatement,
-			'WHILE': WhileLoopStatement,
-			'FOR': ForLoopStatement,
-			'RETURN': ReturnStatement,
-			'THROW': ThrowStatement,
-			'QUIT': QuitStatement,
-			'CONTINUE': ContinueStatement,
-			'SKIP': SkipStatement,			
-		}, ExpressionStatement)
-
 	def parse(self, parser, tokens):
 		statements = []
 		while not tokens.is_end():
-			statement = self.get_statement_subparser(tokens.current()).parse(parser, tokens)
+			subparser = statement_subparsers[tokens.kind()]
+			if subparser.nested: statement = yield subparser.parse(parser, tokens)
+			else: statement = subparser.parse(parser, tokens)
 			if statement is not None:
 				statements.append(statement)
 			else:
@@ -551,18 +616,47 @@ class Statements(Subparser):
 		return statements
 
 
+statements_parser = Statements()
+
+statement_subparsers = dispatch_table({
+	FUNCTION: function_statement,
+	SYNC: function_statement,
+	CLASS: ClassStatement(),
+	IF: ConditionalStatement(),
+	USE: UseStatement(),
+	DO: ExceptionStatement(),
+	WHEN: WhenStatement(),
+	WHILE: WhileLoopStatement(),
+	FOR: ForLoopStatement(),
+	RETURN: ReturnStatement(),
+	THROW: ThrowStatement(),
+	QUIT: QuitStatement(),
+	CONTINUE: ContinueStatement(),
+	SKIP: SkipStatement(),
+}, ExpressionStatement())
+
+
 # prog: stmnts
 class Program(Subparser):
 
 	def parse(self, parser, tokens):
-		statements = Statements().parse(parser, tokens)
+		statements = run(statements_parser.parse(parser, tokens))
 		tokens.expect_end()
 		return AST.Program(statements)
 
 
+program = Program()
+
+
 class Parser(object):
 
-	def __init__(self): self.scope = None
+	def __init__(self):
+		self.scope = None
+		self.throws = None # per enclosing function: whether its body throws so far
+		self.syncs = None # per enclosing function: whether it is sync
+
 	def parse(self, tokens):
 		self.scope = []
-		return Program().parse(self, tokens)
+		self.throws = []
+		self.syncs = []
+		return program.parse(self, tokens)
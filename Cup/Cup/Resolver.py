@@ -0,0 +1,155 @@
+from Cup import AST
+from Cup.Errors import ArityError, arity_error
+
+
+class Layout(object):
+	"""Slot layout of a function frame: parameters first, then every other local."""
+
+	__slots__ = ('names', 'index')
+
+	def __init__(self, names):
+		self.names = tuple(names)
+		self.index = {name: slot for slot, name in enumerate(self.names)}
+
+	@property
+	def size(self): return len(self.names)
+
+	def __repr__(self): return f'Layout({", ".join(self.names)})'
+
+
+def declared_names(statements, names):
+	"""Names bound by these statements, in order, without entering nested functions."""
+	for statement in statements:
+		tp = type(statement)
+		if tp is AST.Assignment:
+			if isinstance(statement.left, AST.Identifier): names.append(statement.left.value)
+		elif tp is AST.ForLoop:
+			names.append(statement.var_name)
+			declared_names(statement.body, names)
+		elif tp is AST.Function:
+			names.append(statement.name)
+		elif tp is AST.Condition:
+			declared_names(statement.if_body, names)
+			for cond in statement.elifs: declared_names(cond.body, names)
+			declared_names(statement.else_body or [], names)
+		elif tp is AST.When:
+			for pattern in statement.patterns: declared_names(pattern.body, names)
+			declared_names(statement.else_body or [], names)
+		elif tp is AST.WhileLoop:
+			declared_names(statement.body, names)
+			declared_names(statement.else_body or [], names)
+		elif tp is AST.RangeLoop:
+			names.append(statement.var_name)
+			names.extend(variable.name for variable in statement.derived)
+			declared_names([statement.loop], names)
+		elif tp is AST.Do:
+			declared_names(statement.do_body, names)
+			for unless in statement.unlesses: declared_names(unless.body, names)
+			declared_names(statement.last_body or [], names)
+	return names
+
+
+def function_layout(params, body):
+	"""The Layout of a function frame: its parameters, then every other name its body binds."""
+	names = list(params)
+	for name in declared_names(body, []):
+		if name not in names: names.append(name)
+	return Layout(names)
+
+
+class Resolver(object):
+	"""Annotates identifiers with the lexical (depth, slot) of the frame that binds them.
+
+	The outermost scope is the global Environment itself: its slots are
+	declared as the program is resolved, so the same environment can be
+	reused across programs (as the REPL does).
+	"""
+
+	def __init__(self, env):
+		self._env = env
+		self._scopes = []
+
+	def _address(self, name):
+		for depth, scope in enumerate(reversed(self._scopes)):
+			if name in scope: return (depth, scope[name])
+		slot = self._env.slot(name)
+		if slot is not None: return (len(self._scopes), slot)
+
+	def _resolve(self, node):
+		if isinstance(node, list): return [self._resolve(item) for item in node]
+		elif isinstance(node, tuple) and not hasattr(node, '_fields'): return tuple(self._resolve(item) for item in node)
+		elif not hasattr(node, '_fields'): return node
+		tp = type(node)
+		if tp is AST.Identifier: return node._replace(address=self._address(node.value))
+		elif tp is AST.Function: return self._resolve_function(node)
+		return tp(*[self._resolve(getattr(node, field)) for field in node._fields])
+
+	def _resolve_function(self, node):
+		# defaults are evaluated where the function is declared
+		defaults = self._resolve(node.defaults)
+		layout = function_layout(node.params, node.body)
+		self._scopes.append(layout.index)
+		body = self._resolve(node.body)
+		self._scopes.pop()
+		return node._replace(body=body, layout=layout, defaults=defaults)
+
+	def resolve(self, program):
+		for name in declared_names(program.body, []): self._env.declare(name)
+		return AST.Program(self._resolve(program.body))
+
+
+def resolve(program, env):
+	"""Return `program` with every identifier bound to a frame slot of `env` or of a function."""
+	return Resolver(env).resolve(program)
+
+
+def _check_call(node, scopes):
+	name = node.left.value
+	for bound, known in reversed(scopes):
+		if name in bound:
+			function = known.get(name)
+			if function is not None:
+				n_args, n_params = len(node.arguments), len(function.params)
+				if n_args > n_params or n_args < n_params - len(function.defaults):
+					error = arity_error(function.params, function.defaults, n_args)
+					# a call the Parser did not make has no position to report
+					if node.line is None: raise error
+					raise ArityError(str(error), node.line, node.column)
+			return
+
+
+def _check_calls(node, scopes):
+	nodes = [node]
+	while nodes:
+		node = nodes.pop()
+		if isinstance(node, (list, tuple)) and not hasattr(node, '_fields'): nodes.extend(node)
+		elif not hasattr(node, '_fields') or type(node) is AST.Class: continue
+		elif type(node) is AST.Function:
+			nodes.extend(node.defaults)
+			_check_scope(node.body, node.params, scopes)
+		else:
+			if type(node) is AST.CallFunction and type(node.left) is AST.Identifier: _check_call(node, scopes)
+			nodes.extend(node)
+
+
+def _check_scope(statements, params, scopes):
+	names = declared_names(statements, list(params))
+	known = {}
+	scopes = scopes + [(set(names), known)]
+	for statement in statements:
+		if type(statement) is AST.Function:
+			_check_calls(statement.defaults, scopes)
+			# from here on, including in its own body, the name can only be this function
+			if names.count(statement.name) == 1: known[statement.name] = statement
+			_check_scope(statement.body, statement.params, scopes)
+		else: _check_calls(statement, scopes)
+
+
+def check_arity(program):
+	"""Raise ArityError for a call whose argument count cannot fit its function.
+
+	Only calls whose function is known while compiling are checked: a name
+	bound by a single `let` at the top level of its scope, called after that
+	statement. Other calls are checked when they run.
+	"""
+	_check_scope(program.body, (), [])
@@ -0,0 +1,437 @@
+from __future__ import print_function
+import ast, keyword, weakref
+
+from Cup import AST
+from Cup.AST import bind_arguments
+from Cup.Interpreter import Skip, create_global_env, parse
+from Cup.Operators import make_range, simple_operations
+from Cup.Resolver import function_layout
+from Cup.Utils import print_env
+
+
+RESULT = '__cup_result__'
+
+binary_operators = {
+	'+': ast.Add,
+	'-': ast.Sub,
+	'*': ast.Mult,
+	'/': ast.Div,
+	'\\': ast.FloorDiv,
+	'%': ast.Mod,
+	'^': ast.Pow,
+	'<<': ast.LShift,
+	'>>': ast.RShift,
+	'&&': ast.BitAnd,
+	'||': ast.BitOr,
+	'^^': ast.BitXor,
+}
+
+comparison_operators = {
+	'>': ast.Gt,
+	'>=': ast.GtE,
+	'<': ast.Lt,
+	'<=': ast.LtE,
+	'==': ast.Eq,
+	'!=': ast.NotEq,
+	'in': ast.In,
+	'not in': ast.NotIn,
+	'is': ast.Is,
+	'is not': ast.IsNot,
+}
+
+# Python's and/or short-circuit as well; `not not` makes their value a truth value
+logical_operators = {
+	'&': ast.And,
+	'and': ast.And,
+	'|': ast.Or,
+	'or': ast.Or,
+}
+
+unary_operators = {
+	'+': ast.UAdd,
+	'-': ast.USub,
+	'!': ast.Not,
+	'not': ast.Not,
+}
+
+# Cup operators without a Python counterpart are called through these helpers
+helper_operators = {
+	'><': '__cup_disjoint',
+	'<=>': '__cup_num_eq',
+	'?': '__cup_type',
+	'~': '__cup_round',
+}
+
+
+helpers = {
+	'__cup_disjoint': simple_operations['><'],
+	'__cup_num_eq': simple_operations['<=>'],
+	'__cup_type': type,
+	'__cup_round': round,
+	'__cup_range': make_range,
+	'__cup_Skip': Skip,
+	'__cup_NameError': NameError,
+}
+
+
+class Builtin(object):
+	"""Python-callable wrapper around an AST.BuiltinFunction."""
+
+	__slots__ = ('params', 'body', 'defaults')
+
+	def __init__(self, function):
+		self.params = function.params
+		self.body = function.body
+		self.defaults = function.defaults
+
+	def __call__(self, *args):
+		if len(args) != len(self.params): return self.body(*bind_arguments(self, list(args)))
+		return self.body(*args)
+
+
+def mangle(name):
+	return f'__cup_kw_{name}' if keyword.iskeyword(name) else name
+
+
+def unmangle(name):
+	return name[len('__cup_kw_'):] if name.startswith('__cup_kw_') else name
+
+
+def _load(name): return ast.Name(id=name, ctx=ast.Load())
+def _store(name): return ast.Name(id=name, ctx=ast.Store())
+def _assign(name, value): return ast.Assign(targets=[_store(name)], value=value)
+def _call(name, args): return ast.Call(func=_load(name), args=args, keywords=[])
+def _truth(value): return ast.UnaryOp(op=ast.Not(), operand=ast.UnaryOp(op=ast.Not(), operand=value))
+
+
+def _contains_skip(statements):
+	"""Whether a skip in these statements reaches the enclosing statement."""
+	for statement in statements:
+		tp = type(statement)
+		if tp is AST.Skip: return True
+		elif tp is AST.When:
+			bodies = [pattern.body for pattern in statement.patterns] + [statement.else_body or []]
+			if any(_contains_skip(body) for body in bodies): return True
+		elif tp is AST.Do:
+			bodies = [unless.body for unless in statement.unlesses] + [statement.last_body or []]
+			if any(_contains_skip(body) for body in bodies): return True
+	return False
+
+
+def _calls(node):
+	"""Whether `node` calls anything, outside nested function declarations."""
+	if isinstance(node, (list, tuple)) and not hasattr(node, '_fields'): return any(_calls(item) for item in node)
+	elif not hasattr(node, '_fields') or type(node) is AST.Function: return False
+	elif type(node) is AST.CallFunction or type(node) is AST.CallClass: return True
+	return any(_calls(value) for value in node)
+
+
+def _catch_skip(body):
+	handler = ast.ExceptHandler(type=_load('__cup_Skip'), name=None, body=[ast.Pass()])
+	return [ast.Try(body=body, handlers=[handler], orelse=[], finalbody=[])]
+
+
+def _identifiers(node, names):
+	if type(node) is AST.Identifier: names.add(node.value)
+	elif isinstance(node, (list, tuple)):
+		for item in node: _identifiers(item, names)
+	return names
+
+
+def _unbound_reads(statements, local, bound, unbound):
+	"""Add to `unbound` the names of `local` these statements may read before they bind them.
+
+	`bound` holds the names bound when the statements start; returns the
+	names bound for sure when they end. A read in a nested function counts
+	where the function is declared.
+	"""
+	bound = set(bound)
+	def read(node): unbound.update(name for name in _identifiers(node, set()) if name in local and name not in bound)
+	def branches(bodies):
+		ends = [_unbound_reads(body, local, bound, unbound) for body in bodies]
+		return set.intersection(*ends)
+	for statement in statements:
+		tp = type(statement)
+		if tp is AST.Assignment:
+			read(statement.right)
+			if type(statement.left) is AST.Identifier: bound.add(statement.left.value)
+			else: read(statement.left)
+		elif tp is AST.Function:
+			read([statement.defaults, statement.body])
+			bound.add(statement.name)
+		elif tp is AST.ForLoop:
+			read(statement.collection)
+			_unbound_reads(statement.body, local, bound | {statement.var_name}, unbound)
+		elif tp is AST.WhileLoop:
+			read(statement.test)
+			_unbound_reads(statement.body, local, bound, unbound)
+			if statement.else_body is not None: _unbound_reads(statement.else_body, local, bound, unbound)
+		elif tp is AST.RangeLoop: _unbound_reads([statement.loop], local, bound, unbound)
+		elif tp is AST.Condition:
+			read([statement.test] + [cond.test for cond in statement.elifs])
+			bodies = [statement.if_body] + [cond.body for cond in statement.elifs]
+			# only an if with an else binds what all its branches bind
+			if statement.else_body is not None: bound = branches(bodies + [statement.else_body])
+			else: branches(bodies)
+		elif tp is AST.When:
+			read([statement.test] + [pattern.pattern for pattern in statement.patterns])
+			bodies = [pattern.body for pattern in statement.patterns]
+			if statement.else_body is not None: bound = branches(bodies + [statement.else_body])
+			else: branches(bodies)
+		elif tp is AST.Do:
+			read([unless.unlesses for unless in statement.unlesses])
+			bodies = [statement.do_body] + [unless.body for unless in statement.unlesses] + [statement.last_body or []]
+			branches(bodies)
+		else: read(statement)
+	return bound
+
+
+def _stop_skip(statements, body):
+	"""`body`, the lowered `statements`, ending where a skip raised in them, or in a call they make, would leave."""
+	if _contains_skip(statements) or _calls(statements): return _catch_skip(body)
+	return body
+
+
+class Transpiler(object):
+	"""Lowers an AST.Program to a Python ast.Module."""
+
+	def __init__(self):
+		self._temps = 0
+		# Python names of the Cup names that are not simply mangled (see function)
+		self._names = {}
+
+	def _temp(self, prefix):
+		self._temps += 1
+		return f'__cup_{prefix}{self._temps}'
+
+	def _name(self, name):
+		return self._names.get(name) or mangle(name)
+
+	# expressions
+
+	def expression(self, node):
+		tp = type(node)
+		if tp in (AST.Number, AST.String, AST.Logic): return ast.Constant(value=node.value)
+		elif tp is AST.Identifier: return _load(self._name(node.value))
+		elif tp is AST.List: return ast.List(elts=[self.expression(item) for item in node.items], ctx=ast.Load())
+		elif tp is AST.Shell: return ast.Tuple(elts=[self.expression(item) for item in node.items], ctx=ast.Load())
+		elif tp is AST.Dictionary:
+			return ast.Dict(keys=[self.expression(key) for key, _ in node.items], values=[self.expression(value) for _, value in node.items])
+		elif tp is AST.Range:
+			step = self.expression(node.step) if node.step is not None else ast.Constant(value=None)
+			bounds = [self.expression(node.start), self.expression(node.stop), step]
+			return _call('__cup_range', bounds + [ast.Constant(value=node.closed_start), ast.Constant(value=node.closed_stop)])
+		elif tp is AST.BinaryOperator: return self.bin_op(node)
+		elif tp is AST.UnaryOperatorPrefix: return self.unary_op(node)
+		elif tp is AST.SubscriptOperator:
+			return ast.Subscript(value=self.expression(node.left), slice=self.expression(node.key), ctx=ast.Load())
+		elif tp is AST.CallFunction:
+			return ast.Call(func=self.expression(node.left), args=[self.expression(arg) for arg in node.arguments], keywords=[])
+		elif tp is AST.Wait: return ast.Await(value=self.expression(node.value))
+		else: raise Exception(f'Unknown node {tp.__name__} {node}')
+
+	def bin_op(self, node):
+		left = self.expression(node.left)
+		right = self.expression(node.right)
+		if node.operator in binary_operators:
+			return ast.BinOp(left=left, op=binary_operators[node.operator](), right=right)
+		elif node.operator in comparison_operators:
+			return ast.Compare(left=left, ops=[comparison_operators[node.operator]()], comparators=[right])
+		elif node.operator in logical_operators:
+			return ast.BoolOp(op=logical_operators[node.operator](), values=[_truth(left), _truth(right)])
+		elif node.operator in helper_operators:
+			return _call(helper_operators[node.operator], [left, right])
+		else: raise Exception(f'Invalid operator {node.operator}')
+
+	def unary_op(self, node):
+		right = self.expression(node.right)
+		if node.operator in unary_operators:
+			return ast.UnaryOp(op=unary_operators[node.operator](), operand=right)
+		return _call(helper_operators[node.operator], [right])
+
+	# statements
+	#
+	# `tail` is how the value of the last statement of a block is delivered:
+	# 'return' returns it from a function, a variable name (RESULT for the
+	# program) stores it, None drops it. `skip` says how a skip statement leaves the block:
+	# 'continue' directly inside a loop body, 'raise' everywhere else.
+
+	def block(self, statements, tail=None, skip='raise'):
+		body = []
+		for i, statement in enumerate(statements):
+			is_tail = tail is not None and i == len(statements) - 1
+			body.extend(self.statement(statement, tail if is_tail else None, skip))
+		return body or [ast.Pass()]
+
+	def _deliver(self, value, tail):
+		if tail == 'return': return [ast.Return(value=value)]
+		elif tail is not None: return [_assign(tail, value)]
+		return [ast.Expr(value=value)]
+
+	def _reset(self, tail):
+		return [_assign(tail, ast.Constant(value=None))] if tail is not None and tail != 'return' else []
+
+	def statement(self, node, tail, skip):
+		tp = type(node)
+		if tp is AST.Quit: return [ast.Break()]
+		elif tp is AST.Continue: return [ast.Continue()]
+		elif tp is AST.Skip:
+			if skip == 'continue': return [ast.Continue()]
+			return [ast.Raise(exc=_call('__cup_Skip', []), cause=None)]
+		elif tp is AST.Return:
+			value = self.expression(node.value) if node.value is not None else ast.Constant(value=None)
+			return [ast.Return(value=value)]
+		elif tp is AST.Throw:
+			# a Python function that yields is a generator, as a Cup function that throws
+			value = self.expression(node.value) if node.value is not None else ast.Constant(value=None)
+			return [ast.Expr(value=ast.Yield(value=value))]
+		elif tp is AST.Assignment: return self.assignment(node) + self._reset(tail)
+		elif tp is AST.Function: return [self.function(node)] + self._reset(tail)
+		elif tp is AST.Use: return self._reset(tail)
+		elif tp is AST.Condition: return self._reset(tail) + self.condition(node, tail)
+		elif tp is AST.When: return self._reset(tail) + self.when(node, tail, skip)
+		elif tp is AST.WhileLoop: return self._reset(tail) + self.while_loop(node, tail)
+		elif tp is AST.RangeLoop: return self._reset(tail) + self.while_loop(node.loop, tail)
+		elif tp is AST.ForLoop: return self._reset(tail) + self.for_loop(node)
+		elif tp is AST.Do: return self._reset(tail) + self.exception(node, tail)
+		return self._deliver(self.expression(node), tail)
+
+	def assignment(self, node):
+		value = self.expression(node.right)
+		if isinstance(node.left, AST.SubscriptOperator):
+			target = ast.Subscript(value=self.expression(node.left.left), slice=self.expression(node.left.key), ctx=ast.Store())
+		else:
+			target = _store(self._name(node.left.value))
+		return [ast.Assign(targets=[target], value=value)]
+
+	def _arguments(self, params, defaults=()):
+		return ast.arguments(posonlyargs=[], args=[ast.arg(arg=mangle(param)) for param in params], vararg=None,
+			kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[self.expression(default) for default in defaults])
+
+	def function(self, node):
+		# A Cup local read before the function binds it reads the enclosing
+		# name, which a Python local would hide: it gets a name of its own,
+		# starting from the enclosing value. Nothing a call runs can rebind
+		# a Cup name outside its own frame, so the value is the same later.
+		args = self._arguments(node.params, node.defaults)
+		local = function_layout(node.params, node.body).names[len(node.params):]
+		unbound = set()
+		_unbound_reads(node.body, set(local), set(), unbound)
+		outer = self._names
+		self._names = {name: value for name, value in outer.items() if name not in local and name not in node.params}
+		prologue = []
+		for name in sorted(unbound):
+			self._names[name] = self._temp('local') + '_' + name
+			handler = ast.ExceptHandler(type=_load('__cup_NameError'), name=None, body=[ast.Pass()])
+			prologue.append(ast.Try(body=[_assign(self._names[name], _load(outer.get(name) or mangle(name)))], handlers=[handler], orelse=[], finalbody=[]))
+		try: body = prologue + self.block(node.body, 'return')
+		finally: self._names = outer
+		definition = ast.AsyncFunctionDef if node.sync else ast.FunctionDef
+		return definition(name=self._name(node.name), args=args, body=body, decorator_list=[], returns=None)
+
+	def condition(self, node, tail):
+		# a skip ends the branch it leaves, as in the tree walker
+		orelse = _stop_skip(node.else_body, self.block(node.else_body, tail)) if node.else_body is not None else []
+		for cond in reversed(node.elifs):
+			orelse = [ast.If(test=self.expression(cond.test), body=_stop_skip(cond.body, self.block(cond.body, tail)), orelse=orelse)]
+		return [ast.If(test=self.expression(node.test), body=_stop_skip(node.if_body, self.block(node.if_body, tail)), orelse=orelse)]
+
+	def when(self, node, tail, skip):
+		test = self._temp('when')
+		orelse = self.block(node.else_body, tail, skip) if node.else_body is not None else []
+		for pattern in reversed(node.patterns):
+			compare = ast.Compare(left=self.expression(pattern.pattern), ops=[ast.Eq()], comparators=[_load(test)])
+			orelse = [ast.If(test=compare, body=self.block(pattern.body, tail, skip), orelse=orelse)]
+		return [_assign(test, self.expression(node.test))] + orelse
+
+	def while_loop(self, node, tail):
+		orelse = []
+		if node.else_body is not None: orelse = _stop_skip(node.else_body, self.block(node.else_body, tail))
+		# a skip leaving a call continues the loop
+		body = self.block(node.body, skip='continue')
+		if _calls(node.body): body = _catch_skip(body)
+		return [ast.While(test=self.expression(node.test), body=body, orelse=orelse)]
+
+	def for_loop(self, node):
+		body = self.block(node.body, skip='continue')
+		if _calls(node.body): body = _catch_skip(body)
+		return [ast.For(target=_store(self._name(node.var_name)), iter=self.expression(node.collection), body=body, orelse=[])]
+
+	def exception(self, node, tail):
+		# a return in the finally block would override a return from do or
+		# unless: the value is stored instead and returned after the block
+		value = self._temp('value') if tail == 'return' and node.last_body is not None else tail
+		orelse = []
+		for unless in reversed(node.unlesses):
+			orelse = [ast.If(test=self.expression(unless.unlesses), body=self.block(unless.body, value), orelse=orelse)]
+		handler = ast.ExceptHandler(type=_load('Exception'), name=None, body=orelse or [ast.Pass()])
+		finalbody = self.block(node.last_body, value) if node.last_body is not None else []
+		statement = [ast.Try(body=self.block(node.do_body), handlers=[handler], orelse=[], finalbody=finalbody)]
+		return statement + self._deliver(_load(value), tail) if value != tail else statement
+
+	def program(self, program):
+		body = [_assign(RESULT, ast.Constant(value=None))] + self.block(program.body, RESULT)
+		return ast.fix_missing_locations(ast.Module(body=body, type_ignores=[]))
+
+
+def transpile(program):
+	"""Lower an AST.Program to a Python ast.Module."""
+	return Transpiler().program(program)
+
+
+def compile_program(program):
+	return compile(transpile(program), '<cup>', 'exec')
+
+
+_namespaces = weakref.WeakKeyDictionary()
+_reserved = ('__builtins__', 'Exception')
+
+
+def namespace_for(env):
+	"""The Python globals dict backing `env`, created on first use."""
+	namespace = _namespaces.get(env)
+	if namespace is None:
+		if env._parent is None:
+			namespace = {'__builtins__': {}, 'Exception': Exception}
+			namespace.update(helpers)
+		else:
+			# Python globals are flat: start from a copy of the enclosing frame's
+			namespace = dict(namespace_for(env._parent))
+		for key, val in env.asdict().items():
+			namespace[mangle(key)] = Builtin(val) if isinstance(val, AST.BuiltinFunction) else val
+		_namespaces[env] = namespace
+	return namespace
+
+
+def run(code, env):
+	namespace = namespace_for(env)
+	exec(code, namespace)
+	for key, val in namespace.items():
+		if key in _reserved or key.startswith('__cup_') and not key.startswith('__cup_kw_'): continue
+		if not isinstance(val, Builtin): env.set(unmangle(key), val)
+	return namespace.get(RESULT)
+
+
+def evaluate_env(s, env, verbose=False, optimize=True, cache=None):
+	program = parse(s, verbose, optimize, cache)
+	if program is None: return
+
+	module = transpile(program)
+
+	if verbose:
+		print('Python')
+		print(ast.unparse(module))
+		print()
+
+	ret = run(compile(module, '<cup>', 'exec'), env)
+
+	if verbose:
+		print('Environment')
+		print_env(env)
+		print()
+
+	return ret
+
+
+def evaluate(s, verbose=False, optimize=True, cache=None):
+	return evaluate_env(s, create_global_env(), verbose, optimize, cache)
@@ -0,0 +1,234 @@
+from __future__ import print_function
+from collections import namedtuple
+
+from Cup import AST
+from Cup.Bytecode import (
+	LOAD_CONST, LOAD_NAME, STORE_NAME, POP_TOP, DUP_TOP, BINARY, UNARY, GETITEM, SETITEM,
+	BUILD_LIST, BUILD_SHELL, BUILD_DICT, CALL, RETURN, MAKE_FUNCTION, MAKE_GENERATOR,
+	JUMP, JUMP_IF_FALSE, GET_ITER, FOR_ITER, SETUP_EXCEPT, POP_EXCEPT, RAISE_SKIP, TAIL_CALL, MAKE_FUNCTION_DEFAULTS,
+	BUILD_RANGE, RANGE_CLOSED_START, RANGE_CLOSED_STOP, YIELD_VALUE, AWAIT, SETUP_FINALLY, END_FINALLY,
+	binary_functions, unary_functions, compile_program, disassemble,
+)
+from Cup.AST import bind_arguments
+from Cup.Interpreter import Environment, Skip, create_global_env, drive, parse
+from Cup.Operators import make_range
+from Cup.Resolver import Layout
+from Cup.Utils import print_env
+
+
+class Function(namedtuple('Function', ['name', 'params', 'code', 'env', 'defaults', 'layout'])):
+	"""A user function at run time, closed over the environment it was declared in.
+
+	Python code, such as a builtin, can call it directly.
+	"""
+
+	__slots__ = ()
+
+	def __call__(self, *args): return call_function(self, list(args), None)
+
+# frame layouts, shared by every function made from the same code
+_layouts = {}
+
+
+def make_function(code, env, defaults=()):
+	layout = _layouts.get(code.varnames)
+	if layout is None: layout = _layouts[code.varnames] = Layout(code.varnames)
+	return Function(code.name, code.params, code, env, defaults, layout)
+
+
+# a throw in code before version 6: the function returns the values of the expression
+def _throw_values(code, env):
+	for val in run(code, env):
+		yield val
+
+
+def call_function(function, args, env):
+	args = bind_arguments(function, args)
+	if type(function) is AST.BuiltinFunction:
+		return function.body(*args)
+	call_env = Environment(function.env, args, function.layout)
+	if function.code.sync: return drive(execute(function.code, call_env))
+	if function.code.generator: return execute(function.code, call_env)
+	return run(function.code, call_env)
+
+
+def run(code, env):
+	"""Execute a Code object that does not throw in `env` and return its value."""
+	try: next(execute(code, env))
+	except StopIteration as stop: return stop.value
+	raise RuntimeError(f'{code.name} throws, it can only be run as a generator')
+
+
+# a return waiting for a last block to run (see Bytecode.compile_exception)
+Returning = namedtuple('Returning', ['value'])
+
+
+def _skip_block(skips, pc):
+	for block in skips:
+		if block[0] <= pc < block[1]: return block
+
+
+def execute(code, env):
+	"""Execute a Code object in `env`: a generator of the values it throws, returning its value.
+
+	A call to a Cup function saves the caller on `frames` and carries on in
+	the same loop instead of recursing, so Cup recursion is bounded only by
+	memory; an exception unwinds those frames to the nearest do handler,
+	and a skip to the nearest block that stops it (see Bytecode.Code).
+	A handler is (target, stack depth, start): start is None for a do
+	block, or where the region a last block guards starts.
+	A call to a generator function is not run here: it returns the
+	generator of its own execute().
+	"""
+	frames = []
+	instructions = code.instructions
+	constants = code.constants
+	names = code.names
+	skips = code.skips
+	stack = []
+	push = stack.append
+	pop = stack.pop
+	handlers = []
+	pc = 0
+	while True:
+		try:
+			while True:
+				op = instructions[pc]
+				arg = instructions[pc + 1]
+				pc += 2
+				if op == LOAD_NAME: push(env.lookup(names[arg]))
+				elif op == LOAD_CONST: push(constants[arg])
+				elif op == BINARY:
+					right = pop()
+					stack[-1] = binary_functions[arg](stack[-1], right)
+				elif op == JUMP_IF_FALSE:
+					if not pop(): pc = arg
+				elif op == STORE_NAME: env.set(names[arg], pop())
+				elif op == JUMP: pc = arg
+				elif op == POP_TOP: pop()
+				elif op == GETITEM:
+					key = pop()
+					stack[-1] = stack[-1][key]
+				elif op == CALL or op == TAIL_CALL:
+					args = stack[len(stack) - arg:]
+					del stack[len(stack) - arg:]
+					function = pop()
+					if type(function) is not Function or function.code.generator:
+						push(call_function(function, args, env))
+						continue
+					call_env = Environment(function.env, bind_arguments(function, args), function.layout)
+					# a tail call drops the caller's frame, whose RETURN would only pass the value on
+					if op == CALL: frames.append((instructions, constants, names, skips, stack, handlers, pc, env))
+					env = call_env
+					code = function.code
+					instructions = code.instructions
+					constants = code.constants
+					names = code.names
+					skips = code.skips
+					stack = []
+					push = stack.append
+					pop = stack.pop
+					handlers = []
+					pc = 0
+				elif op == RETURN:
+					value = pop()
+					while handlers and handlers[-1][2] is None: handlers.pop()
+					if handlers:
+						# run the last block first; its END_FINALLY returns again
+						pc, depth, _ = handlers.pop()
+						del stack[depth:]
+						push(Returning(value))
+						continue
+					if not frames: return value
+					instructions, constants, names, skips, stack, handlers, pc, env = frames.pop()
+					push = stack.append
+					pop = stack.pop
+					push(value)
+				elif op == FOR_ITER:
+					try: push(next(stack[-1]))
+					except StopIteration:
+						pop()
+						pc = arg
+				elif op == SETITEM:
+					value = pop()
+					key = pop()
+					pop()[key] = value
+				elif op == UNARY: stack[-1] = unary_functions[arg](stack[-1])
+				elif op == DUP_TOP: push(stack[-1])
+				elif op == GET_ITER: stack[-1] = iter(stack[-1])
+				elif op == BUILD_LIST:
+					items = stack[len(stack) - arg:]
+					del stack[len(stack) - arg:]
+					push(items)
+				elif op == BUILD_SHELL:
+					items = tuple(stack[len(stack) - arg:])
+					del stack[len(stack) - arg:]
+					push(items)
+				elif op == BUILD_DICT:
+					items = stack[len(stack) - 2 * arg:]
+					del stack[len(stack) - 2 * arg:]
+					push({items[i]: items[i + 1] for i in range(0, len(items), 2)})
+				elif op == BUILD_RANGE:
+					step = pop()
+					stop = pop()
+					stack[-1] = make_range(stack[-1], stop, step, arg & RANGE_CLOSED_START, arg & RANGE_CLOSED_STOP)
+				elif op == MAKE_FUNCTION:
+					push(make_function(constants[arg], env))
+				elif op == MAKE_FUNCTION_DEFAULTS: stack[-1] = make_function(constants[arg], env, stack[-1])
+				elif op == YIELD_VALUE: yield pop()
+				elif op == AWAIT: push((yield pop()))
+				elif op == MAKE_GENERATOR: push(_throw_values(constants[arg], env))
+				elif op == SETUP_EXCEPT: handlers.append((arg, len(stack), None))
+				elif op == SETUP_FINALLY: handlers.append((arg, len(stack), pc))
+				elif op == POP_EXCEPT: handlers.pop()
+				elif op == END_FINALLY:
+					pending = pop()
+					if type(pending) is not Returning: raise pending
+					push(pending.value)
+				elif op == RAISE_SKIP: raise Skip()
+				else: raise Exception(f'Unknown opcode {op}')
+		except Exception as error:
+			skipped = type(error) is Skip
+			while True:
+				# the instruction that raised, or the call that did
+				block = _skip_block(skips, pc - 2) if skipped else None
+				start = handlers[-1][2] if handlers else None
+				# a last block guarding the error runs first, unless a block inside it stops the skip
+				guarded = start is not None and (block is None or block[0] < start)
+				if block is not None and block[2] is not None and not guarded:
+					pc, depth = block[2], block[3]
+					break
+				if handlers and (block is not None or not skipped or guarded):
+					pc, depth, _ = handlers.pop()
+					break
+				if not frames: raise
+				instructions, constants, names, skips, stack, handlers, pc, env = frames.pop()
+			push = stack.append
+			pop = stack.pop
+			del stack[depth:]
+			if guarded: push(error)
+
+
+def evaluate_env(s, env, verbose=False, tail_calls=False, optimize=True, cache=None):
+	program = parse(s, verbose, optimize, cache)
+	if program is None: return
+
+	code = compile_program(program, tail_calls)
+
+	if verbose:
+		print('Bytecode')
+		print(disassemble(code))
+		print()
+
+	ret = run(code, env)
+
+	if verbose:
+		print('Environment')
+		print_env(env)
+		print()
+
+	return ret
+
+
+def evaluate(s, verbose=False, tail_calls=False, optimize=True, cache=None):
+	return evaluate_env(s, create_global_env(), verbose, tail_calls, optimize, cache)
@@ -1,26 +1,84 @@
 
 
 import argparse # từ python
-from Cup import __version__ as ver, __documents__ as docs, Interpreter
+import json
+import os
+import sys
+from Cup import __version__ as ver, __documents__ as docs, Interpreter, Compiler, Transpiler, VM, Bytecode, Batch
+from Cup.Cache import Cache
+from Cup.Lexer import open_source
+from Cup.Utils import print_ast
 
 
 try: input = raw_input
 except NameError: pass
 
 
+backends = {
+	'tree': Interpreter,
+	'closure': Compiler,
+	'python': Transpiler,
+	'vm': VM,
+}
+
+
 def parse_args():
 	argparser = argparse.ArgumentParser()
 	argparser.add_argument('-v', '--verbose', action='store_true')
-	argparser.add_argument('file', nargs='?')
-	return argparser.parse_args()
+	argparser.add_argument('-b', '--backend', choices=list(backends), default='tree')
+	argparser.add_argument('-o', '--output', help='compile the file to Cup bytecode instead of running it')
+	argparser.add_argument('--tail-calls', action='store_true', help='run returned calls in the caller\'s frame (vm backend and bytecode only)')
+	argparser.add_argument('--no-optimize', dest='optimize', action='store_false', help='skip constant folding and dead-branch elimination')
+	argparser.add_argument('--dump-ast', action='store_true', help='print the (optimized) AST of the file instead of running it')
+	argparser.add_argument('--no-cache', dest='cache', action='store_false', help='always lex and parse the file instead of loading it from the cache ($CUP_CACHE_DIR, ~/.cache/cup)')
+	argparser.add_argument('-j', '--jobs', type=int, help='run the files, and the Cup files in the directories, on JOBS worker processes and print a JSON summary')
+	argparser.add_argument('--timeout', type=float, help='stop a script of a batch after TIMEOUT seconds')
+	argparser.add_argument('--summary', help='write the JSON summary of a batch to this file instead of printing it')
+	argparser.add_argument('files', nargs='*', metavar='file')
+	args = argparser.parse_args()
+	args.batch = args.jobs is not None or len(args.files) > 1 or any(os.path.isdir(path) for path in args.files)
+	if args.batch and (args.output or args.dump_ast):
+		argparser.error('--output and --dump-ast take a single file')
+	if args.jobs is not None and args.jobs < 1: argparser.error('--jobs must be at least 1')
+	if args.tail_calls and args.backend != 'vm' and not args.output and not args.batch:
+		argparser.error('--tail-calls requires --backend vm or --output')
+	return args
+
+
+def runFile(path, verbose = False, backend = 'tree', tail_calls = False, optimize = True, cache = True):
+	options = {'tail_calls': True} if tail_calls else {}
+	if cache: options['cache'] = Cache()
+	with open_source(path) as source:
+		print(str(backends[backend].evaluate(source, verbose = verbose, optimize = optimize, **options)).removesuffix('None')) # removesuffix() | giải pháp tạm thời
+
+
+def compileFile(path, output, tail_calls = False, optimize = True):
+	with open_source(path) as source:
+		program = Interpreter.parse(source, optimize = optimize)
+	if program is not None: Bytecode.dump(Bytecode.compile_program(program, tail_calls), output)
+
+
+def dumpAST(path, optimize = True):
+	with open_source(path) as source:
+		program = Interpreter.parse(source, optimize = optimize)
+	if program is not None: print_ast(program.body)
+
+
+def runBatch(paths, jobs = None, timeout = None, summary = None, backend = 'tree', tail_calls = False, optimize = True, cache = True):
+	result = Batch.run_batch(paths, jobs, timeout, backend, optimize, tail_calls, cache)
+	if summary:
+		with open(summary, 'w') as f: json.dump(result, f, indent=1)
+	else: print(json.dumps(result, indent=1))
+	return 0 if result['counts'].get('ok', 0) == len(result['scripts']) else 1
 
 
-def runFile(path, verbose = False):
-	with open(path) as f:
-		print(str(Interpreter.evaluate(f.read(), verbose = verbose)).removesuffix('None')) # removesuffix() | giải pháp tạm thời
+def runBytecode(path, verbose = False):
+	code = Bytecode.load(path)
+	if verbose: print(Bytecode.disassemble(code))
+	print(str(VM.run(code, Interpreter.create_global_env())).removesuffix('None'))
 
 
-def runPrompt():
+def runPrompt(backend = 'tree', optimize = True):
 	print(f'Welcome to Cup {ver}! Type "help" for more information.')
 	env = Interpreter.create_global_env()
 	while True:
@@ -32,16 +90,23 @@ def runPrompt():
 					nxtinp = input('[...] ')
 					if not nxtinp: break
 					else: inp += '\n' + nxtinp
-			print(str(Interpreter.evaluate_env(inp, env)).removesuffix("None"))
+			print(str(backends[backend].evaluate_env(inp, env, optimize = optimize)).removesuffix("None"))
 		except KeyboardInterrupt: print('[Suggest] Type "exit()" for end!')
 
 
 def main():
 	args = parse_args()
 	extensions = ['cup', 'cp', 'u']
-	if args.file:
-		if args.file.split('.')[-1] in extensions: runFile(args.file, args.verbose)
-		else: print("Invalid fileType for Cup (.cup, .cp, .u)")
-	else: runPrompt()
+	if args.batch:
+		sys.exit(runBatch(args.files, args.jobs, args.timeout, args.summary, args.backend, args.tail_calls, args.optimize, args.cache))
+	elif args.files:
+		file = args.files[0]
+		extension = file.split('.')[-1]
+		if extension == 'cupb': runBytecode(file, args.verbose)
+		elif extension not in extensions: print("Invalid fileType for Cup (.cup, .cp, .u, .cupb)")
+		elif args.dump_ast: dumpAST(file, args.optimize)
+		elif args.output: compileFile(file, args.output, args.tail_calls, args.optimize)
+		else: runFile(file, args.verbose, args.backend, args.tail_calls, args.optimize, args.cache)
+	else: runPrompt(args.backend, args.optimize)
 
 if __name__ == '__main__': main()
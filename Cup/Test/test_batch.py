@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+
+from Cup import Batch
+
+
+SCRIPTS = {
+    'hello.cup': 'say("hello")\n1 + 2',
+    'syntax.cup': 'x = (1 +\n',
+    'notes.txt': 'not a script',
+    os.path.join('more', 'globals.cp'): 'x = 1\nx',
+    os.path.join('more', 'loop.u'): 'do:\n    while true:\n        x = 1\nunless true:\n    say("caught")',
+    os.path.join('more', 'exit.cup'): "run('import os; os._exit(3)')",
+}
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+        for name, source in SCRIPTS.items():
+            path = os.path.join(self.directory, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f: f.write(source)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_find_scripts(self):
+        extra = os.path.join(self.directory, 'notes.txt')
+        names = [os.path.relpath(path, self.directory) for path in Batch.find_scripts([self.directory, extra])]
+        self.assertEqual(names, ['hello.cup', 'syntax.cup', os.path.join('more', 'exit.cup'),
+            os.path.join('more', 'globals.cp'), os.path.join('more', 'loop.u'), 'notes.txt'])
+
+    def test_run_batch(self):
+        for backend in ('tree', 'vm'):
+            summary = Batch.run_batch([self.directory], jobs=2, timeout=0.5, backend=backend, cache=False)
+            entries = {os.path.basename(entry['path']): entry for entry in summary['scripts']}
+            self.assertEqual(summary['counts'], {'ok': 2, 'error': 1, 'timeout': 1, 'crashed': 1}, backend)
+            self.assertEqual((entries['hello.cup']['result'], entries['hello.cup']['stdout']), ('3', 'hello\n'))
+            self.assertEqual(entries['globals.cp']['result'], '1')
+            self.assertEqual(entries['syntax.cup']['error'], 'Expected expression at 1:9')
+            # the time limit is not an error a do block can catch
+            self.assertEqual((entries['loop.u']['status'], entries['loop.u']['stdout']), ('timeout', ''))
+            self.assertEqual(entries['exit.cup']['status'], 'crashed')
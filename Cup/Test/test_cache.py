@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+
+from Cup import AST, VM
+from Cup.Cache import Cache
+from Cup.Interpreter import evaluate, parse
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.cache = Cache(self._directory.name)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_hit(self):
+        src = 'let f(n):\n    n * 2\nf(21)'
+        self.assertEqual(evaluate(src, cache=self.cache), 42)
+        key = self.cache.key(src)
+        self.assertEqual(self.cache.load(key), parse(src))
+        # a hit is run without lexing or parsing the source again
+        self.cache.store(key, AST.Program([AST.Number(7)]))
+        self.assertEqual(evaluate(src, cache=self.cache), 7)
+        self.assertEqual(VM.evaluate(src, cache=self.cache), 7)
+        self.assertEqual(evaluate(src), 42)
+
+    def test_key(self):
+        key = self.cache.key('x = 1')
+        self.assertEqual(self.cache.key(b'x = 1'), key)
+        self.assertNotEqual(self.cache.key('x = 2'), key)
+        self.assertNotEqual(self.cache.key('x = 1', optimize=False), key)
+
+    def test_invalid_entry(self):
+        key = self.cache.key('1')
+        path = os.path.join(self.cache.directory, key + '.cupc')
+        with open(path, 'wb') as f: f.write(b'CUPC garbage')
+        self.assertIsNone(self.cache.load(key))
+        self.assertFalse(os.path.exists(path))
+        self.assertIsNone(self.cache.load(self.cache.key('2')))
+
+    def test_eviction(self):
+        programs = [AST.Program([AST.String('x' * 100), AST.Number(i)]) for i in range(3)]
+        for i, program in enumerate(programs):
+            self.cache.store(str(i), program)
+            # distinct modification times, oldest first
+            os.utime(os.path.join(self.cache.directory, f'{i}.cupc'), (i, i))
+        self.cache.load('0')
+        self.cache.max_size = sum(size for _, size, _ in self.cache.entries()) - 1
+        self.cache.evict()
+        self.assertIsNone(self.cache.load('1'))
+        self.assertEqual(self.cache.load('0'), programs[0])
+        self.assertEqual(self.cache.load('2'), programs[2])
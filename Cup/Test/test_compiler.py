@@ -0,0 +1,50 @@
+import unittest
+
+from Cup import Compiler, Interpreter
+
+
+class CompilerTest(unittest.TestCase):
+
+    def _assertSameResult(self, s, expected):
+        self.assertEqual(Interpreter.evaluate(s), expected)
+        self.assertEqual(Compiler.evaluate(s), expected)
+
+    def test_arithmetic(self):
+        self._assertSameResult('1 + 2 * 3 - 4 \\ 3', 6)
+        self._assertSameResult('-2 ^ 2', -4)
+
+    def test_operator_sites(self):
+        # one site sees ints, floats and strings in turn
+        src = '''let add(a, b):
+    return a + b
+[add(1, 2), add(0.5, 0.25), add("a", "b"), add(1, 2) * 2.5, 7 % 4 <=> 3]'''
+        self._assertSameResult(src, [3, 0.75, 'ab', 7.5, True])
+
+    def test_function(self):
+        src = '''let fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+fib(15)'''
+        self._assertSameResult(src, 610)
+
+    def test_loops(self):
+        src = '''total = 0
+i = 0
+while i < 10:
+    i = i + 1
+    if i % 2 == 0:
+        skip
+    total = total + i
+for x in [1, 2, 3, 4]:
+    total = total + x
+    quit
+total'''
+        self._assertSameResult(src, 56)
+
+    def test_rerun(self):
+        program = Interpreter.parse('x = x + 1\nx')
+        run = Compiler.compile_program(program)
+        env = Interpreter.create_global_env()
+        env.set('x', 0)
+        self.assertEqual([run(env) for _ in range(3)], [1, 2, 3])
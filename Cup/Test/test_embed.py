@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor
+import unittest
+
+from Cup import Embed
+from Cup.Errors import CupSyntaxError
+from Cup.Interpreter import create_global_env
+
+
+SOURCE = '''let fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+total = 0
+i = 0
+while i < limit:
+    total = total + fib(i)
+    i = i + 1
+total'''
+
+
+class EmbedTest(unittest.TestCase):
+
+    def test_run(self):
+        for backend in Embed.backends:
+            program = Embed.compile(SOURCE, backend)
+            self.assertEqual(program.run({'limit': 10}), 88, backend)
+            self.assertEqual(program.run({'limit': 5}), 7, backend)
+            self.assertEqual(program.run({'limit': 10}), 88, backend)
+
+    def test_environment(self):
+        for backend in Embed.backends:
+            env = create_global_env()
+            env.set('limit', 3)
+            self.assertEqual(Embed.compile(SOURCE, backend).run(env), 2, backend)
+            self.assertEqual(env.lookup('i'), 3)
+
+    def test_syntax_error(self):
+        with self.assertRaises(CupSyntaxError) as context:
+            Embed.compile('x = 1\ny = (2 +\n')
+        error = context.exception
+        self.assertEqual((error.mess, error.ln, error.col), ('Expected expression', 2, 9))
+        self.assertEqual(error.source_line, 'y = (2 +')
+
+    def test_arity_error(self):
+        with self.assertRaises(CupSyntaxError) as context:
+            Embed.compile('let f(a, b = 1):\n    a\nx = f(1, 2, 3)\n')
+        error = context.exception
+        self.assertEqual((error.mess, error.ln, error.col), ('Expected 1 to 2 arguments, got 3', 3, 6))
+        self.assertEqual(error.source_line, 'x = f(1, 2, 3)')
+        # it is still the TypeError a call that cannot fit raises when it runs
+        self.assertIsInstance(error, TypeError)
+
+    def test_threads(self):
+        for backend in Embed.backends:
+            program = Embed.compile(SOURCE, backend)
+            with ThreadPoolExecutor(4) as pool:
+                results = list(pool.map(lambda limit: program.run({'limit': limit}), range(15)))
+            self.assertEqual(results, [Embed.compile(SOURCE).run({'limit': limit}) for limit in range(15)], backend)
@@ -1,9 +1,13 @@
-import unittest, os
+import contextlib, io, unittest, os, tempfile
 
-from Cup.Interpreter import evaluate
+from Cup import Compiler, Interpreter, Transpiler, VM
+from Cup.__main__ import runFile
+from Cup.Interpreter import BUILTINS, complete, create_global_env, eval_statements, evaluate, evaluate_env, parse
 
 TESTS_DIR = os.path.dirname(__file__)
 
+BACKENDS = (Interpreter, Compiler, Transpiler, VM)
+
 
 class InterpreterTest(unittest.TestCase):
 
@@ -14,7 +18,255 @@ class InterpreterTest(unittest.TestCase):
         with open(os.path.join(TESTS_DIR, path)) as f:
             return self._evaluate(f.read())
 
+    def _assert_all_backends(self, src, expected, backends=BACKENDS):
+        for backend in backends:
+            with self.subTest(backend=backend.__name__):
+                self.assertEqual(backend.evaluate(src), expected)
+
     # def test_big(self):
     #     self.assertEqual(self._evaluate_file(''),)
     #     self.assertEqual(self._evaluate_file(''),)
     #     self._evaluate_file('')
+
+    def test_lexical_scope(self):
+        src = '''let make(n):
+    let add(x):
+        x + n
+    add
+adder = make(10)
+let call(f):
+    n = 1
+    f(5)
+call(adder)'''
+        self._assert_all_backends(src, 15)
+        # a local read before it is bound reads the enclosing name, which keeps its value
+        src = '''n = 5
+let f():
+    n = n + 1
+    let g():
+        n = n * 2
+        n
+    [n, g()]
+[f(), n]'''
+        self._assert_all_backends(src, [[6, 12], 5])
+
+    def test_control_flow(self):
+        # skip leaving a function continues the caller's loop
+        src = '''let find(items, key):
+    for i in items:
+        if i == key:
+            return i
+        continue
+    return -1
+let check(n):
+    when n % 3:
+        is 0:
+            skip
+    n
+total = 0
+i = 0
+while i < 10:
+    i = i + 1
+    check(i)
+    total = total + i
+do:
+    skip
+unless 1:
+    total = total + 100
+total + find([1, 2, 3], 3) + find([1], 5)'''
+        self._assert_all_backends(src, 139)
+        # a return leaves do or unless after the last block, which runs like a finally
+        src = '''log = []
+let f(n):
+    do:
+        if n > 0:
+            return n
+        1 / 0
+    unless true:
+        return -1
+    last:
+        add(n, log)
+    0
+let g():
+    do:
+        return 1
+    last:
+        return 2
+let h():
+    do:
+        1 / 0
+    unless true:
+        6
+    last:
+        7
+[f(1), f(0), g(), h(), log]'''
+        self._assert_all_backends(src, [1, -1, 2, 7, [1, 0]])
+
+    def test_shadow_builtin(self):
+        for backend in (Compiler, Transpiler, VM):
+            env = create_global_env()
+            self.assertEqual(backend.evaluate_env('size = 3\nsize', env), 3)
+            self.assertEqual(backend.evaluate('size([1, 2])'), 2)
+        env = create_global_env()
+        self.assertEqual(evaluate_env('let size(x):\n    0\nsize([1])', env), 0)
+        self.assertEqual(evaluate('size([1])'), 1)
+        self.assertEqual(env.asdict().keys(), {'size'})
+        with self.assertRaises(TypeError): BUILTINS.set('size', 0)
+
+    def test_arguments(self):
+        src = '''base = 10
+let f(a, b = base * 2, c = []):
+    add(a, c)
+    a + b + size(c)
+base = 0
+f(1) + f(1, 2) + f(1, 2, [5]) + limit(0, 4)[-1] + size(split('a b'))'''
+        # defaults are evaluated once, where the function is declared
+        self._assert_all_backends(src, 22 + 5 + 5 + 3 + 2)
+        # a parameter may hold any function: its calls are checked when they run
+        self.assertEqual(evaluate('let f(a):\n    a\nlet g(f):\n    f()\nlet h():\n    7\ng(h)'), 7)
+        # a program run without the Resolver lays out its frames when the functions are declared
+        program = parse(src)
+        self.assertEqual(complete(eval_statements(program.body, create_global_env())), 37)
+
+    def test_arity_error(self):
+        # a call that cannot fit is reported before the program runs, at its `(`
+        src = 'let f(a, b = 1):\n    a\nlet g():\n    f()\n0'
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'arity.cup')
+            with open(path, 'w') as f: f.write(src)
+            for backend in ('tree', 'closure', 'python', 'vm'):
+                output = io.StringIO()
+                with self.subTest(backend=backend), contextlib.redirect_stdout(output):
+                    runFile(path, backend=backend, cache=False)
+                    self.assertEqual(output.getvalue(), 'Syntax error: Expected 1 to 2 arguments, got 0 at line 4, column 6\n    f()\n     ^\n\n')
+
+    def test_memo(self):
+        src = '''let paths(x, y):
+    if x * y == 0:
+        return 1
+    return paths(x - 1, y) + paths(x, y - 1)
+paths = memo(paths)
+result = paths(12, 12)
+stats = memostats(paths)
+let total(items):
+    sum(items)
+total = memo(total, 1)
+total([1, 2])
+total(shell([1, 2]))
+total(shell([3]))
+total(shell([1, 2]))
+memoclear(paths)
+[result, stats['hits'], stats['misses'], memostats(total), memostats(paths)['size']]'''
+        total_stats = {'hits': 0, 'misses': 3, 'uncached': 1, 'size': 1, 'max_size': 1}
+        self._assert_all_backends(src, [2704156, 121, 168, total_stats, 0])
+        with self.assertRaises(TypeError): evaluate('memostats(size)')
+
+    def test_logical_operators(self):
+        src = '''items = [1, 2, 3]
+seen = set(items)
+found = 0
+i = 0
+while i < 5:
+    // the subscript would fail once i passes the end
+    if i < size(items) and items[i] % 2 == 1 or i == 4:
+        found = found + 1
+    i = i + 1
+none = null
+[found, 2 in seen, 4 not in seen, 'x' in {'x': 1}, none is null, none is not null, 0 or 2, 1 & 0, 1 not in items]'''
+        expected = [3, True, True, True, True, False, True, False, False]
+        self._assert_all_backends(src, expected)
+
+    def test_range(self):
+        src = '''r = [100;10;2)
+total = 0
+for i in (0;10;3]:
+    total = total + i
+count = 0
+for i in [0;10^5):
+    count = count + 1
+[size(r), r[-1], 12 in r, 13 in r, list(cut(r, 1, 4)), total, count, list((3;3]), size(cut([0;10^8), 5))]'''
+        expected = [45, 12, True, False, [98, 96, 94], 18, 10 ** 5, [], 10 ** 8 - 5]
+        self._assert_all_backends(src, expected)
+
+    def test_generators(self):
+        src = '''let evens(n):
+    i = 0
+    while i < n:
+        i = i + 1
+        if i % 2 == 0:
+            do:
+                throw i
+            unless true:
+                skip
+    throw null
+let naturals():
+    i = 0
+    while true:
+        throw i
+        i = i + 1
+let tail():
+    return 5
+    throw 6
+first = evens(7)
+[list(first), list(first), list(take(naturals(), 3)), list(tail())]'''
+        expected = [[2, 4, 6, None], [], [0, 1, 2], []]
+        self._assert_all_backends(src, expected)
+
+    def test_streams(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'data.txt')
+            with open(path, 'w') as f: f.write('3\n10\n1\n7\n2\n8\n')
+            src = f'''let big(n):
+    n > 2
+let squares(items):
+    for item in items:
+        throw item * item
+numbers = filter(map(lines({path!r}), int), big)
+[list(chunk(squares(numbers), 3)), list(numbers), list(take(squares([1;10^12]), 3)), list(merge('ab', [5;0]))]'''
+            # numbers is read once, by the first pipeline
+            expected = [[[9, 100, 49], [64]], [], [1, 4, 9], [('a', 5), ('b', 4)]]
+            self._assert_all_backends(src, expected)
+
+    def test_sync(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'data.txt')
+            with open(path, 'w') as f: f.write('cup')
+            src = f'''done = []
+sync let job(name, delay):
+    wait sleep(delay)
+    add(name, done)
+    return wait sleep(0, upcase(name))
+sync let main():
+    text = wait readfile({path!r})
+    do:
+        wait readfile({os.path.join(directory, 'missing')!r})
+    unless true:
+        text = text + '?'
+    names = wait gather([job('slow', 0.05), job('fast', 0.01)])
+    [text, names, done]
+runsync(main())'''
+            # the jobs run concurrently: the fast one finishes first
+            expected = ['cup?', ['SLOW', 'FAST'], ['fast', 'slow']]
+            self._assert_all_backends(src, expected)
+
+    def test_pmap(self):
+        src = '''SCALE = 3
+let square(n):
+    return n * n
+let fib(n, k = 1):
+    if n < 2:
+        return n * k
+    return fib(n - 1, k) + fib(n - 2, k)
+let scaled(n):
+    return fib(n, SCALE) + square(n)
+let bounded(limit):
+    let clamp(n):
+        return min([n, limit])
+    return list(pmap([1;10], clamp, 2))
+[list(pmap([0;20), scaled, 3)), list(take(pmap([0;10^12), square), 3)), bounded(5)]'''
+        expected = [[3 * fib + n * n for n, fib in enumerate([0, 1, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 233, 377, 610, 987, 1597, 2584, 4181])], [0, 1, 4], [1, 2, 3, 4, 5, 5, 5, 5, 5, 5]]
+        self._assert_all_backends(src, expected, (Interpreter, Compiler, VM))
+        # the python backend sends only functions declared at the top level
+        self.assertEqual(Transpiler.evaluate(src.replace('bounded(5)', '[]')), expected[:2] + [[]])
+        for src in ('list(pmap([1], abs))', 'list(pmap([1], memo(abs)))', 'list(pmap([1, 2], abs, 0))'):
+            with self.assertRaises((TypeError, ValueError)): evaluate(src)
@@ -1,6 +1,9 @@
+import os
+import tempfile
 import unittest
 
-from Cup.Lexer import Lexer
+from Cup.Errors import CupSyntaxError as LexerError
+from Cup.Lexer import Lexer, TokenBuffer, TokenStream, open_source
 
 class LexerTest(unittest.TestCase):
 
@@ -43,3 +46,40 @@ continue'''
         src2 = '''break
     // continue'''
         self._assertTokensEq(src2, 'BREAK NEWLINE')
+
+    def test_indent_unit(self):
+        # only leading whitespace counts towards the indentation level
+        src = 'if x:\n\ty = "\t\t"\n\t\tz\n'
+        expected = 'IF NAME COLON NEWLINE INDENT NAME ASSIGN STRING NEWLINE INDENT NAME NEWLINE DEDENT DEDENT'
+        self._assertTokensEq(src, expected)
+
+    def test_streaming(self):
+        src = 'x = [1, 2]\nif x:\n\ty\n'
+        stream = TokenStream(Lexer().iter_tokens(src))
+        tokens = []
+        while not stream.is_end():
+            tokens.append(stream.consume())
+        self.assertEqual(tokens, Lexer().tokenize(src))
+        with self.assertRaises(LexerError):
+            stream.consume()
+
+    def test_token_buffer(self):
+        src = 'x = [1, true, 1.0, "x"]\nif x:\n\tx\n'
+        tokens = Lexer().tokenize(src)
+        buffer = Lexer().tokenize_buffer(src)
+        self.assertEqual(list(buffer), tokens)
+        self.assertEqual(buffer[-1], tokens[-1])
+        self.assertEqual(list(TokenBuffer(tokens)), tokens)
+        # each distinct value is stored once, without mixing up 1, 1.0 and true
+        self.assertEqual(buffer.constants, [None, 'x', '=', '[', 1, ',', True, 1.0, ']', ':'])
+
+    def test_mmap(self):
+        src = 'let f(n):\n\treturn n * 2 // twice\nf("\u00e9")\n'
+        with tempfile.NamedTemporaryFile('wb', suffix='.cup', delete=False) as f:
+            f.write(src.encode('utf-8'))
+        try:
+            with open_source(f.name) as source:
+                tokens = Lexer().tokenize(source)
+        finally:
+            os.remove(f.name)
+        self.assertEqual([token[:3] for token in tokens], [token[:3] for token in Lexer().tokenize(src)])
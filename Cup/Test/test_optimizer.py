@@ -0,0 +1,183 @@
+import unittest
+
+from Cup import AST, Compiler, Interpreter, Optimizer, Transpiler, VM
+from Cup.Interpreter import create_global_env, evaluate, evaluate_env, parse
+
+
+class OptimizerTest(unittest.TestCase):
+
+    def _assertSameResult(self, s, expected):
+        for backend in (Interpreter, Compiler, Transpiler, VM):
+            with self.subTest(backend=backend.__name__):
+                self.assertEqual(backend.evaluate(s), expected)
+        self.assertEqual(evaluate(s, optimize=False), expected)
+
+    def test_fold(self):
+        self.assertEqual(parse('x = 1 + 2 * 3').body[0].right, AST.Number(7))
+        self.assertEqual(parse('x = -(2 ^ 3) < 0 & !false').body[0].right, AST.Logic(True))
+        self.assertEqual(parse('x = "a" + "b"').body[0].right, AST.String('ab'))
+        # left to raise at run time
+        self.assertEqual(type(parse('x = 1 \\ 0').body[0].right), AST.BinaryOperator)
+
+    def test_prune(self):
+        src = '''x = 0
+if false:
+    x = 1
+elif x:
+    x = 2
+elif true:
+    x = 3
+else:
+    x = 4
+while false:
+    x = 5
+1
+x'''
+        program = parse(src)
+        self.assertEqual(len(program.body), 3)
+        condition = program.body[1]
+        self.assertEqual(condition.test, AST.Identifier('x'))
+        self.assertEqual(condition.elifs, [])
+        self.assertEqual(len(condition.else_body), 1)
+        self._assertSameResult(src, 3)
+
+    def test_block_value(self):
+        src = '''let f():
+    1
+    if null:
+        2
+let g(n):
+    when 2:
+        is 1:
+            'one'
+        is 2:
+            'two'
+[f(), g(0), 2 * 3]'''
+        self._assertSameResult(src, [None, 'two', 6])
+
+    def test_skip(self):
+        # a condition that always runs still catches skip from its body
+        src = '''total = 0
+for i in [1, 2, 3]:
+    if 1:
+        skip
+        total = total + 100
+    total = total + i
+total'''
+        self._assertSameResult(src, 6)
+        # or from a function it calls
+        src = '''let stop():
+    skip
+total = 0
+for i in [1, 2, 3]:
+    if true:
+        stop()
+        total = total + 10
+    total = total + i
+total'''
+        for optimize in (True, False):
+            self.assertEqual(evaluate(src, optimize=optimize), 6)
+            self.assertEqual(Compiler.evaluate(src, optimize=optimize), 6)
+
+    def test_range_loop(self):
+        src = '''let count(i, n):
+    seen = []
+    while i <= n:
+        add(i * 2 + 1, seen)
+        i = i + 2
+    else:
+        add(i, seen)
+    seen
+let down(n):
+    total = 0
+    while n > 0:
+        if n == 3:
+            return [total, n]
+        total = total + n
+        n = n - 1
+    [total, n]
+let first(n):
+    while n < 10:
+        quit
+        n = n + 1
+    n
+let skipping(i):
+    while i < 6:
+        i = i + 1
+        continue
+        i = i + 1
+    i
+[count(1, 6), count(0.5, 2), count(9, 1), down(5), first(4), skipping(0)]'''
+        loops = [node for node in parse(src).body[0].body if type(node) is AST.RangeLoop]
+        self.assertEqual(len(loops), 1)
+        self.assertEqual(len(loops[0].derived), 1)
+        self._assertSameResult(src, [[3, 7, 11, 7], [2.0, 2.5], [9], [9, 3], 4, 6])
+
+    def test_hoisting(self):
+        src = '''let scale(items, k):
+    result = []
+    i = 0
+    n = size(items)
+    while i < n:
+        add(items[i] * (k * k + 1), result)
+        i = i + 1
+    result
+let never(n):
+    while n < 0:
+        n = n + 1 \\ 0
+    n
+[scale([1, 2], 3), never(4)]'''
+        hoisted = []
+        Optimizer.optimize(parse(src, optimize=False), hoisted.append)
+        self.assertEqual(len(hoisted), 2)
+        self.assertIn('hoisted (k * k) + 1', hoisted[0])
+        self._assertSameResult(src, [[10, 20], 4])
+
+    def test_hoisting_containers(self):
+        # a container stored into, passed to a call or looked into is not invariant
+        src = '''a = [0]
+b = a
+t = []
+i = 0
+while i < 6:
+    b[0] = i \\ 2
+    t = t + (a * 1)
+    i = i + 1
+d = {}
+n = 0
+i = 0
+while i < 3:
+    d[i] = 1
+    n = n + (2 in d)
+    i = i + 1
+c = []
+sizes = []
+while size(sizes) < 3:
+    add(size(c * 1), sizes)
+    add(0, c)
+[t, n, sizes]'''
+        changes = []
+        Optimizer.optimize(parse(src, optimize=False), changes.append)
+        self.assertFalse([change for change in changes if 'hoisted' in change])
+        self._assertSameResult(src, [[0, 0, 1, 1, 2, 2], 1, [0, 1, 2]])
+
+    def test_hoisting_calls(self):
+        # a call may change any global container in place
+        src = '''a = [1]
+let grow():
+    add(2, a)
+t = 0
+i = 0
+while i < 3:
+    t = t + size(a * 1)
+    grow()
+    i = i + 1
+t'''
+        changes = []
+        Optimizer.optimize(parse(src, optimize=False), changes.append)
+        self.assertFalse([change for change in changes if 'hoisted' in change])
+        self._assertSameResult(src, 6)
+        # the temporaries of a hoisted expression stay out of the environment
+        env = create_global_env()
+        self.assertEqual(evaluate_env('k = 2\nt = 0\ni = 0\nwhile i < 3:\n    t = t + k * k\n    i = i + 1\nt', env), 12)
+        self.assertEqual(env.asdict().keys(), {'k', 't', 'i'})
@@ -2,7 +2,7 @@ import unittest
 
 from Cup import AST
 from Cup.Lexer import Lexer, TokenStream
-from Cup.Parser import Parser
+from Cup.Parser import Parser, ParserError
 
 
 class ParserTest(unittest.TestCase):
@@ -18,3 +18,67 @@ class ParserTest(unittest.TestCase):
             '1',
             [ast.Number(1)]
         )
+
+    def test_dictionary(self):
+        self._assertNodesEq(
+            'x = {"a": 1 + 2, "b": f(3)[0]}',
+            [AST.Assignment(AST.Identifier('x'), AST.Dictionary([
+                (AST.String('a'), AST.BinaryOperator('+', AST.Number(1), AST.Number(2))),
+                (AST.String('b'), AST.SubscriptOperator(AST.CallFunction(AST.Identifier('f'), [AST.Number(3)], 1, 24), AST.Number(0))),
+            ]))]
+        )
+
+    def test_range(self):
+        self._assertNodesEq(
+            'x = [1; n)\n(10; 0; 2]',
+            [
+                AST.Assignment(AST.Identifier('x'), AST.Range(AST.Number(1), AST.Identifier('n'), None, True, False)),
+                AST.Range(AST.Number(10), AST.Number(0), AST.Number(2), False, True),
+            ]
+        )
+
+    def test_precedence(self):
+        self._assertNodesEq(
+            '-a * b ^ 2 + c[1] == 4',
+            [AST.BinaryOperator('==', AST.BinaryOperator(
+                '+',
+                AST.BinaryOperator('*', AST.UnaryOperatorPrefix('-', AST.Identifier('a')), AST.BinaryOperator('^', AST.Identifier('b'), AST.Number(2))),
+                AST.SubscriptOperator(AST.Identifier('c'), AST.Number(1)),
+            ), AST.Number(4))]
+        )
+
+    def test_long_expression(self):
+        # 10^5 terms parse without recursion, left associative
+        node = self._parse(' + '.join(['1'] * 10 ** 5))[0]
+        depth = 0
+        while isinstance(node, AST.BinaryOperator):
+            self.assertEqual(node.right, AST.Number(1))
+            node, depth = node.left, depth + 1
+        self.assertEqual(depth, 10 ** 5 - 1)
+
+    def test_deep_nesting(self):
+        depth = 10 ** 5
+        node = self._parse('[' * depth + ']' * depth)[0]
+        for _ in range(depth - 1):
+            node, = node.items
+        self.assertEqual(node, AST.List([]))
+
+        node = self._parse('-' * depth + '(' * depth + 'x' + ')' * depth + '[0]')[0]
+        for _ in range(depth):
+            self.assertEqual(node.operator, '-')
+            node = node.right
+        self.assertEqual(node, AST.SubscriptOperator(AST.Identifier('x'), AST.Number(0)))
+
+    def test_deep_blocks(self):
+        depth = 3000
+        node, = self._parse(''.join('\t' * i + 'while x:\n' for i in range(depth)) + '\t' * depth + 'x\n')
+        for _ in range(depth - 1):
+            node, = node.body
+        self.assertEqual(node.body, [AST.Identifier('x')])
+
+    def test_sync(self):
+        node, = self._parse('sync let f(x):\n    y = wait g(x)\n    return wait y\n')
+        self.assertTrue(node.sync and node.generator)
+        self.assertEqual(node.body[0].right, AST.Wait(AST.CallFunction(AST.Identifier('g'), [AST.Identifier('x')], 2, 15)))
+        for src in ['wait x\n', 'let f():\n    wait x\n', 'sync let f():\n    throw 1\n', 'sync let f():\n    y = 1 + wait x\n']:
+            with self.assertRaises(ParserError): self._parse(src)
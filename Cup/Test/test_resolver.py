@@ -0,0 +1,38 @@
+import unittest
+
+from Cup import AST
+from Cup.Interpreter import create_global_env, evaluate, evaluate_env, parse
+from Cup.Resolver import resolve
+
+
+class ResolverTest(unittest.TestCase):
+
+    def test_addresses(self):
+        env = create_global_env()
+        program = resolve(parse('x = 1\nlet f(a):\n    b = a + x\n    b\n'), env)
+        x, function = program.body
+        self.assertEqual(x.left.address, (0, env.slot('x')))
+        self.assertEqual(function.layout.names, ('a', 'b'))
+        assign, read = function.body
+        self.assertEqual(assign.left.address, (0, 1))
+        self.assertEqual(assign.right.left.address, (0, 0))
+        self.assertEqual(assign.right.right.address, (1, env.slot('x')))
+        self.assertEqual(read, AST.Identifier('b', (0, 1)))
+
+    def test_read_before_local_assignment(self):
+        src = '''x = 10
+let f():
+    y = x
+    x = 1
+    x + y
+f() + x'''
+        self.assertEqual(evaluate(src), 21)
+
+    def test_stored_null(self):
+        self.assertEqual(evaluate('x = clear([1])\nx == clear([])'), True)
+
+    def test_reused_env(self):
+        env = create_global_env()
+        evaluate_env('x = 2', env)
+        evaluate_env('let f(n):\n    n * x', env)
+        self.assertEqual(evaluate_env('y = f(3)\ny + x', env), 8)
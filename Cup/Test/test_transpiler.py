@@ -0,0 +1,90 @@
+import unittest
+
+from Cup import Interpreter, Transpiler
+
+
+class TranspilerTest(unittest.TestCase):
+
+    def _assertSameResult(self, s, expected):
+        self.assertEqual(Interpreter.evaluate(s), expected)
+        self.assertEqual(Transpiler.evaluate(s), expected)
+
+    def test_operators(self):
+        self._assertSameResult('7 \\ 2 + 2 ^ 3', 11)
+        self._assertSameResult('[1, 2] >< [3]', True)
+        self._assertSameResult('1 <=> 1.0', True)
+        self._assertSameResult('0 & 1', False)
+        self._assertSameResult('-2 ^ 2', -4)
+
+    def test_implicit_return(self):
+        src = '''let sign(x):
+    if x < 0:
+        -1
+    elif x == 0:
+        0
+    else:
+        1
+sign(-5) + sign(0) * 10 + sign(3) * 100'''
+        self._assertSameResult(src, 99)
+
+    def test_control_flow(self):
+        src = '''total = 0
+i = 0
+while i < 10:
+    i = i + 1
+    if i > 5:
+        skip
+        total = total + 1000
+    total = total + i
+for x in [1, 2, 3]:
+    total = total + x
+    continue
+    total = total + 100
+while true:
+    quit
+else:
+    total = 0
+total'''
+        self._assertSameResult(src, 61)
+
+    def test_skip_from_call(self):
+        # a skip leaving a call continues the caller's loop, or ends its if
+        src = '''let check(n):
+    when n % 3:
+        is 0:
+            skip
+    n
+total = 0
+for i in [1, 2, 3, 4, 5, 6]:
+    if i > 4:
+        check(i)
+        total = total + 100
+    total = total + check(i)
+total'''
+        self._assertSameResult(src, 1 + 2 + 4 + 100 + 5)
+
+    def test_local_bound_in_loop(self):
+        # a local a loop may leave unbound has no enclosing name to start from
+        src = '''let f(n):
+    i = 0
+    while i < n:
+        t = i * 2
+        i = i + 1
+    return t
+f(3)'''
+        self._assertSameResult(src, 4)
+
+    def test_when(self):
+        src = '''let name(n):
+    when n:
+        is 1:
+            'one'
+        is 2:
+            'two'
+        else:
+            'many'
+name(1) + name(2) + name(3)'''
+        self._assertSameResult(src, 'onetwomany')
+
+    def test_builtins(self):
+        self._assertSameResult('size([1, 2, 3]) + sum([4, 5])', 12)
@@ -0,0 +1,166 @@
+import unittest
+
+from Cup import Bytecode, Interpreter, VM
+
+
+class VMTest(unittest.TestCase):
+
+    def _assertSameResult(self, s, expected):
+        self.assertEqual(Interpreter.evaluate(s), expected)
+        self.assertEqual(VM.evaluate(s), expected)
+
+    def test_function(self):
+        src = '''let fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+fib(15)'''
+        self._assertSameResult(src, 610)
+
+    def test_loops(self):
+        src = '''total = 0
+i = 0
+while i < 10:
+    i = i + 1
+    total = total + i
+else:
+    total = total * 2
+for x in [1, 2, 3]:
+    total = total + x
+    quit
+while false:
+    quit
+total'''
+        self._assertSameResult(src, 111)
+
+    def test_when(self):
+        src = '''let name(n):
+    when n:
+        is 1:
+            'one'
+        else:
+            'many'
+name(1) + name(2)'''
+        self._assertSameResult(src, 'onemany')
+
+    def test_do(self):
+        src = '''y = 0
+do:
+    x = 1 \\ 0
+unless 1:
+    y = 2
+last:
+    y + 1'''
+        self._assertSameResult(src, 3)
+
+    def test_serialize(self):
+        program = Interpreter.parse('let twice(x):\n    x * 2\ntwice(21)')
+        code = Bytecode.loads(Bytecode.dumps(Bytecode.compile_program(program)))
+        self.assertEqual(VM.run(code, Interpreter.create_global_env()), 42)
+        self.assertIn('Disassembly of twice(x):', Bytecode.disassemble(code))
+        program = Interpreter.parse('let scale(x, by = 3):\n    y = x * by\n    y\nscale(2) + scale(1, 1)')
+        code = Bytecode.loads(Bytecode.dumps(Bytecode.compile_program(program)))
+        self.assertEqual(VM.run(code, Interpreter.create_global_env()), 7)
+        program = Interpreter.parse('let upto(n):\n    for i in [1;n]:\n        throw i\nsum(upto(4))')
+        code = Bytecode.loads(Bytecode.dumps(Bytecode.compile_program(program)))
+        self.assertEqual(VM.run(code, Interpreter.create_global_env()), 10)
+
+    def test_deep_recursion(self):
+        src = '''let depth(n):
+    if n == 0:
+        return 0
+    return 1 + depth(n - 1)
+depth(20000)'''
+        self.assertEqual(VM.evaluate(src), 20000)
+
+    def test_unwind_to_caller(self):
+        src = '''let fail(n):
+    if n == 0:
+        return 1 \\ 0
+    return fail(n - 1)
+y = 0
+do:
+    fail(50)
+unless 1:
+    y = 1
+y'''
+        self._assertSameResult(src, 1)
+        self.assertEqual(VM.evaluate(src, tail_calls=True), 1)
+
+    def test_skip_to_caller(self):
+        # a skip leaving a call stops the innermost block around the call
+        src = '''let check(n):
+    when n % 3:
+        is 0:
+            skip
+    n
+let outer(n):
+    return check(n)
+total = 0
+for i in [1, 2, 3, 4, 5, 6]:
+    if i > 4:
+        total = total + 100 * outer(i)
+    i = i + [0, check(i)][1]
+    total = total + i
+while total < 0:
+    total = 0
+else:
+    check(3)
+    total = 0
+total'''
+        self._assertSameResult(src, 524)
+        self.assertEqual(VM.evaluate(src, tail_calls=True), 524)
+        code = Bytecode.loads(Bytecode.dumps(Bytecode.compile_program(Interpreter.parse(src))))
+        self.assertEqual(VM.run(code, Interpreter.create_global_env()), 524)
+
+    def test_last_block(self):
+        # a return, an error or a skip leaving do or unless runs the last block first
+        src = '''log = []
+let f(k):
+    do:
+        if k > 0:
+            return f(k - 1)
+        1 / 0
+    unless true:
+        return 'caught'
+    last:
+        add(k, log)
+    'after'
+let g():
+    do:
+        1 / 0
+    unless true:
+        1 / 0
+    last:
+        add('last', log)
+let check(n):
+    skip
+for i in [1, 2]:
+    do:
+        do:
+            g()
+        unless true:
+            check(i)
+        last:
+            add(i, log)
+    unless true:
+        add('error', log)
+[f(2), log]'''
+        expected = ['caught', ['last', 1, 'error', 'last', 2, 'error', 0, 1, 2]]
+        self.assertEqual(VM.evaluate(src), expected)
+        self.assertEqual(VM.evaluate(src, tail_calls=True), expected)
+        code = Bytecode.loads(Bytecode.dumps(Bytecode.compile_program(Interpreter.parse(src))))
+        self.assertEqual(VM.run(code, Interpreter.create_global_env()), expected)
+
+    def test_tail_calls(self):
+        src = '''let count(n, total):
+    if n == 0:
+        return total
+    return count(n - 1, total + n)
+let sum(n):
+    count(n, 0)
+sum(50000)'''
+        code = Bytecode.compile_program(Interpreter.parse(src), tail_calls=True)
+        self.assertIn('TAIL_CALL', Bytecode.disassemble(code))
+        self.assertNotIn('TAIL_CALL', Bytecode.disassemble(Bytecode.compile_program(Interpreter.parse(src))))
+        self.assertEqual(VM.evaluate(src, tail_calls=True), 1250025000)